@@ -0,0 +1,36 @@
+"""Gunicorn settings for production
+gunicorn -c gunicorn.conf.py runduck:app
+
+Each worker process has its own redis pool, in memory caches and invalidation
+listener (see runduck/invalidation.py), so the app is loaded after the fork.
+Metrics are kept per process too, /metrics only shows the worker that
+answered the request.
+
+Workers are not recycled with max_requests: a combine started with
+POST /api/jobs/combine runs in a thread of the worker, and it would be
+killed with the worker, leaving the task "running" until it expires.
+"""
+import os
+import multiprocessing
+
+bind = (
+    f"{os.environ.get('SERVER_HOST', '0.0.0.0')}:"
+    f"{os.environ.get('SERVER_PORT', '3825')}"
+)
+workers = int(
+    os.environ.get("GUNICORN_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 8))
+)
+# requests wait on redis and rundeck, threads share the caches of the worker
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+keepalive = 5
+preload_app = False
+accesslog = "-"
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    from runduck.invalidation import start_listener
+
+    start_listener()
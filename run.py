@@ -1,6 +1,7 @@
 """Start runduck app"""
 import os
 from runduck import app
+from runduck.invalidation import start_listener
 
 if __name__ == "__main__":
     HOST = os.environ.get("SERVER_HOST", "localhost")
@@ -8,4 +9,5 @@ if __name__ == "__main__":
         PORT = int(os.environ.get("SERVER_PORT", "3825"))
     except ValueError:
         PORT = 3825
+    start_listener()
     app.run(host=HOST, port=PORT, threaded=True)
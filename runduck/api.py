@@ -1,5 +1,7 @@
 """API routes"""
 import os
+from datetime import datetime
+from datetime import timedelta
 from flask import json
 from flask import jsonify
 from flask_cors import CORS
@@ -11,16 +13,40 @@ from cron_descriptor import get_description
 from runduck import app
 from runduck.datainteraction import DataSource
 from runduck.datainteraction import DataInteraction
+from runduck.datainteraction import get_redis_pool_stats
 from runduck.jobinfo import read_environment
 from runduck.jobinfo import get_job_details
-from runduck.jobinfo import combine_data
-from runduck.jobinfo import get_last_execution
+from runduck.jobinfo import refresh_job_details
+from runduck.executions import get_execution_summary
+from runduck.jobdiff import get_job_diff
+from runduck.searchindex import search_jobs
 from runduck.jobinfo import get_jobs
+from runduck.jobinfo import get_first_next_execution
+from runduck.localcache import get_combined_meta
+from runduck.combinetask import CombineRunningError
+from runduck.combinetask import start_combine
+from runduck.combinetask import get_task_status
+from runduck.responsecache import CachedResponse
+from runduck.responsecache import response_cache
+from runduck.responsecache import make_etag
+from runduck.responsecache import make_response
+from runduck.schedule import get_upcoming_executions
+from runduck import profiler
+from runduck.profiler import profile_request
 
 
+DEFAULT_PAGE_SIZE = 100
+
 cors = CORS(app, resources={r"/api/*": {"origins": "http://localhost:3000"}})
 
-api = Api(app, version="1.0", doc="/api/doc", prefix="/api", validate=False)
+api = Api(
+    app,
+    version="1.0",
+    doc="/api/doc",
+    prefix="/api",
+    validate=False,
+    decorators=[profile_request],
+)
 
 parser = reqparse.RequestParser()
 parser.add_argument(
@@ -31,6 +57,113 @@ parser.add_argument(
     help="Skip cache and force getting data from source",
 )
 
+combine_parser = parser.copy()
+combine_parser.add_argument(
+    "delta",
+    location="args",
+    default=False,
+    type=inputs.boolean,
+    help="Read job lists and metadata from source, but definitions only for jobs that changed",
+)
+
+jobs_parser = parser.copy()
+jobs_parser.add_argument("env", location="args", help="Only jobs of this environment")
+jobs_parser.add_argument("project", location="args", help="Only jobs of this project")
+jobs_parser.add_argument("group", location="args", help="Only jobs of this group")
+jobs_parser.add_argument(
+    "parent", location="args", help="Only jobs linked to this parent job id"
+)
+jobs_parser.add_argument(
+    "q", location="args", help="Search words in the job name and description"
+)
+jobs_parser.add_argument(
+    "enabled",
+    location="args",
+    type=inputs.boolean,
+    help="Only jobs with schedule and execution enabled (true) or not (false)",
+)
+jobs_parser.add_argument(
+    "offset", location="args", default=0, type=inputs.natural, help="Jobs to skip"
+)
+jobs_parser.add_argument(
+    "page", location="args", type=inputs.positive, help="Page number, starts at 1"
+)
+jobs_parser.add_argument(
+    "limit", location="args", type=inputs.positive, help="Maximum number of jobs"
+)
+jobs_parser.add_argument(
+    "cursor", location="args", help="Continue after the page that returned this cursor"
+)
+profile_parser = reqparse.RequestParser()
+profile_parser.add_argument(
+    "top",
+    location="args",
+    default=30,
+    type=inputs.positive,
+    help="Number of functions",
+)
+profile_parser.add_argument(
+    "sort",
+    location="args",
+    default="cumulative",
+    choices=profiler.SORT_KEYS,
+    help="Sort functions by cumulative time, own time (tottime) or calls",
+)
+
+schedule_parser = reqparse.RequestParser()
+schedule_parser.add_argument(
+    "from",
+    location="args",
+    type=inputs.datetime_from_iso8601,
+    help="Start of the time window (ISO date), defaults to now",
+)
+schedule_parser.add_argument(
+    "to",
+    location="args",
+    type=inputs.datetime_from_iso8601,
+    help="End of the time window (ISO date), defaults to 24 hours after from",
+)
+schedule_parser.add_argument(
+    "env", location="args", help="Only jobs of this environment"
+)
+schedule_parser.add_argument(
+    "limit",
+    location="args",
+    default=1000,
+    type=inputs.positive,
+    help="Maximum number of executions",
+)
+
+search_parser = reqparse.RequestParser()
+search_parser.add_argument(
+    "q",
+    location="args",
+    required=True,
+    help="Words in the name, group, description, options or workflow commands",
+)
+search_parser.add_argument("env", location="args", help="Only jobs of this environment")
+search_parser.add_argument(
+    "limit",
+    location="args",
+    default=50,
+    type=inputs.positive,
+    help="Maximum number of jobs",
+)
+
+
+def to_local_time(date):
+    """Next executions are calculated in local time without timezone"""
+    if date is not None and date.tzinfo is not None:
+        return date.astimezone().replace(tzinfo=None)
+    return date
+
+
+def parse_updated(updated):
+    """Parse the timestamp set by DataInteraction.set_redis"""
+    if not updated:
+        return None
+    return datetime.strptime(updated, "%Y-%m-%dT%H:%M:%S%z")
+
 
 @api.errorhandler
 def default_error_handler(error):
@@ -39,31 +172,109 @@ def default_error_handler(error):
 
 @api.route("/jobs")
 class Jobs(Resource):
-    @api.expect(parser)
+    @api.expect(jobs_parser)
     def get(self):
         """
         List all jobs from all environments
         """
-        args = parser.parse_args()
+        args = jobs_parser.parse_args()
+        limit = args.get("limit")
+        offset = args.get("offset") or 0
+        if args.get("page"):
+            limit = limit or DEFAULT_PAGE_SIZE
+            offset += (args["page"] - 1) * limit
         force_refresh = args.get("force_refresh", False)
-        data = get_jobs(force_refresh=force_refresh)
-        return jsonify(data)
+        meta = get_combined_meta()
+        # same data and same arguments get the same response
+        cache_key = (
+            meta.get("version"),
+            tuple(
+                sorted((key, value) for key, value in args.items() if value is not None)
+            ),
+        )
+        entry = None if force_refresh else response_cache.get(cache_key)
+        if entry is not None:
+            return make_response(entry)
+
+        try:
+            data = get_jobs(
+                force_refresh=force_refresh,
+                env=args.get("env"),
+                project=args.get("project"),
+                group=args.get("group"),
+                parent=args.get("parent"),
+                q=args.get("q"),
+                enabled=args.get("enabled"),
+                offset=offset,
+                limit=limit,
+                cursor=args.get("cursor"),
+            )
+        except ValueError as ex:
+            return {"message": str(ex)}, 400
+
+        expires = get_first_next_execution(data["data"] or [])
+        entry = CachedResponse(
+            jsonify(data).get_data(),
+            etag=make_etag(cache_key, expires),
+            last_modified=parse_updated(meta.get("updated")),
+            expires=expires,
+        )
+        if not force_refresh:
+            response_cache.set(cache_key, entry)
+        return make_response(entry)
 
 
 @api.route("/jobs/combine")
 class JobsCombine(Resource):
     """Recombine all the data for the Jobs API from the raw data"""
 
-    @api.expect(parser)
+    @api.expect(combine_parser)
     def post(self):
         """Prepare all the data for the APIs
         This takes a few seconds if the raw data is already cached, it will
-        take several minutes if the data is being refreshed from the source
+        take several minutes if the data is being refreshed from the source.
+        The data is combined in the background, follow the progress with the
+        status URL that is returned
         """
-        args = parser.parse_args()
+        args = combine_parser.parse_args()
         force_refresh = args.get("force_refresh", False)
-        combine_data(force_refresh=force_refresh)
-        return jsonify({"message": "Data successfully combined"})
+        try:
+            task_id = start_combine(
+                force_refresh=force_refresh, delta=args.get("delta", False)
+            )
+        except CombineRunningError as ex:
+            return {"message": str(ex), "task_id": ex.task_id}, 409
+
+        status_url = api.url_for(JobsCombineStatus, task_id=task_id)
+        return (
+            {
+                "message": "Combine started",
+                "task_id": task_id,
+                "status_url": status_url,
+            },
+            202,
+            {"Location": status_url},
+        )
+
+    def get(self):
+        """Status of the combine that is running, or the last one that ran"""
+        status = get_task_status()
+        if status is None:
+            return {"message": "No combine has run"}, 404
+        return status
+
+
+@api.route("/jobs/combine/<string:task_id>")
+class JobsCombineStatus(Resource):
+    def get(self, task_id):
+        """
+        Progress of a combine: environments done, projects and jobs read,
+        errors and estimated seconds until all the projects are read
+        """
+        status = get_task_status(task_id)
+        if status is None:
+            return {"message": f"Combine {task_id} not found"}, 404
+        return status
 
 
 @api.route("/job/<string:env>/<string:jobid>")
@@ -77,17 +288,119 @@ class Job(Resource):
         """
         args = parser.parse_args()
         force_refresh = args.get("force_refresh", False)
-        data = get_job_details(env=env, job_id=jobid, force_refresh=force_refresh)
+        if force_refresh:
+            # also updates the job in the combined data
+            data = refresh_job_details(env=env, job_id=jobid)
+        else:
+            data = get_job_details(env=env, job_id=jobid)
         return jsonify(data)
 
 
+@api.route("/job/<string:env>/<string:jobid>/diff")
+class JobDiff(Resource):
+    def get(self, env, jobid):
+        """
+        Get the differences of the job with its parent job.
+
+        Compares the schedule, options, workflow steps, node filters and enabled
+        flags. Calculated when the data is combined, children lists the jobs
+        linked to this one
+        """
+        diff = get_job_diff(env=env, job_id=jobid)
+        if diff is None:
+            return {"message": f"Diff of {env}.{jobid} not found"}, 404
+        return diff
+
+
 @api.route("/job/<string:env>/<string:jobid>/execution")
 class JobExecution(Resource):
+    @api.expect(parser)
     def get(self, env, jobid):
         """
         Get details of the last time the job was executed.
-        
-        This API aways gets data from the source
+
+        Includes stats of the recent executions: duration p50/p95, failure
+        rate and last success. New executions are read from the source when
+        the cached ones are older than EXECUTION_CACHE_TTL seconds
+        """
+        args = parser.parse_args()
+        return get_execution_summary(
+            env=env, job_id=jobid, force_refresh=args.get("force_refresh", False)
+        )
+
+
+@api.route("/schedule")
+class Schedule(Resource):
+    @api.expect(schedule_parser)
+    def get(self):
+        """
+        List upcoming executions of all jobs in a time window, in order of time
+        """
+        args = schedule_parser.parse_args()
+        from_date = to_local_time(args.get("from")) or datetime.now()
+        to_date = to_local_time(args.get("to")) or from_date + timedelta(hours=24)
+        max_hours = app.config.get("SCHEDULE_MAX_HOURS", 168)
+        if to_date - from_date > timedelta(hours=max_hours):
+            return {"message": f"The time window can't be over {max_hours} hours"}, 400
+
+        data = get_upcoming_executions(
+            from_date=from_date,
+            to_date=to_date,
+            env=args.get("env"),
+            limit=args.get("limit"),
+        )
+        return jsonify(
+            {"from": from_date.isoformat(), "to": to_date.isoformat(), "data": data}
+        )
+
+
+@api.route("/search")
+class Search(Resource):
+    @api.expect(search_parser)
+    def get(self):
+        """
+        Search jobs by the words in their definition, best matches first
+
+        Jobs must have all the words, in the name, group, description, options
+        or workflow commands. matches lists where they were found
+        """
+        args = search_parser.parse_args()
+        return search_jobs(args["q"], env=args.get("env"), limit=args.get("limit"))
+
+
+@api.route("/redis/pool")
+class RedisPool(Resource):
+    def get(self):
+        """
+        Connections of the shared redis pool, in use and idle
+        """
+        return get_redis_pool_stats()
+
+
+@api.route("/profiles")
+class Profiles(Resource):
+    def get(self):
+        """
+        List the saved request profiles, newest first
+
+        Set PROFILING_ENABLED in app.cfg and send the header X-Runduck-Profile: 1
+        (or profile=true) with a request to profile it
+        """
+        if not profiler.is_enabled():
+            return {"message": "Profiling is not enabled"}, 404
+        return {"data": profiler.list_profiles()}
+
+
+@api.route("/profiles/<string:profile_id>")
+class Profile(Resource):
+    @api.expect(profile_parser)
+    def get(self, profile_id):
+        """
+        Functions that took the most time in a profiled request
         """
-        data = get_last_execution(env=env, job_id=jobid, force_refresh=True)
-        return data
+        if not profiler.is_enabled():
+            return {"message": "Profiling is not enabled"}, 404
+        args = profile_parser.parse_args()
+        return profiler.get_top_functions(
+            profile_id, top=args.get("top"), sort=args.get("sort")
+        )
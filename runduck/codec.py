@@ -0,0 +1,135 @@
+"""Serialize values stored in the redis cache
+
+Values are stored with a small header: MAGIC, one byte for the format and one
+byte for the compression, so the settings can change without breaking what is
+already cached. Values without the header were written with jsonpickle and are
+still decoded with it.
+
+Settings in app.cfg:
+    CACHE_CODEC: "json", "orjson" or "msgpack", defaults to orjson if installed
+    CACHE_COMPRESSION: None, "zlib" or "zstd", defaults to None
+    CACHE_COMPRESS_THRESHOLD: compress only values larger than this (bytes)
+"""
+import json
+import zlib
+import jsonpickle
+from runduck import app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"\x00rd"
+HEADER_SIZE = len(MAGIC) + 2
+
+FORMATS = {"json": b"j", "orjson": b"o", "msgpack": b"m"}
+COMPRESSIONS = {None: b"-", "zlib": b"z", "zstd": b"s"}
+FORMAT_NAMES = {value: name for name, value in FORMATS.items()}
+COMPRESSION_NAMES = {value: name for name, value in COMPRESSIONS.items()}
+
+
+def get_codec():
+    """Name of the format used to encode new values"""
+    codec = app.config.get("CACHE_CODEC")
+    if codec:
+        return codec
+    return "orjson" if orjson else "json"
+
+
+def dumps(value, codec):
+    """Serialize value to bytes in one of the FORMATS"""
+    if codec in ("orjson", "msgpack") and not globals()[codec]:
+        raise ValueError(f"{codec} is not installed")
+    if codec == "orjson":
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    if codec == "msgpack":
+        return msgpack.packb(value, use_bin_type=True, default=str)
+    if codec == "json":
+        return json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+    raise ValueError(f"{codec} is not a valid cache codec")
+
+
+def loads(data, codec):
+    """Deserialize bytes in one of the FORMATS"""
+    if codec == "orjson":
+        # values written by orjson are plain json
+        return orjson.loads(data) if orjson else json.loads(data)
+    if codec == "msgpack":
+        if not msgpack:
+            raise ValueError("msgpack is needed to read this value")
+        return msgpack.unpackb(data, raw=False)
+    if codec == "json":
+        return orjson.loads(data) if orjson else json.loads(data)
+    raise ValueError(f"{codec} is not a valid cache codec")
+
+
+def compress(data, compression):
+    """Compress bytes with one of the COMPRESSIONS"""
+    if compression == "zlib":
+        return zlib.compress(data, 1)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress(data, compression):
+    """Decompress bytes with one of the COMPRESSIONS"""
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "zstd":
+        if not zstandard:
+            raise ValueError("zstandard is needed to read this value")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def encode(value, codec=None, compression=None, threshold=None):
+    """Encode a value for the cache
+
+    :param value: Value to encode (dict, list or other json compatible types)
+    :param codec: One of FORMATS, defaults to get_codec()
+    :param compression: One of COMPRESSIONS, defaults to CACHE_COMPRESSION
+    :param threshold: Minimum size to compress, defaults to CACHE_COMPRESS_THRESHOLD
+    :return: encoded value with header
+    :rtype: bytes
+    """
+    codec = codec or get_codec()
+    if compression is None:
+        compression = app.config.get("CACHE_COMPRESSION")
+    if compression == "zstd" and not zstandard:
+        compression = "zlib"
+    if threshold is None:
+        threshold = app.config.get("CACHE_COMPRESS_THRESHOLD", 16384)
+
+    data = dumps(value, codec)
+    if len(data) < threshold:
+        compression = None
+    return (
+        MAGIC + FORMATS[codec] + COMPRESSIONS[compression] + compress(data, compression)
+    )
+
+
+def decode(raw):
+    """Decode a value from the cache, written by encode or by jsonpickle"""
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if not raw.startswith(MAGIC):
+        return jsonpickle.decode(raw)
+
+    header = raw[len(MAGIC) : HEADER_SIZE]
+    if header[:1] not in FORMAT_NAMES or header[1:] not in COMPRESSION_NAMES:
+        raise ValueError(f"{header} is not a valid cache header")
+    codec = FORMAT_NAMES[header[:1]]
+    compression = COMPRESSION_NAMES[header[1:]]
+    return loads(decompress(raw[HEADER_SIZE:], compression), codec)
@@ -0,0 +1,28 @@
+"""Lock of the combined data, across all the processes
+
+A combine holds it while it runs (see combinetask.py), and update_combined
+while it patches the combined data, so they don't overwrite each other's
+changes.
+"""
+from runduck import app
+from runduck.datainteraction import DataInteraction
+
+LOCK_KEY = "runduck:combine:lock"
+
+
+class CombineLockedError(Exception):
+    """The lock wasn't released in time"""
+
+    code = 409
+
+    def __init__(self):
+        super().__init__("The combined data is being updated, try again later")
+
+
+def get_combine_lock(interaction=None):
+    """Lock that expires after COMBINE_LOCK_TIMEOUT seconds if it's not renewed,
+    it can be released by another thread than the one that acquired it
+    """
+    interaction = interaction or DataInteraction()
+    timeout = int(app.config.get("COMBINE_LOCK_TIMEOUT", 60))
+    return interaction.redis.lock(LOCK_KEY, timeout=timeout, thread_local=False)
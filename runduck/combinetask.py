@@ -0,0 +1,246 @@
+"""Run the combine in the background and report its progress
+
+Only one combine runs at a time, across all the processes, with a lock in
+redis. The progress of each task is saved in redis so it can be read from any
+process until TASK_TTL seconds after it was last updated.
+"""
+import json
+import time
+import uuid
+import threading
+from datetime import datetime
+from redis.exceptions import LockError
+from runduck import app
+from runduck.datainteraction import DataInteraction
+from runduck.jobinfo import combine_data
+from runduck.combinelock import get_combine_lock
+
+# id of the task that is running, or the last one that ran
+CURRENT_KEY = "runduck:combine:current"
+TASK_KEY = "runduck:combine:task:{task_id}"
+TASK_TTL = 86400
+# seconds between saves of the counters while reading projects
+SAVE_INTERVAL = 1
+
+
+class CombineRunningError(Exception):
+    """Another combine is running"""
+
+    def __init__(self, task_id):
+        super().__init__(f"Combine {task_id} is already running")
+        self.task_id = task_id
+
+
+class CombineProgress(object):
+    """Counters of a combine task, updated from the environment threads"""
+
+    def __init__(self, task_id, environments, interaction=None):
+        self.redis = (interaction or DataInteraction()).redis
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.saved_time = 0
+        self.status = {
+            "id": task_id,
+            "state": "running",
+            "phase": "reading",
+            "started": datetime.now().isoformat(),
+            "finished": None,
+            "environments": {
+                env: {
+                    "state": "pending",
+                    "projects": None,
+                    "projects_done": 0,
+                    "jobs": 0,
+                    # previously combined jobs kept if the environment failed
+                    "jobs_kept": 0,
+                }
+                for env in environments
+            },
+            "errors": [],
+        }
+
+    @property
+    def task_id(self):
+        return self.status["id"]
+
+    def start_environment(self, env, projects):
+        with self.lock:
+            self.status["environments"][env].update(state="reading", projects=projects)
+        self.save()
+
+    def project_done(self, env, jobs):
+        with self.lock:
+            counters = self.status["environments"][env]
+            counters["projects_done"] += 1
+            counters["jobs"] += jobs
+        self.save(force=False)
+
+    def environment_done(self, env):
+        with self.lock:
+            self.status["environments"][env]["state"] = "done"
+        self.save()
+
+    def environment_failed(self, env, error):
+        with self.lock:
+            self.status["environments"][env]["state"] = "failed"
+            self.status["errors"].append(f"[{env}] {error}")
+        self.save()
+
+    def environment_kept(self, env, jobs):
+        with self.lock:
+            self.status["environments"][env]["jobs_kept"] = jobs
+        self.save()
+
+    def set_phase(self, phase):
+        with self.lock:
+            self.status["phase"] = phase
+        self.save()
+
+    def finish(self, error=None):
+        with self.lock:
+            self.status["state"] = "failed" if error else "done"
+            self.status["phase"] = None
+            self.status["finished"] = datetime.now().isoformat()
+            if error:
+                self.status["errors"].append(f"{error}")
+        self.save()
+
+    def get_eta(self):
+        """Seconds until all the projects are read, from the speed so far
+        None until all the environments know their number of projects
+        """
+        environments = self.status["environments"].values()
+        reading = [
+            counters for counters in environments if counters["state"] != "failed"
+        ]
+        if any(counters["projects"] is None for counters in reading):
+            return None
+        total = sum(counters["projects"] for counters in reading)
+        done = sum(counters["projects_done"] for counters in reading)
+        if done >= total:
+            return 0
+        if not done:
+            return None
+        elapsed = time.time() - self.start_time
+        return round(elapsed * (total - done) / done, 1)
+
+    def get_status(self):
+        """Status with the totals of all the environments"""
+        with self.lock:
+            status = json.loads(json.dumps(self.status))
+        environments = status["environments"].values()
+        status["environments_done"] = sum(
+            counters["state"] in ("done", "failed") for counters in environments
+        )
+        status["projects_done"] = sum(
+            counters["projects_done"] for counters in environments
+        )
+        status["jobs_processed"] = sum(counters["jobs"] for counters in environments)
+        status["elapsed_seconds"] = round(time.time() - self.start_time, 1)
+        status["eta_seconds"] = self.get_eta() if status["state"] == "running" else None
+        return status
+
+    def save(self, force=True):
+        """Save the status in redis, at most every SAVE_INTERVAL unless forced"""
+        now = time.time()
+        if not force and now - self.saved_time < SAVE_INTERVAL:
+            return
+        self.saved_time = now
+        self.redis.set(
+            TASK_KEY.format(task_id=self.task_id),
+            json.dumps(self.get_status()),
+            ex=TASK_TTL,
+        )
+
+
+def get_task_status(task_id=None, interaction=None):
+    """Status of a combine task, the current or last one if task_id is None
+    Returns None if the task is not known"""
+    redis = (interaction or DataInteraction()).redis
+    if task_id is None:
+        task_id = redis.get(CURRENT_KEY)
+        if task_id is None:
+            return None
+        task_id = task_id.decode("utf-8")
+    status = redis.get(TASK_KEY.format(task_id=task_id))
+    return json.loads(status) if status else None
+
+
+def get_running_task_id(interaction=None):
+    status = get_task_status(interaction=interaction)
+    if status and status["state"] == "running":
+        return status["id"]
+    return None
+
+
+def start_combine(force_refresh=False, cache_only=False, wait=False, delta=False):
+    """Combine the data in a background thread
+
+    :param force_refresh: Read everything from the live data source
+    :param cache_only: Only use data that is already cached
+    :param delta: Only read definitions of jobs that changed, see read_environment
+    :param wait: Wait for the running combine to finish, and run in this thread
+    :return: id of the task
+    :raises CombineRunningError: if another combine is running and wait is False
+    """
+    interaction = DataInteraction()
+    # the lock is released by the thread that runs the combine
+    lock = get_combine_lock(interaction)
+    if not lock.acquire(blocking=wait):
+        raise CombineRunningError(get_running_task_id(interaction))
+
+    progress = CombineProgress(
+        uuid.uuid4().hex, list(app.config["ENV"]), interaction=interaction
+    )
+    progress.save()
+    interaction.redis.set(CURRENT_KEY, progress.task_id, ex=TASK_TTL)
+
+    if wait:
+        run_combine(progress, lock, force_refresh, cache_only, delta)
+    else:
+        threading.Thread(
+            target=run_combine,
+            args=(progress, lock, force_refresh, cache_only, delta),
+            name=f"runduck-combine-{progress.task_id}",
+            daemon=True,
+        ).start()
+    return progress.task_id
+
+
+def run_combine(progress, lock, force_refresh=False, cache_only=False, delta=False):
+    """Combine the data while holding the lock
+    The lock expires if the process dies, it's renewed while the combine runs
+    """
+    done = threading.Event()
+
+    def renew_lock():
+        while not done.wait(lock.timeout / 3):
+            try:
+                lock.reacquire()
+            except LockError:
+                app.logger.warning(f"Combine lock lost by {progress.task_id}")
+                return
+
+    renew_thread = threading.Thread(
+        target=renew_lock, name="runduck-combine-lock", daemon=True
+    )
+    renew_thread.start()
+    try:
+        combine_data(
+            force_refresh=force_refresh,
+            cache_only=cache_only,
+            progress=progress,
+            delta=delta,
+        )
+    except Exception as ex:
+        app.logger.exception(f"Combine {progress.task_id} failed")
+        progress.finish(error=ex)
+    else:
+        progress.finish()
+    finally:
+        done.set()
+        renew_thread.join()
+        try:
+            lock.release()
+        except LockError:
+            app.logger.warning(f"Combine lock expired before {progress.task_id} ended")
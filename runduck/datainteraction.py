@@ -1,14 +1,30 @@
 """Read data from Redis, or sample file, or API"""
 import os
 import json
+import threading
 import yaml
 import redis
 import requests
-import jsonpickle
 import pytz
 from datetime import datetime
 from enum import Enum
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import HTTPError as Urllib3Error
 from runduck import app
+from runduck import codec
+from runduck import metrics
+from runduck.yamlparser import load as load_yaml
+from runduck.yamlparser import iter_yaml_sequence
+
+# Status codes from rundeck that are worth retrying
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+_redis_pool = None
+_redis_pool_lock = threading.Lock()
 
 
 class DataSource(Enum):
@@ -25,6 +41,131 @@ def get_now_str():
     return f"{now_utc:%Y-%m-%dT%H:%M:%S%z}"
 
 
+class RundeckApiError(Exception):
+    """Rundeck API returned an error or a response that can't be parsed"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+        # used by the API error handler
+        self.code = 404 if status_code == 404 else 502
+
+
+class RundeckConnectionError(RundeckApiError):
+    """Rundeck API could not be reached or didn't answer in time"""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.code = 504
+
+
+def get_env_setting(env, name, default=None):
+    """Get a setting for one environment
+    Settings in the ENV configuration (lowercase) override the global ones
+    (uppercase), for example max_workers for one rundeck overrides MAX_WORKERS
+    """
+    env_config = app.config["ENV"].get(env, {})
+    return env_config.get(name.lower(), app.config.get(name, default))
+
+
+def get_session(env):
+    """Get the HTTP session for an environment, sessions are shared between
+    threads so connections are kept alive and reused"""
+    with _sessions_lock:
+        session = _sessions.get(env)
+        if session is None:
+            session = create_session(env)
+            _sessions[env] = session
+        return session
+
+
+def create_session(env):
+    """Create an HTTP session with a connection pool and retries"""
+    retry = Retry(
+        total=int(get_env_setting(env, "HTTP_RETRIES", 3)),
+        backoff_factor=float(get_env_setting(env, "HTTP_BACKOFF", 0.5)),
+        status_forcelist=RETRY_STATUS_CODES,
+        raise_on_status=False,
+    )
+    pool_size = max(
+        int(get_env_setting(env, "HTTP_POOL_SIZE", 10)),
+        int(get_env_setting(env, "MAX_WORKERS", 1)),
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class CountingConnectionPool(redis.BlockingConnectionPool):
+    """Blocking pool that keeps count of the connections it created and lent"""
+
+    def reset(self):
+        # also called after a fork, the connections of the parent are dropped
+        self.counts_lock = threading.Lock()
+        self.created = 0
+        self.lent = set()
+        super().reset()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        with self.counts_lock:
+            self.created += 1
+        return connection
+
+    def get_connection(self, command_name, *keys, **options):
+        connection = super().get_connection(command_name, *keys, **options)
+        with self.counts_lock:
+            self.lent.add(id(connection))
+        return connection
+
+    def release(self, connection):
+        with self.counts_lock:
+            self.lent.discard(id(connection))
+        super().release(connection)
+
+
+def get_redis_pool():
+    """Get the redis connection pool shared by the whole process
+    Created on first use with the REDIS_* settings from app.cfg
+    """
+    global _redis_pool
+    if _redis_pool is None:
+        with _redis_pool_lock:
+            if _redis_pool is None:
+                _redis_pool = CountingConnectionPool(
+                    host=app.config["REDIS_HOST"],
+                    port=app.config["REDIS_PORT"],
+                    db=app.config["REDIS_INDEX"],
+                    max_connections=app.config.get("REDIS_MAX_CONNECTIONS", 50),
+                    # seconds to wait for a free connection
+                    timeout=app.config.get("REDIS_POOL_TIMEOUT", 20),
+                    socket_timeout=app.config.get("REDIS_SOCKET_TIMEOUT", 30),
+                    socket_connect_timeout=app.config.get(
+                        "REDIS_SOCKET_CONNECT_TIMEOUT", 5
+                    ),
+                    health_check_interval=app.config.get(
+                        "REDIS_HEALTH_CHECK_INTERVAL", 30
+                    ),
+                )
+    return _redis_pool
+
+
+def get_redis_pool_stats():
+    """Count connections of the shared redis pool"""
+    pool = get_redis_pool()
+    with pool.counts_lock:
+        created = pool.created
+        in_use = len(pool.lent)
+    return {
+        "max_connections": pool.max_connections,
+        "created": created,
+        "in_use": in_use,
+        "idle": created - in_use,
+    }
+
+
 class DataInteraction(object):
     """Common object to read data from redis or from file system or API"""
 
@@ -49,6 +190,13 @@ class DataInteraction(object):
                     "field": "jobs",
                 },
             },
+            # all the job definitions of a project in one call, to be split in
+            # job.definition values (not cached as a whole)
+            "project.definitions": {
+                "format": "yaml",
+                DataSource.API: "/api/14/project/{project}/jobs/export",
+                DataSource.FILE_SYSTEM: "{env}.project.{project}.definitions.yaml",
+            },
             "job.metadata": {
                 "format": "json",
                 DataSource.API: "/api/18/job/{jobid}/info",
@@ -67,6 +215,22 @@ class DataInteraction(object):
                     "field": "definition",
                 },
             },
+            # hash of the job list entry and metadata when the definition was read
+            "job.fingerprint": {
+                "format": "json",
+                DataSource.REDIS: {
+                    "key": "runduck:{env}:jobs:{jobid}",
+                    "field": "fingerprint",
+                },
+            },
+            # differences with the linked jobs, see jobdiff.py (redis only)
+            "job.diff": {
+                "format": "json",
+                DataSource.REDIS: {
+                    "key": "runduck:{env}:jobs:{jobid}",
+                    "field": "diff",
+                },
+            },
             "job.executions": {
                 "format": "json",
                 DataSource.API: "/api/24/job/{jobid}/executions",
@@ -76,18 +240,38 @@ class DataInteraction(object):
                     "field": "executions",
                 },
             },
+            # recent executions and their stats, see executions.py (redis only)
+            "job.history": {
+                "format": "json",
+                DataSource.REDIS: {
+                    "key": "runduck:{env}:jobs:{jobid}",
+                    "field": "history",
+                },
+            },
             # This is where all the combined data for the API will be stored (redis only)
             "combined": {
                 "format": "json",
                 DataSource.REDIS: {"key": "runduck:all", "field": "combined"},
             },
+            # version and number of combined jobs, changes when combined is saved
+            "combined.meta": {
+                "format": "json",
+                DataSource.REDIS: {"key": "runduck:all", "field": "meta"},
+            },
+            # version and number of search documents, changes when they are
+            # saved, see searchindex.py
+            "search.meta": {
+                "format": "json",
+                DataSource.REDIS: {"key": "runduck:all", "field": "search.meta"},
+            },
+            # [id, content hash] of each combined job, in environment priority order
+            "combined.order": {
+                "format": "json",
+                DataSource.REDIS: {"key": "runduck:all", "field": "order"},
+            },
         }
 
-        self.pool = redis.ConnectionPool(
-            host=app.config["REDIS_HOST"],
-            port=app.config["REDIS_PORT"],
-            db=app.config["REDIS_INDEX"],
-        )
+        self.pool = get_redis_pool()
         self.redis = redis.StrictRedis(connection_pool=self.pool, decode_responses=True)
         self.live_data_source = live_data_source
         self.env = env
@@ -99,19 +283,23 @@ class DataInteraction(object):
         args.update({"env": self.env})
         return args
 
-    def get_filesystem(self, data_key, **args):
-        """Read data from sample json file"""
+    def get_filesystem_path(self, data_key, **args):
+        """Path of the sample file"""
         args = self.prepare_args(**args)
 
         base_path = os.path.dirname(os.path.abspath(__file__))
         file_name = self.CONFIG[data_key][DataSource.FILE_SYSTEM].format(**args)
-        file_path = f"{base_path}/sampledata/{file_name}"
+        return f"{base_path}/sampledata/{file_name}"
+
+    def get_filesystem(self, data_key, **args):
+        """Read data from sample json file"""
+        file_path = self.get_filesystem_path(data_key, **args)
         parsed_data = {}
         with open(file_path, "rb") as file_obj:
             if self.CONFIG[data_key]["format"] == "json":
                 parsed_data = json.load(file_obj)
             elif self.CONFIG[data_key]["format"] == "yaml":
-                parsed_data = yaml.safe_load(file_obj)
+                parsed_data = load_yaml(file_obj)
             else:
                 raise ValueError(
                     f"{self.CONFIG[data_key]['format']} is not a valid file format"
@@ -119,8 +307,8 @@ class DataInteraction(object):
             file_obj.close()
         return parsed_data
 
-    def get_api(self, data_key, **args):
-        """Call Rundeck API"""
+    def request_api(self, data_key, stream=False, **args):
+        """Call Rundeck API, returns the url and the response"""
         base_url = app.config["ENV"][self.env]["base_url"].strip("/")
 
         headers = {}
@@ -134,39 +322,133 @@ class DataInteraction(object):
             params["format"] = "yaml"
 
         url = f"{base_url}{self.CONFIG[data_key][DataSource.API]}".format(**params)
-        # print(url, params)
-        resp = requests.get(url, headers=headers, params=params)
-        # resp.raise_for_status()
-        if response_format == "json":
-            return resp.json()
-        else:
-            # print(str(resp.content))
-            return yaml.safe_load(resp.content)
+        # seconds, or (connect, read) timeouts
+        timeout = get_env_setting(self.env, "HTTP_TIMEOUT", (5, 60))
+        if isinstance(timeout, list):
+            timeout = tuple(timeout)
+        try:
+            with metrics.rundeck_request_seconds.time(
+                env=self.env, data_key=data_key, status="error"
+            ) as labels:
+                resp = get_session(self.env).get(
+                    url, headers=headers, params=params, timeout=timeout, stream=stream
+                )
+                labels["status"] = resp.status_code
+            resp.raise_for_status()
+        except requests.exceptions.HTTPError as ex:
+            raise RundeckApiError(
+                f"[{self.env}] {url} returned {ex.response.status_code}",
+                status_code=ex.response.status_code,
+            ) from ex
+        except requests.exceptions.RequestException as ex:
+            raise RundeckConnectionError(
+                f"[{self.env}] {url} failed: {type(ex).__name__}"
+            ) from ex
+        return url, resp
 
-    def get_redis(self, data_key, **args):
-        """Get data from redis data source"""
+    def get_api(self, data_key, **args):
+        """Call Rundeck API and parse the response"""
+        url, resp = self.request_api(data_key, **args)
+        response_format = self.CONFIG[data_key]["format"]
+        try:
+            if response_format == "json":
+                return resp.json()
+            return load_yaml(resp.content)
+        except (ValueError, yaml.YAMLError) as ex:
+            raise RundeckApiError(
+                f"[{self.env}] {url} returned an invalid {response_format} response",
+                status_code=resp.status_code,
+            ) from ex
+
+    def stream_api(self, data_key, **args):
+        """Call Rundeck API and parse the yaml list in the response while it's
+        being downloaded, one item at a time"""
+        url, resp = self.request_api(data_key, stream=True, **args)
+        # let urllib3 decompress gzip responses
+        resp.raw.decode_content = True
+        try:
+            yield from iter_yaml_sequence(resp.raw)
+        except yaml.YAMLError as ex:
+            raise RundeckApiError(
+                f"[{self.env}] {url} returned an invalid yaml response",
+                status_code=resp.status_code,
+            ) from ex
+        except (requests.exceptions.RequestException, Urllib3Error) as ex:
+            raise RundeckConnectionError(
+                f"[{self.env}] {url} failed: {type(ex).__name__}"
+            ) from ex
+        finally:
+            resp.close()
+
+    def get_redis_location(self, data_key, **args):
+        """Get the redis key and field where the data is stored"""
         args = self.prepare_args(**args)
         key = self.CONFIG[data_key][DataSource.REDIS]["key"].format(**args)
         field = self.CONFIG[data_key][DataSource.REDIS]["field"]
+        return key, field
+
+    def get_redis(self, data_key, **args):
+        """Get data from redis data source"""
+        key, field = self.get_redis_location(data_key, **args)
 
         raw_data = self.redis.hget(key, field)
+        metrics.observe_redis_read(data_key, [raw_data])
         if raw_data is None:
             return None
 
-        data = jsonpickle.decode(raw_data)
+        data = codec.decode(raw_data)
         return data
 
     def set_redis(self, data_key, value, **args):
         """Add value to redis cache"""
-        args = self.prepare_args(**args)
-        key = self.CONFIG[data_key][DataSource.REDIS]["key"].format(**args)
-        field = self.CONFIG[data_key][DataSource.REDIS]["field"]
+        key, field = self.get_redis_location(data_key, **args)
 
         # Append a timestamp if value is a dictionary
         if isinstance(value, dict):
             value["updated"] = get_now_str()
 
-        self.redis.hset(key, field, jsonpickle.encode(value))
+        raw_data = codec.encode(value)
+        self.redis.hset(key, field, raw_data)
+        metrics.observe_redis_write(data_key, [raw_data])
+
+    def get_many(self, data_key, args_list):
+        """Get several values of the same kind from redis in one round trip
+
+        :param data_key: Key in CONFIG
+        :param args_list: list of arguments for each value, e.g. [{"jobid": "..."}]
+        :return: values in the same order as args_list, None if not cached
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for args in args_list:
+            pipe.hget(*self.get_redis_location(data_key, **args))
+
+        raw_values = pipe.execute()
+        metrics.observe_redis_read(data_key, raw_values)
+        return [
+            None if raw_data is None else codec.decode(raw_data)
+            for raw_data in raw_values
+        ]
+
+    def set_many(self, data_key, values, args_list):
+        """Add several values of the same kind to redis in one round trip
+
+        :param data_key: Key in CONFIG
+        :param values: list of values to store, None values are not cached so
+            they are read again next time
+        :param args_list: list of arguments for each value, same order as values
+        """
+        now_str = get_now_str()
+        pipe = self.redis.pipeline(transaction=False)
+        raw_values = []
+        for value, args in zip(values, args_list):
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                value["updated"] = now_str
+            raw_values.append(codec.encode(value))
+            pipe.hset(*self.get_redis_location(data_key, **args), raw_values[-1])
+        pipe.execute()
+        metrics.observe_redis_write(data_key, raw_values)
 
     def clear_redis_pattern(self, pattern):
         """Clear all matching redis keys"""
@@ -181,10 +463,28 @@ class DataInteraction(object):
         print("\n", pattern)
         self.clear_redis_pattern(pattern)
 
+    def fetch_data(self, data_key, **args):
+        """Read data from the live data source, without caching it
+        Returns None if the data is not available from the source
+        """
+        if not self.CONFIG[data_key].get(self.live_data_source):
+            return None
+
+        if self.live_data_source == DataSource.FILE_SYSTEM:
+            return self.get_filesystem(data_key, **args)
+        return self.get_api(data_key, **args)
+
+    def iter_data(self, data_key, **args):
+        """Read a yaml list from the live data source one item at a time"""
+        if self.live_data_source == DataSource.FILE_SYSTEM:
+            with open(self.get_filesystem_path(data_key, **args), "rb") as file_obj:
+                yield from iter_yaml_sequence(file_obj)
+        else:
+            yield from self.stream_api(data_key, **args)
+
     def get_data(self, data_key, force_refresh=False, **args):
         """Get all the data under a key or call the source to get the data"""
         if not force_refresh:
-            source = str(DataSource.REDIS)
             data = self.get_redis(data_key, **args)
             if not data is None:
                 return {"source": DataSource.REDIS.value, "data": data}
@@ -194,11 +494,7 @@ class DataInteraction(object):
             # Data not available from the source
             return {"source": None, "data": None}
 
-        if self.live_data_source == DataSource.FILE_SYSTEM:
-            data = self.get_filesystem(data_key, **args)
-        else:
-            data = self.get_api(data_key, **args)
-
+        data = self.fetch_data(data_key, **args)
         self.set_redis(data_key, data, **args)
 
         return {"source": source.value, "data": data}
@@ -0,0 +1,168 @@
+"""Execution history of each job, read incrementally from rundeck
+
+The last EXECUTION_HISTORY_SIZE finished executions of a job are cached in
+one compact list: [id, status, start time (ms), duration (ms)], newest first,
+with the last execution and the duration stats. Rundeck is only asked for the
+executions newer than the last one seen, and not more than once every
+EXECUTION_CACHE_TTL seconds.
+"""
+import math
+import time
+from runduck import app
+from runduck.datainteraction import DataSource
+from runduck.datainteraction import DataInteraction
+from runduck.utils import format_duration
+from runduck.utils import get_object_property
+
+# positions in the compact executions
+ID, STATUS, STARTED, DURATION = range(4)
+
+
+def compact_execution(execution):
+    """[id, status, start time, duration] of a finished execution"""
+    started = get_object_property(execution, "date-started.unixtime")
+    ended = get_object_property(execution, "date-ended.unixtime")
+    duration = ended - started if started and ended else None
+    return [execution["id"], execution.get("status"), started, duration]
+
+
+def is_finished(execution):
+    return bool(get_object_property(execution, "date-ended.unixtime"))
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of a sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def get_stats(executions):
+    """Duration percentiles of succeeded executions, failure rate and last success
+
+    :param executions: compact executions, newest first
+    """
+    durations = sorted(
+        execution[DURATION]
+        for execution in executions
+        if execution[STATUS] == "succeeded" and execution[DURATION] is not None
+    )
+    failed = sum(execution[STATUS] != "succeeded" for execution in executions)
+    last_success = next(
+        (execution for execution in executions if execution[STATUS] == "succeeded"),
+        None,
+    )
+    p50 = percentile(durations, 50)
+    p95 = percentile(durations, 95)
+    return {
+        "count": len(executions),
+        "failure_rate": round(failed / len(executions), 4) if executions else None,
+        "duration_p50": p50,
+        "duration_p95": p95,
+        "duration_p50_text": format_duration(p50) if p50 is not None else None,
+        "duration_p95_text": format_duration(p95) if p95 is not None else None,
+        "last_success_id": last_success[ID] if last_success else None,
+        "last_success_started": last_success[STARTED] if last_success else None,
+    }
+
+
+def fetch_new_executions(interaction, job_id, last_id=None, max_count=None):
+    """Executions newer than last_id, newest first, a page at a time
+
+    :param last_id: stop at this execution, None to read up to max_count
+    :param max_count: maximum number of executions to read
+    """
+    page_size = int(app.config.get("EXECUTION_PAGE_SIZE", 50))
+    executions = []
+    offset = 0
+    while True:
+        response = interaction.fetch_data(
+            "job.executions", jobid=job_id, max=page_size, offset=offset
+        )
+        page = (response or {}).get("executions") or []
+        for execution in page:
+            if last_id is not None and execution["id"] <= last_id:
+                return executions
+            if executions and execution["id"] >= executions[-1]["id"]:
+                # newest first, the source didn't use the offset
+                return executions
+            executions.append(execution)
+            if max_count and len(executions) >= max_count:
+                return executions
+        total = get_object_property(response, "paging.total", 0)
+        offset += len(page)
+        if not page or offset >= total:
+            return executions
+
+
+def ingest_executions(env, job_id, live_data_source=DataSource.API):
+    """Read the new executions of a job and update the cached history"""
+    interaction = DataInteraction(live_data_source=live_data_source, env=env)
+    history_size = int(app.config.get("EXECUTION_HISTORY_SIZE", 200))
+    history = interaction.get_redis("job.history", jobid=job_id) or {}
+
+    new_executions = fetch_new_executions(
+        interaction, job_id, last_id=history.get("last_id"), max_count=history_size
+    )
+    running = [
+        execution["id"] for execution in new_executions if not is_finished(execution)
+    ]
+    # executions that are running are read again next time, when they are done
+    known = {execution[ID] for execution in history.get("executions", [])}
+    finished = [
+        compact_execution(execution)
+        for execution in new_executions
+        if is_finished(execution) and execution["id"] not in known
+    ]
+    executions = sorted(
+        finished + history.get("executions", []),
+        key=lambda execution: execution[ID],
+        reverse=True,
+    )[:history_size]
+
+    last_id = history.get("last_id")
+    if running:
+        last_id = min(running) - 1
+    elif new_executions:
+        last_id = new_executions[0]["id"]
+
+    last_execution = history.get("last")
+    if new_executions:
+        last_execution = new_executions[0]
+        duration = compact_execution(last_execution)[DURATION]
+        # finished executions without a start date have no duration
+        if is_finished(last_execution) and duration is not None:
+            last_execution["duration"] = format_duration(duration)
+
+    history = {
+        "last_id": last_id,
+        "checked": time.time(),
+        "last": last_execution,
+        "executions": executions,
+        "stats": get_stats(executions),
+    }
+    interaction.set_redis("job.history", history, jobid=job_id)
+    return history
+
+
+def get_execution_history(
+    env, job_id, live_data_source=DataSource.API, force_refresh=False
+):
+    """Cached history of a job, updated when it's older than EXECUTION_CACHE_TTL"""
+    interaction = DataInteraction(live_data_source=live_data_source, env=env)
+    history = interaction.get_redis("job.history", jobid=job_id)
+    ttl = float(app.config.get("EXECUTION_CACHE_TTL", 60))
+    if force_refresh or not history or time.time() - history["checked"] >= ttl:
+        history = ingest_executions(env, job_id, live_data_source=live_data_source)
+    return history
+
+
+def get_execution_summary(
+    env, job_id, live_data_source=DataSource.API, force_refresh=False
+):
+    """Last execution of a job with the stats of the recent ones"""
+    history = get_execution_history(
+        env, job_id, live_data_source=live_data_source, force_refresh=force_refresh
+    )
+    return dict(history.get("last") or {}, stats=history["stats"])
@@ -0,0 +1,117 @@
+"""Tell every process when the combined data changes, with redis pub/sub
+
+Each process keeps objects built from the combined data (see localcache.py and
+responsecache.py). When the combined data is saved its meta is published in
+CHANNEL, and the listener thread of each process drops what was built from an
+older version. While the listener is connected the version doesn't have to be
+read from redis on every request, if it disconnects it's read again until the
+listener is back. The listener also reads the meta every META_CHECK_INTERVAL
+seconds, in case a change wasn't published.
+"""
+import json
+import time
+import threading
+import redis
+from runduck import app
+from runduck import localcache
+from runduck.datainteraction import DataInteraction
+from runduck.responsecache import response_cache
+
+CHANNEL = "runduck:combined:events"
+# seconds between attempts to connect again
+RETRY_INTERVAL = 5
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def publish_meta(meta, interaction=None):
+    """Send the new meta of the combined data to the listeners"""
+    interaction = interaction or DataInteraction()
+    try:
+        interaction.redis.publish(CHANNEL, json.dumps(meta))
+    except redis.RedisError as ex:
+        # the listeners read the version from redis when they reconnect
+        app.logger.warning(f"Couldn't publish the combined version: {ex}")
+
+
+def apply_meta(meta):
+    """Drop the local objects that are not for this meta"""
+    version = meta.get("version")
+    localcache.set_known_meta(meta)
+    # responses are cached by (version, arguments)
+    response_cache.discard(lambda key: key[0] != version)
+
+
+class InvalidationListener(threading.Thread):
+    """Receive the meta of the combined data when it changes"""
+
+    def __init__(self):
+        super().__init__(name="runduck-invalidation", daemon=True)
+        self.stop_event = threading.Event()
+        self.connected = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.listen()
+            except (redis.RedisError, ValueError) as ex:
+                app.logger.warning(f"Invalidation listener disconnected: {ex}")
+            finally:
+                self.connected.clear()
+                localcache.set_known_meta(None)
+            self.stop_event.wait(RETRY_INTERVAL)
+
+    def listen(self):
+        interaction = DataInteraction()
+        pubsub = interaction.redis.pubsub()
+        try:
+            pubsub.subscribe(CHANNEL)
+            while pubsub.get_message(timeout=1.0) is None:
+                # wait until subscribed, so no change is missed
+                if self.stop_event.is_set():
+                    return
+            apply_meta(interaction.get_redis("combined.meta") or {})
+            self.connected.set()
+            check_interval = float(app.config.get("META_CHECK_INTERVAL", 60))
+            checked = time.monotonic()
+            while not self.stop_event.is_set():
+                message = pubsub.get_message(timeout=min(1.0, check_interval))
+                if message and message["type"] == "message":
+                    apply_meta(json.loads(message["data"]))
+                elif time.monotonic() - checked >= check_interval:
+                    # the publish may have failed, see publish_meta
+                    meta = interaction.get_redis("combined.meta") or {}
+                    if meta.get("version") != localcache.get_combined_version():
+                        apply_meta(meta)
+                    checked = time.monotonic()
+        finally:
+            pubsub.close()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+def start_listener():
+    """Start the listener of this process, once
+    Call it in each process after it's forked (see gunicorn.conf.py)
+
+    :return: the listener, None if CACHE_INVALIDATION_ENABLED is False
+    """
+    global _listener
+    if not app.config.get("CACHE_INVALIDATION_ENABLED", True):
+        return None
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = InvalidationListener()
+            _listener.start()
+        return _listener
+
+
+def stop_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.join()
+            _listener = None
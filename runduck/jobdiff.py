@@ -0,0 +1,328 @@
+"""Differences between a job and the same job in other environments
+
+Jobs are linked to the matching job of an environment with higher priority
+(parentId, see jobinfo.link_jobs). The definitions are normalized, so changes
+that don't matter (order of keys and options, trailing spaces in scripts) are
+ignored, and hashed by section. Jobs with the same hash are identical, only the
+sections with a different hash are compared.
+
+The differences are calculated when the data is combined and saved with each
+job (job.diff), with the hash of the job, so a refresh only compares again
+the jobs whose hash or parent changed.
+"""
+import json
+import hashlib
+from runduck.datainteraction import DataInteraction
+
+SECTIONS = ("schedule", "options", "workflow", "nodefilters", "enabled")
+
+# value of the fields that one of the jobs doesn't have
+MISSING = object()
+
+
+def normalize_text(value):
+    """Same text without trailing spaces and with the same line breaks"""
+    if not isinstance(value, str):
+        return value
+    return "\n".join(line.rstrip() for line in value.strip().splitlines())
+
+
+def normalize_command(command):
+    return {key: normalize_text(value) for key, value in command.items()}
+
+
+def normalize_job(job):
+    """Sections of the definition that are compared"""
+    sequence = job.get("sequence") or {}
+    return {
+        "schedule": dict(job.get("schedule") or {}, timeZone=job.get("timeZone")),
+        "options": {
+            option.get("name"): {
+                key: normalize_text(value)
+                for key, value in option.items()
+                if key != "name"
+            }
+            for option in job.get("options") or []
+        },
+        "workflow": {
+            "strategy": sequence.get("strategy"),
+            "keepgoing": sequence.get("keepgoing"),
+            "commands": [
+                normalize_command(command) for command in sequence.get("commands") or []
+            ],
+        },
+        "nodefilters": dict(
+            job.get("nodefilters") or {},
+            nodesSelectedByDefault=job.get("nodesSelectedByDefault"),
+        ),
+        "enabled": {
+            "scheduleEnabled": job.get("scheduleEnabled"),
+            "executionEnabled": job.get("executionEnabled"),
+        },
+    }
+
+
+def hash_value(value):
+    return hashlib.sha1(
+        json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def fingerprint(normalized):
+    """Hash of the whole definition and of each section"""
+    sections = {section: hash_value(normalized[section]) for section in SECTIONS}
+    return {"hash": hash_value(sections), "sections": sections}
+
+
+def diff_values(parent, job, path):
+    """Differences between two values, going into dicts and lists
+
+    :return: list of {"path", "change", "parent", "job"}
+    """
+    if parent == job:
+        return []
+    if isinstance(parent, dict) and isinstance(job, dict):
+        differences = []
+        for key in sorted(set(parent) | set(job), key=str):
+            differences.extend(
+                diff_values(
+                    parent.get(key, MISSING), job.get(key, MISSING), f"{path}.{key}"
+                )
+            )
+        return differences
+    if isinstance(parent, list) and isinstance(job, list):
+        differences = []
+        for index in range(max(len(parent), len(job))):
+            differences.extend(
+                diff_values(
+                    parent[index] if index < len(parent) else MISSING,
+                    job[index] if index < len(job) else MISSING,
+                    f"{path}[{index}]",
+                )
+            )
+        return differences
+
+    change = "changed"
+    if parent is MISSING:
+        change = "added"
+    elif job is MISSING:
+        change = "removed"
+    return [
+        {
+            "path": path,
+            "change": change,
+            "parent": None if parent is MISSING else parent,
+            "job": None if job is MISSING else job,
+        }
+    ]
+
+
+def diff_jobs(parent, job, parent_fingerprint=None, job_fingerprint=None):
+    """Differences of a job with its parent, by section
+
+    :param parent: normalized definition of the parent job
+    :param job: normalized definition of the job
+    :return: list of differences, see diff_values
+    """
+    parent_fingerprint = parent_fingerprint or fingerprint(parent)
+    job_fingerprint = job_fingerprint or fingerprint(job)
+    if parent_fingerprint["hash"] == job_fingerprint["hash"]:
+        return []
+
+    differences = []
+    for section in SECTIONS:
+        if (
+            parent_fingerprint["sections"][section]
+            != job_fingerprint["sections"][section]
+        ):
+            differences.extend(diff_values(parent[section], job[section], section))
+    return differences
+
+
+def build_diffs(rows, definitions):
+    """Differences of each job with its parent
+
+    :param rows: combined jobs, with id, env and parentId
+    :param definitions: job definitions by combined id, None if not available
+    :return: diff of each job by combined id, children list the jobs that
+        are linked to the job and if they are identical
+    """
+    normalized = {
+        row_id: normalize_job(job)
+        for row_id, job in definitions.items()
+        if job is not None
+    }
+    fingerprints = {row_id: fingerprint(job) for row_id, job in normalized.items()}
+
+    diffs = {}
+    for row in rows:
+        row_id = row["id"]
+        parent_id = row.get("parentId")
+        identical = None
+        differences = []
+        if parent_id and row_id in normalized and parent_id in normalized:
+            differences = diff_jobs(
+                normalized[parent_id],
+                normalized[row_id],
+                fingerprints[parent_id],
+                fingerprints[row_id],
+            )
+            identical = not differences
+        diffs[row_id] = {
+            "id": row_id,
+            "env": row["env"],
+            "parentId": parent_id,
+            "hash": fingerprints[row_id]["hash"] if row_id in fingerprints else None,
+            "identical": identical,
+            "differences": differences,
+            "children": [],
+        }
+
+    for diff in diffs.values():
+        parent = diffs.get(diff["parentId"])
+        if parent is not None:
+            parent["children"].append(
+                {
+                    "id": diff["id"],
+                    "identical": diff["identical"],
+                    "differences": len(diff["differences"]),
+                }
+            )
+    return diffs
+
+
+def get_job_id(diff):
+    """Rundeck id of a job from its combined id ({env}.{id})"""
+    return diff["id"][len(diff["env"]) + 1 :]
+
+
+def save_diffs(diffs):
+    """Save the diffs with each job, one round trip per environment"""
+    by_env = {}
+    for diff in diffs.values():
+        by_env.setdefault(diff["env"], []).append(diff)
+    for env, env_diffs in by_env.items():
+        DataInteraction(env=env).set_many(
+            "job.diff", env_diffs, [{"jobid": get_job_id(diff)} for diff in env_diffs]
+        )
+
+
+def delete_diffs(rows):
+    """Delete the diffs of jobs that were removed, one round trip per environment"""
+    by_env = {}
+    for row in rows:
+        by_env.setdefault(row["env"], []).append(row)
+    for env, env_rows in by_env.items():
+        interaction = DataInteraction(env=env)
+        pipe = interaction.redis.pipeline(transaction=False)
+        for row in env_rows:
+            pipe.hdel(
+                *interaction.get_redis_location("job.diff", jobid=get_job_id(row))
+            )
+        pipe.execute()
+
+
+def read_diffs(rows):
+    """Saved diffs of the jobs by combined id, one round trip per environment"""
+    by_env = {}
+    for row in rows:
+        by_env.setdefault(row["env"], []).append(row)
+    diffs = {}
+    for env, env_rows in by_env.items():
+        values = DataInteraction(env=env).get_many(
+            "job.diff", [{"jobid": get_job_id(row)} for row in env_rows]
+        )
+        for row, value in zip(env_rows, values):
+            diffs[row["id"]] = value
+    return diffs
+
+
+def get_definitions(raw_data):
+    """Definitions by combined id from the data read by read_all_environments
+    Jobs without a definition (no sequence) are left out
+    """
+    return {
+        f"{env}.{job['id']}": job
+        for env, projects in raw_data.items()
+        for project in projects
+        for job in project.get("jobs") or []
+        if "sequence" in job
+    }
+
+
+def read_definitions(rows):
+    """Cached definitions of the jobs by combined id, one round trip per
+    environment
+    """
+    by_env = {}
+    for row in rows:
+        by_env.setdefault(row["env"], []).append(row["id"])
+    definitions = {}
+    for env, row_ids in by_env.items():
+        values = DataInteraction(env=env).get_many(
+            "job.definition", [{"jobid": row_id[len(env) + 1 :]} for row_id in row_ids]
+        )
+        for row_id, value in zip(row_ids, values):
+            definitions[row_id] = next(iter(value)) if value else None
+    return definitions
+
+
+def update_diffs(rows, row_ids):
+    """Calculate again the diffs that change when some jobs change, after they
+    were refreshed individually: the jobs, their children and their parents.
+    Jobs with the same hash and parent as their saved diff are skipped
+
+    :param rows: all the combined jobs
+    :param row_ids: ids of the jobs that changed
+    """
+    rows_by_id = {row["id"]: row for row in rows}
+    children = {}
+    for row in rows:
+        if row.get("parentId"):
+            children.setdefault(row["parentId"], []).append(row["id"])
+
+    def add_relatives(row_ids, related):
+        for row_id in row_ids:
+            related.update(children.get(row_id, []))
+            parent_id = rows_by_id[row_id].get("parentId")
+            if parent_id:
+                related.add(parent_id)
+        return related
+
+    candidates = [rows_by_id[row_id] for row_id in set(row_ids) if row_id in rows_by_id]
+    definitions = read_definitions(candidates)
+    saved_diffs = read_diffs(candidates)
+    changed = set()
+    for row in candidates:
+        job = definitions[row["id"]]
+        job_hash = None if job is None else fingerprint(normalize_job(job))["hash"]
+        saved_diff = saved_diffs[row["id"]] or {}
+        saved_children = {child["id"] for child in saved_diff.get("children", [])}
+        if (
+            not saved_diff
+            or saved_diff["hash"] != job_hash
+            or saved_diff["parentId"] != row.get("parentId")
+            or saved_children != set(children.get(row["id"], []))
+        ):
+            changed.add(row["id"])
+        # the previous parent has one child less
+        old_parent_id = saved_diff.get("parentId")
+        if old_parent_id != row.get("parentId") and old_parent_id in rows_by_id:
+            changed.add(old_parent_id)
+    if not changed:
+        return
+
+    saved = add_relatives(changed, set(changed))
+    # jobs needed to compare the saved jobs and list their children
+    needed = add_relatives(saved, set(saved))
+    family = [row for row in rows if row["id"] in needed]
+    definitions.update(
+        read_definitions([row for row in family if row["id"] not in definitions])
+    )
+    diffs = build_diffs(family, {row["id"]: definitions[row["id"]] for row in family})
+    save_diffs({row_id: diffs[row_id] for row_id in saved})
+
+
+def get_job_diff(env, job_id):
+    """Differences of a job with its parent, None if they were not calculated"""
+    return DataInteraction(env=env).get_redis("job.diff", jobid=job_id)
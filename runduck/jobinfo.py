@@ -1,16 +1,47 @@
 """Read information from all jobs"""
+import json
+import hashlib
+import time
+import uuid
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from cron_descriptor import get_description
+from redis.exceptions import LockError
 from runduck.datainteraction import DataSource
 from runduck.datainteraction import DataInteraction
+from runduck.datainteraction import get_env_setting
+from runduck.datainteraction import RundeckApiError
+from runduck.combinelock import CombineLockedError
+from runduck.combinelock import get_combine_lock
+from runduck.invalidation import publish_meta
+from runduck.jobdiff import build_diffs
+from runduck.jobdiff import delete_diffs
+from runduck.jobdiff import get_definitions
+from runduck.jobdiff import read_definitions
+from runduck.jobdiff import save_diffs
+from runduck.jobdiff import update_diffs
+from runduck.searchindex import build_documents
+from runduck.searchindex import save_documents
+from runduck.searchindex import update_documents
+from runduck.jobquery import get_job_query
+from runduck.jobtable import get_job_table
+from runduck.jobtable import job_table_cache
 from runduck import app
-from runduck.utils import get_elapsed_time
-from runduck.utils import get_object_property
 from runduck.utils import get_cron
-from runduck.utils import get_next_execution
-
-
-def read_environment(live_data_source, force_refresh=False, env="qa"):
+from runduck.schedule import schedule_cache
+from runduck.schedule import InvalidCronError
+from runduck.metrics import combine_phase_seconds
+
+
+def read_environment(
+    live_data_source,
+    force_refresh=False,
+    env="qa",
+    cache_only=False,
+    progress=None,
+    delta=False,
+):
     """Iterate through projects to get the jobs and job details for one environment
 
     :param live_data_source: Where to get the data if not available in the cache
@@ -19,57 +50,384 @@ def read_environment(live_data_source, force_refresh=False, env="qa"):
     :type force_refresh: bool, optional
     :param env: Which rundeck to read from, must match the key in the ENV configuration, defaults to "qa"
     :type env: str, optional
+    :param cache_only: Only use data that is already cached, defaults to False
+    :type cache_only: bool, optional
+    :param progress: Counters of the combine task, see combinetask.CombineProgress
+    :param delta: Read projects, job lists and metadata from live_data_source,
+        but definitions only for the jobs that changed, and delete the cached
+        jobs that don't exist anymore, defaults to False
+    :type delta: bool, optional
     :return: project with jobs
     :rtype: array of projects
     """
 
     interaction = DataInteraction(live_data_source=live_data_source, env=env)
-    projects = interaction.get_data("projects").get("data")
-    for project_i, project in enumerate(projects):
-        app.logger.info(
-            f"[{env}] Reading jobs from {project_i + 1} of {len(projects)}: {project['name']}"
-        )
-        jobs = interaction.get_data(
-            "jobs", project=project["name"], force_refresh=force_refresh
+    max_workers = get_max_workers(env)
+    delta = delta and not cache_only
+    if cache_only:
+        projects = interaction.get_redis("projects") or []
+    else:
+        projects = interaction.get_data(
+            "projects", force_refresh=force_refresh or delta
         ).get("data")
+    if progress:
+        progress.start_environment(env, len(projects))
+
+    # job lists of all the projects in one round trip
+    project_jobs = read_many(
+        interaction,
+        "jobs",
+        [{"project": project["name"]} for project in projects],
+        force_refresh=force_refresh or delta,
+        cache_only=cache_only,
+    )
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix=f"runduck-{env}"
+    ) as executor:
+        for project_i, project in enumerate(projects):
+            app.logger.info(
+                f"[{env}] Reading jobs from {project_i + 1} of {len(projects)}: {project['name']}"
+            )
+            jobs = project_jobs[project_i] or []
+            project["jobs"] = jobs
+
+            job_args = [{"jobid": job["id"]} for job in jobs]
+            job_metadata = read_many(
+                interaction,
+                "job.metadata",
+                job_args,
+                force_refresh=force_refresh or delta,
+                cache_only=cache_only,
+                executor=executor if max_workers > 1 else None,
+            )
+            if delta:
+                job_definitions = read_changed_definitions(
+                    interaction,
+                    project["name"],
+                    job_args,
+                    [
+                        fingerprint_job(job, metadata)
+                        for job, metadata in zip(jobs, job_metadata)
+                    ],
+                    executor=executor if max_workers > 1 else None,
+                )
+            else:
+                job_definitions = read_many(
+                    interaction,
+                    "job.definition",
+                    job_args,
+                    force_refresh=force_refresh,
+                    cache_only=cache_only,
+                    fetch_many=partial(
+                        fetch_definitions,
+                        interaction,
+                        project["name"],
+                        executor=executor if max_workers > 1 else None,
+                        project_size=len(jobs),
+                    ),
+                )
+            for job, metadata, definition in zip(jobs, job_metadata, job_definitions):
+                if metadata is not None:
+                    job.update(metadata)
+                if definition is not None:
+                    job.update(next(iter(definition)))
+            if progress:
+                progress.project_done(env, len(jobs))
+
+    if delta:
+        prune_environment(interaction, projects)
+    return projects
 
-        project["jobs"] = jobs
 
-        for job_i, job in enumerate(jobs):
-            # print(f"Job {job_i + 1} of {len(jobs)}: {job['name']}")
-            # print(f"  Reading metadata for {job['id']}")
-            job_metadata = interaction.get_data(
-                "job.metadata", jobid=job["id"], force_refresh=force_refresh
-            ).get("data")
-            job.update(job_metadata)
+def get_max_workers(env):
+    """Number of concurrent requests allowed for one environment
+    Set MAX_WORKERS in app.cfg, or max_workers in the ENV settings to override
+    it for a specific rundeck. Defaults to 1 (one request at a time)
+    """
+    return max(int(get_env_setting(env, "MAX_WORKERS", 1)), 1)
 
-            # print(f"  Reading job definition for {job['id']}")
-            job_definition = interaction.get_data(
-                "job.definition", jobid=job["id"], force_refresh=force_refresh
-            ).get("data")
-            job.update(next(iter(job_definition)))
 
-    return projects
+def fetch_value(interaction, data_key, args):
+    """Read one value from the live data source, args as a dict"""
+    return interaction.fetch_data(data_key, **args)
+
 
+def read_many(
+    interaction,
+    data_key,
+    args_list,
+    force_refresh=False,
+    cache_only=False,
+    executor=None,
+    fetch_many=None,
+):
+    """Read several values of the same kind, cached values are read from redis
+    in one round trip and the missing ones from the live data source
+
+    :param interaction: DataInteraction for the environment
+    :param data_key: Key in DataInteraction.CONFIG
+    :param args_list: list of arguments for each value, e.g. [{"jobid": "..."}]
+    :param force_refresh: Read everything from the live data source, defaults to False
+    :param cache_only: Don't call the live data source, defaults to False
+    :param executor: Read from the live data source concurrently with this executor
+    :param fetch_many: Function that reads a list of arguments from the live
+        data source, instead of reading them one by one
+    :return: values in the same order as args_list, None if not available
+    """
+    if force_refresh and not cache_only:
+        values = [None] * len(args_list)
+    else:
+        values = interaction.get_many(data_key, args_list)
+
+    missing = [index for index, value in enumerate(values) if value is None]
+    if cache_only or not missing:
+        return values
+
+    missing_args = [args_list[index] for index in missing]
+    fetch = partial(fetch_value, interaction, data_key)
+    if fetch_many:
+        fetched = fetch_many(missing_args)
+    elif executor:
+        # map keeps the order, so the result is the same as reading one by one
+        fetched = list(executor.map(fetch, missing_args))
+    else:
+        fetched = [fetch(args) for args in missing_args]
 
-def read_all_environments(live_data_source=DataSource.API, force_refresh=False):
+    interaction.set_many(data_key, fetched, missing_args)
+    for index, value in zip(missing, fetched):
+        values[index] = value
+    return values
+
+
+# fields of job.metadata that change when the job runs or is cached
+VOLATILE_FIELDS = ("nextScheduledExecution", "averageDuration", "updated")
+
+
+def fingerprint_job(job, metadata):
+    """Hash of the job list entry and the metadata of a job
+    Rundeck doesn't tell when a definition was modified, the definition is
+    read again when something in the job list or the metadata changes
+    """
+    values = dict(job)
+    values.update(
+        {
+            key: value
+            for key, value in (metadata or {}).items()
+            if key not in VOLATILE_FIELDS
+        }
+    )
+    return hashlib.sha1(
+        json.dumps(values, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def read_changed_definitions(
+    interaction, project, job_args, fingerprints, executor=None
+):
+    """Read definitions from the cache, and from the live data source only for
+    the jobs with a different fingerprint than when they were cached
+
+    :param interaction: DataInteraction for the environment
+    :param project: name of the project of the jobs
+    :param job_args: list of {"jobid": ...}
+    :param fingerprints: fingerprint_job of each job, same order as job_args
+    :param executor: Read from the live data source concurrently with this executor
+    :return: definitions in the same order as job_args
+    """
+    definitions = interaction.get_many("job.definition", job_args)
+    cached_fingerprints = interaction.get_many("job.fingerprint", job_args)
+    changed = [
+        index
+        for index, (definition, fingerprint, cached_fingerprint) in enumerate(
+            zip(definitions, fingerprints, cached_fingerprints)
+        )
+        if definition is None or fingerprint != cached_fingerprint
+    ]
+    if not changed:
+        return definitions
+
+    changed_args = [job_args[index] for index in changed]
+    fetched = fetch_definitions(
+        interaction,
+        project,
+        changed_args,
+        executor=executor,
+        project_size=len(job_args),
+    )
+    interaction.set_many("job.definition", fetched, changed_args)
+    interaction.set_many(
+        "job.fingerprint", [fingerprints[index] for index in changed], changed_args
+    )
+    for index, value in zip(changed, fetched):
+        definitions[index] = value
+    app.logger.info(
+        f"[{interaction.env}] {len(changed)} of {len(job_args)} definitions changed"
+    )
+    return definitions
+
+
+def fetch_definition(interaction, args):
+    """Read one job definition from the live data source, None if the job was
+    deleted after it was listed
+    """
+    try:
+        return interaction.fetch_data("job.definition", **args)
+    except RundeckApiError as ex:
+        if ex.status_code == 404:
+            app.logger.info(f"[{interaction.env}] {args['jobid']} not found")
+            return None
+        raise
+
+
+def fetch_definitions(interaction, project, job_args, executor=None, project_size=None):
+    """Read job definitions from the live data source
+    All the definitions of the project are exported in one call instead of one
+    call per job when at least BULK_DEFINITIONS_MIN jobs (0 to disable) and at
+    least BULK_DEFINITIONS_RATIO of the jobs of the project are needed. The
+    export has every job of the project, so a few changed jobs in a large
+    project are cheaper one by one
+
+    :param interaction: DataInteraction for the environment
+    :param project: name of the project of the jobs
+    :param job_args: list of {"jobid": ...}
+    :param executor: Read one by one concurrently with this executor
+    :param project_size: number of jobs in the project, defaults to len(job_args)
+    :return: definitions in the same order as job_args, None for jobs that
+        were deleted
+    """
+    fetch = partial(fetch_definition, interaction)
+    bulk_min = int(get_env_setting(interaction.env, "BULK_DEFINITIONS_MIN", 5))
+    bulk_ratio = float(get_env_setting(interaction.env, "BULK_DEFINITIONS_RATIO", 0.25))
+    if project_size is None:
+        project_size = len(job_args)
+    if (
+        not bulk_min
+        or len(job_args) < bulk_min
+        or len(job_args) < bulk_ratio * project_size
+    ):
+        if executor:
+            return list(executor.map(fetch, job_args))
+        return [fetch(args) for args in job_args]
+
+    job_ids = {args["jobid"] for args in job_args}
+    # same format as job.definition: a list with one job
+    exported = {
+        job["id"]: [job]
+        for job in interaction.iter_data("project.definitions", project=project)
+        if job.get("id") in job_ids
+    }
+    # jobs created after the export started are read one by one
+    return [exported.get(args["jobid"]) or fetch(args) for args in job_args]
+
+
+def prune_environment(interaction, projects):
+    """Delete cached projects and jobs that are not in the list of projects
+
+    :param interaction: DataInteraction for the environment
+    :param projects: projects with their jobs, as returned by read_environment
+    :return: number of keys deleted
+    """
+    project_prefix, _ = interaction.get_redis_location("jobs", project="")
+    job_prefix, _ = interaction.get_redis_location("job.metadata", jobid="")
+    names = {project_prefix + project["name"] for project in projects}
+    names.update(
+        job_prefix + job["id"] for project in projects for job in project["jobs"]
+    )
+
+    stale = [
+        key
+        for prefix in (project_prefix, job_prefix)
+        for key in interaction.redis.scan_iter(match=f"{prefix}*", count=1000)
+        if key.decode("utf-8") not in names
+    ]
+    if stale:
+        interaction.redis.delete(*stale)
+        app.logger.info(f"[{interaction.env}] Deleted {len(stale)} cached keys")
+    return len(stale)
+
+
+def read_all_environments(
+    live_data_source=DataSource.API,
+    force_refresh=False,
+    cache_only=False,
+    progress=None,
+    delta=False,
+):
     """Read all data from all configured environments and merge into result dataset
+    Environments are read at the same time, each one in its own thread. The
+    result keeps the order of the ENV configuration, environments that fail
+    are logged and left out of the result (combine_data keeps their
+    previously combined jobs).
 
     :param live_data_source: Where to get the data if not available in the cache
     :type live_data_source: DataSource
     :param force_refresh: Force reading from live_data_source, defaults to False
     :type force_refresh: bool, optional
+    :param cache_only: Only use data that is already cached, defaults to False
+    :type cache_only: bool, optional
+    :param progress: Counters of the combine task, see combinetask.CombineProgress
+    :param delta: Only read definitions of jobs that changed, see read_environment
+    :type delta: bool, optional
     """
-    environments = app.config["ENV"]
-    env_data = None
+    environments = list(app.config["ENV"])
     all_data = {}
-    for env in environments:
-        all_data[env] = read_environment(
-            live_data_source, force_refresh=force_refresh, env=env
-        )
+    if not environments:
+        return all_data
+
+    with ThreadPoolExecutor(
+        max_workers=len(environments), thread_name_prefix="runduck-env"
+    ) as executor:
+        futures = {
+            env: executor.submit(
+                read_environment_timed,
+                live_data_source,
+                force_refresh=force_refresh,
+                env=env,
+                cache_only=cache_only,
+                progress=progress,
+                delta=delta,
+            )
+            for env in environments
+        }
+        for env in environments:
+            try:
+                all_data[env] = futures[env].result()
+            except Exception as ex:
+                app.logger.exception(f"[{env}] Error reading environment")
+                if progress:
+                    progress.environment_failed(env, ex)
+            else:
+                if progress:
+                    progress.environment_done(env)
     return all_data
 
 
+def read_environment_timed(
+    live_data_source,
+    force_refresh=False,
+    env="qa",
+    cache_only=False,
+    progress=None,
+    delta=False,
+):
+    """Read one environment and log how long it took"""
+    start = time.perf_counter()
+    try:
+        return read_environment(
+            live_data_source,
+            force_refresh=force_refresh,
+            env=env,
+            cache_only=cache_only,
+            progress=progress,
+            delta=delta,
+        )
+    finally:
+        app.logger.info(
+            f"[{env}] Environment read in {time.perf_counter() - start:.2f}s"
+        )
+
+
 def append_info(job, project, env, env_order):
     """Add project and environment info
     Also include:
@@ -112,7 +470,8 @@ def append_info(job, project, env, env_order):
 def find_job(jobs, job_to_find):
     """Find matching job in list"""
     for job in jobs:
-        if job["uuid"] == job_to_find["uuid"]:
+        # jobs without a definition have no uuid
+        if job["uuid"] is not None and job["uuid"] == job_to_find["uuid"]:
             return job
         if (
             job["project_name"] == job_to_find["project_name"]
@@ -123,6 +482,45 @@ def find_job(jobs, job_to_find):
     return None
 
 
+class JobIndex(object):
+    """Index of jobs to find matches without going through the whole list
+    Gives the same result as find_job on the list of added jobs: the first job
+    added that matches either by uuid or by project, group and name
+    """
+
+    def __init__(self, jobs=None):
+        self.by_uuid = {}
+        self.by_name = {}
+        self.count = 0
+        for job in jobs or []:
+            self.add(job)
+
+    @staticmethod
+    def name_key(job):
+        return (job["project_name"], job["group"], job["name"])
+
+    def add(self, job):
+        """Add job to the index, only the first job for each key is kept"""
+        if job["uuid"] is not None:
+            self.by_uuid.setdefault(job["uuid"], (self.count, job))
+        self.by_name.setdefault(self.name_key(job), (self.count, job))
+        self.count += 1
+
+    def find(self, job_to_find):
+        """Find the first added job matching job_to_find"""
+        matches = [
+            match
+            for match in (
+                self.by_uuid.get(job_to_find["uuid"]),
+                self.by_name.get(self.name_key(job_to_find)),
+            )
+            if match
+        ]
+        if not matches:
+            return None
+        return min(matches, key=lambda match: match[0])[1]
+
+
 def get_job_details(env, job_id, live_data_source=DataSource.API, force_refresh=False):
     """Get details of one job"""
     interaction = DataInteraction(live_data_source=live_data_source, env=env)
@@ -137,62 +535,295 @@ def get_job_details(env, job_id, live_data_source=DataSource.API, force_refresh=
     return job_metadata
 
 
-def get_last_execution(
-    env, job_id, live_data_source=DataSource.API, force_refresh=False
-):
-    interaction = DataInteraction(live_data_source=live_data_source, env=env)
-    response = interaction.get_data(
-        "job.executions",
-        force_refresh=force_refresh,
-        jobid=job_id,
-        max=1,  # only using the last execution for now
-    ).get("data")
-    if get_object_property(response, "paging.count", 0) > 0:
-        execution = next(iter(response["executions"]))
+def combine_data(force_refresh=False, cache_only=False, progress=None, delta=False):
+    """Read all the environments and save the combined data
 
-        # Append duration
-        execution["duration"] = get_elapsed_time(
-            get_object_property(execution, "date-started.date"),
-            get_object_property(execution, "date-ended.date"),
+    :param progress: Counters of the combine task, see combinetask.CombineProgress
+    :param delta: Only read definitions of jobs that changed, see read_environment
+    """
+    with combine_phase_seconds.time(phase="read"):
+        raw_data = read_all_environments(
+            force_refresh=force_refresh,
+            cache_only=cache_only,
+            progress=progress,
+            delta=delta,
         )
-        return execution
-    return {}
+    if progress:
+        progress.set_phase("combining")
+    with combine_phase_seconds.time(phase="combine"):
+        jobs, kept = keep_failed_environments(
+            get_job_info_list(raw_data), raw_data, progress=progress
+        )
+        order = [[job["id"], hash_job(job)] for job in jobs]
+        all_jobs = link_jobs(jobs)
+        definitions = get_definitions(raw_data)
+        # the kept jobs are compared and indexed with their cached definitions
+        definitions.update(read_definitions(kept))
+        diffs = build_diffs(all_jobs, definitions)
+        documents = build_documents(definitions)
+
+    if progress:
+        progress.set_phase("saving")
+    with combine_phase_seconds.time(phase="save"):
+        delete_diffs(get_removed_rows(all_jobs))
+        save_diffs(diffs)
+        save_documents(documents)
+        save_combined(all_jobs, order)
+    app.logger.info("DONE!")
+
+
+def get_removed_rows(all_jobs):
+    """Previously combined jobs that are not in all_jobs anymore"""
+    job_ids = {row["id"] for row in all_jobs}
+    return [
+        row
+        for row in DataInteraction().get_redis("combined") or []
+        if row["id"] not in job_ids
+    ]
 
 
-def combine_data(force_refresh=False):
-    raw_data = read_all_environments(force_refresh=force_refresh)
-    all_jobs = []
+def keep_failed_environments(jobs, raw_data, progress=None):
+    """Add the previously combined jobs of the environments that couldn't be
+    read, so they are not removed from the combined data
 
-    # go over each environment
-    for index, env in enumerate(raw_data):
+    :param jobs: job info of the environments that were read, see get_job_info_list
+    :param raw_data: data read by read_all_environments
+    :param progress: Counters of the combine task, see combinetask.CombineProgress
+    :return: job info of all the environments in order of priority, and the
+        jobs that were kept
+    """
+    environments = list(app.config["ENV"])
+    failed = [env for env in environments if env not in raw_data]
+    if not failed:
+        return jobs, []
+
+    interaction = DataInteraction()
+    rows = {row["id"]: row for row in interaction.get_redis("combined") or []}
+    # combined.order has the jobs of each environment in order of priority
+    kept = [
+        rows[row_id]
+        for row_id, _ in interaction.get_redis("combined.order") or []
+        if row_id in rows and rows[row_id]["env"] in failed
+    ]
+    for env in failed:
+        count = sum(row["env"] == env for row in kept)
+        app.logger.warning(f"[{env}] Not read, keeping {count} combined jobs")
+        if progress:
+            progress.environment_kept(env, count)
+    # sorted is stable, the jobs of each environment keep their order
+    return sorted(jobs + kept, key=lambda job: environments.index(job["env"])), kept
+
+
+def build_combined(raw_data):
+    """Build the combined job list from the raw data of all environments
+    Jobs are linked to the matching job of an environment with higher priority
+    (parentId) and sorted so that they are listed next to each other
+    """
+    return link_jobs(get_job_info_list(raw_data))
+
+
+def get_job_info_list(raw_data):
+    """Job info of all environments, in order of priority"""
+    jobs = []
+    # env_order is the priority from the configuration so it doesn't change
+    # if an environment failed to load
+    environments = list(app.config["ENV"])
+    for env in raw_data:
+        index = environments.index(env)
         app.logger.info(f"processing {index}: {env}")
         for project in raw_data[env]:
             for job in project["jobs"]:
-                job_info = append_info(
-                    job=job, project=project, env=env, env_order=index
-                )
-                parent_job = find_job(all_jobs, job_info)
-                if parent_job:
-                    job_info["parentId"] = parent_job["id"]
-                else:
-                    job_info["parentId"] = None
-                    # print(f"added to all jobs {job['euid']}")
-
-                # sort by parent job name
-                job_info["sortkey"] = (
-                    f"{job_info.get('project_name')} "
-                    f"{job_info.get('group')} "
-                    f"{parent_job['name'] if parent_job else job_info.get('name')} "
-                    f"{job_info['env_order']}"
+                jobs.append(
+                    append_info(job=job, project=project, env=env, env_order=index)
                 )
-                all_jobs.append(job_info)
+    return jobs
+
+
+def link_jobs(jobs):
+    """Set parentId and sortkey of the jobs and sort them
+
+    :param jobs: job info in order of priority, see get_job_info_list
+    :return: sorted jobs
+    """
+    job_index = JobIndex()
+    for job_info in jobs:
+        parent_job = job_index.find(job_info)
+        if parent_job:
+            job_info["parentId"] = parent_job["id"]
+        else:
+            job_info["parentId"] = None
+
+        # sort by parent job name
+        job_info["sortkey"] = (
+            f"{job_info.get('project_name')} "
+            f"{job_info.get('group')} "
+            f"{parent_job['name'] if parent_job else job_info.get('name')} "
+            f"{job_info['env_order']}"
+        )
+        job_index.add(job_info)
 
     # sort data
-    all_jobs = sorted(all_jobs, key=lambda item: f"{item.get('sortkey')}")
+    return sorted(jobs, key=lambda item: f"{item.get('sortkey')}")
+
+
+def hash_job(job_info):
+    """Hash of the job info, without the fields calculated by link_jobs"""
+    content = {
+        key: value
+        for key, value in job_info.items()
+        if key not in ("parentId", "sortkey", "next_execution")
+    }
+    return hashlib.sha1(
+        json.dumps(content, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def save_combined(all_jobs, order):
+    """Save the combined jobs and their order to the cache
 
+    :param all_jobs: all the combined jobs, sorted
+    :param order: [id, content hash] of the jobs in order of priority
+    """
     interaction = DataInteraction()
     interaction.set_redis("combined", all_jobs)
-    app.logger.info("DONE!")
+    interaction.set_redis("combined.order", order)
+    # new version, so in memory indexes are rebuilt
+    meta = {"version": uuid.uuid4().hex, "count": len(all_jobs)}
+    interaction.set_redis("combined.meta", meta)
+    publish_meta(meta, interaction)
+
+
+def update_combined(changes):
+    """Patch the combined data with jobs that were refreshed individually
+    Only the jobs that changed are rebuilt. Jobs that are not in the combined
+    data yet are added by the next combine_data
+
+    The combined data is read and saved while holding the combine lock, so
+    updates and combines don't overwrite each other. A running combine is
+    waited for up to COMBINE_WAIT_TIMEOUT seconds
+
+    :param changes: list of (env, job_id, job details), job details is None
+        if the job was deleted
+    :return: True if the combined data changed
+    :rtype: bool
+    :raises CombineLockedError: if the lock wasn't released in time
+    """
+    interaction = DataInteraction()
+    lock = get_combine_lock(interaction)
+    wait = float(app.config.get("COMBINE_WAIT_TIMEOUT", 30))
+    if not lock.acquire(blocking=True, blocking_timeout=wait):
+        raise CombineLockedError()
+    try:
+        return patch_combined(interaction, changes)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            app.logger.warning("Combine lock expired before the update ended")
+
+
+def patch_combined(interaction, changes):
+    """Patch the combined data, the combine lock must be held, see update_combined"""
+    combined = interaction.get_redis("combined")
+    order = interaction.get_redis("combined.order")
+    if combined is None or order is None:
+        return False
+
+    rows = {row["id"]: row for row in combined}
+    linkage = {row["id"]: (row["parentId"], row["sortkey"]) for row in combined}
+    hashes = dict(order)
+    environments = list(app.config["ENV"])
+    changed_ids = set()
+    removed_ids = []
+    removed_rows = []
+    for env, job_id, job in changes:
+        row_id = f"{env}.{job_id}"
+        row = rows.get(row_id)
+        if row is None:
+            continue
+
+        if job is None:
+            app.logger.info(f"[{env}] {job_id} removed from combined data")
+            removed_rows.append(rows.pop(row_id))
+            hashes.pop(row_id, None)
+            removed_ids.append(row_id)
+            continue
+
+        project = {
+            "name": row["project_name"],
+            "description": row["project_description"],
+        }
+        job_info = append_info(
+            job=job, project=project, env=env, env_order=environments.index(env)
+        )
+        job_hash = hash_job(job_info)
+        if hashes.get(row_id) == job_hash:
+            continue
+
+        app.logger.info(f"[{env}] {job_id} changed, updating combined data")
+        rows[row_id] = job_info
+        hashes[row_id] = job_hash
+        changed_ids.add(row_id)
+
+    # definitions are compared even if the combined fields didn't change
+    refreshed_ids = [f"{env}.{job_id}" for env, job_id, job in changes if job]
+    refreshed_rows = [rows[row_id] for row_id in refreshed_ids if row_id in rows]
+    update_documents(refreshed_rows, removed_ids)
+    delete_diffs(removed_rows)
+    if not changed_ids and not removed_ids:
+        update_diffs(combined, refreshed_ids)
+        return False
+
+    # parentId only depends on jobs with higher priority, relinking is a
+    # dictionary lookup per job
+    all_jobs = link_jobs([rows[row_id] for row_id in hashes if row_id in rows])
+    changed_rows = [
+        row
+        for row in all_jobs
+        if row["id"] in changed_ids
+        or linkage.get(row["id"]) != (row["parentId"], row["sortkey"])
+    ]
+    save_combined(all_jobs, [[row_id, job_hash] for row_id, job_hash in hashes.items()])
+    # the parents of removed jobs have one child less
+    update_diffs(
+        all_jobs,
+        refreshed_ids
+        + [row["id"] for row in changed_rows]
+        + [linkage[row_id][0] for row_id in removed_ids if linkage[row_id][0]],
+    )
+    return True
+
+
+def refresh_job_details(env, job_id, live_data_source=DataSource.API):
+    """Get details of one job from the source and update the combined data
+    If a combine holds the lock for too long the combined data is not updated,
+    the details are cached and the next combine or refresh picks them up
+    """
+    try:
+        job = get_job_details(
+            env=env,
+            job_id=job_id,
+            live_data_source=live_data_source,
+            force_refresh=True,
+        )
+    except RundeckApiError as ex:
+        if ex.status_code == 404:
+            try_update_combined([(env, job_id, None)])
+        raise
+
+    try_update_combined([(env, job_id, job)])
+    return job
+
+
+def try_update_combined(changes):
+    """update_combined, logging instead of raising if a combine is running"""
+    try:
+        return update_combined(changes)
+    except CombineLockedError:
+        app.logger.warning(
+            f"Combined data not updated with {len(changes)} jobs, a combine is running"
+        )
+        return False
 
 
 def append_next_execution(row):
@@ -203,7 +834,10 @@ def append_next_execution(row):
         and row.get("cron")
     ):
         try:
-            row["next_execution"] = get_next_execution(row.get("cron"))
+            row["next_execution"] = schedule_cache.get_next_execution(row.get("cron"))
+        except InvalidCronError:
+            # already logged the first time it failed
+            row["next_execution"] = None
         except Exception as ex:
             row["next_execution"] = None
             app.logger.info("")
@@ -219,13 +853,71 @@ def append_next_execution(row):
     return row
 
 
-def get_jobs(force_refresh=False):
+def get_first_next_execution(rows):
+    """Earliest next execution of the rows, when the job list has to change"""
+    next_executions = [
+        row["next_execution"] for row in rows if row.get("next_execution")
+    ]
+    if not next_executions:
+        return None
+    # ISO dates in the same format sort like dates
+    return datetime.strptime(min(next_executions), "%Y-%m-%dT%H:%M:%S")
+
+
+def get_jobs(
+    force_refresh=False,
+    env=None,
+    project=None,
+    group=None,
+    parent=None,
+    q=None,
+    enabled=None,
+    offset=0,
+    limit=None,
+    cursor=None,
+):
     """Get combined job list
     Reads combined data from cache, but appends next execution because it's
     calculated with the current date
+
+    Without filters or paging the whole list is returned. Otherwise the jobs
+    are filtered with the indexes in memory (see JobQuery). The jobs are
+    copied from the table kept in memory by the process (see JobTable)
+
+    :param env: only jobs of this environment
+    :param project: only jobs of this project
+    :param group: only jobs of this group
+    :param parent: only jobs linked to this parent job id
+    :param q: words in the name or description
+    :param enabled: only jobs with schedule and execution enabled (or disabled)
+    :param offset: skip this number of jobs
+    :param limit: maximum number of jobs to return
+    :param cursor: continue after the last page, see next_cursor in the result
     """
-    interaction = DataInteraction()
-    data = interaction.get_data("combined", force_refresh=force_refresh)
-    for row in data["data"]:
+    filters = dict(
+        env=env, project=project, group=group, parent=parent, q=q, enabled=enabled
+    )
+    if all(value is None for value in filters.values()) and not (
+        offset or limit or cursor
+    ):
+        if force_refresh:
+            job_table_cache.clear()
+        rows = get_job_table().get_rows()
+        for row in rows:
+            row = append_next_execution(row)
+        return {"source": DataSource.REDIS.value, "data": rows}
+
+    job_query = get_job_query()
+    positions = job_query.search(**filters)
+    ids, next_cursor = job_query.page(
+        positions, offset=offset, limit=limit, cursor=cursor
+    )
+    rows = get_job_table().get_rows(ids)
+    for row in rows:
         row = append_next_execution(row)
-    return data
+    return {
+        "source": DataSource.REDIS.value,
+        "data": rows,
+        "total": len(positions),
+        "next_cursor": next_cursor,
+    }
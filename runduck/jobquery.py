@@ -0,0 +1,156 @@
+"""Filter and page the combined jobs with indexes kept in memory
+
+The indexes are built once per version of the combined data and shared by all
+requests of the process. They only keep the fields needed to filter, the jobs
+of the requested page are read from the JobTable.
+"""
+import re
+import json
+import base64
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import defaultdict
+from runduck.localcache import VersionedCache
+
+
+def tokenize(text):
+    """Split text in lowercase words for the free text search"""
+    return re.findall(r"[a-z0-9]+", (text or "").lower())
+
+
+def is_enabled(row):
+    """Job is enabled if both schedule and execution are enabled"""
+    return bool(row.get("scheduleEnabled") and row.get("executionEnabled"))
+
+
+def encode_cursor(key):
+    """Opaque cursor for a (sortkey, id) key"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Get the (sortkey, id) key from a cursor"""
+    try:
+        sortkey, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError) as ex:
+        raise ValueError(f"{cursor} is not a valid cursor") from ex
+    if not isinstance(sortkey, str) or not isinstance(row_id, str):
+        raise ValueError(f"{cursor} is not a valid cursor")
+    return (sortkey, row_id)
+
+
+class JobQuery(object):
+    """Indexes over the combined jobs
+    Jobs are identified by their position in the list sorted by (sortkey, id)
+    """
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        rows = sorted(rows, key=lambda row: (f"{row.get('sortkey')}", row["id"]))
+        self.keys = [(f"{row.get('sortkey')}", row["id"]) for row in rows]
+        self.ids = [row["id"] for row in rows]
+        self.by_env = defaultdict(list)
+        self.by_project = defaultdict(list)
+        self.by_group = defaultdict(list)
+        self.by_parent = defaultdict(list)
+        self.by_enabled = defaultdict(list)
+        self.by_token = defaultdict(list)
+
+        for position, row in enumerate(rows):
+            self.by_env[row.get("env")].append(position)
+            self.by_project[row.get("project_name")].append(position)
+            self.by_group[row.get("group") or ""].append(position)
+            self.by_parent[row.get("parentId")].append(position)
+            self.by_enabled[is_enabled(row)].append(position)
+            for token in set(
+                tokenize(row.get("name")) + tokenize(row.get("description"))
+            ):
+                self.by_token[token].append(position)
+
+        # sorted words for prefix search
+        self.vocabulary = sorted(self.by_token)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search_token(self, token):
+        """Positions of jobs with a word starting with token"""
+        start = bisect_left(self.vocabulary, token)
+        positions = set()
+        for word in self.vocabulary[start:]:
+            if not word.startswith(token):
+                break
+            positions.update(self.by_token[word])
+        return positions
+
+    def search(
+        self, env=None, project=None, group=None, parent=None, q=None, enabled=None
+    ):
+        """Positions of the jobs that match all the filters, in order
+
+        :param env: environment
+        :param project: project name
+        :param group: group, empty string for jobs without group
+        :param parent: parent job id
+        :param q: words that must be in the name or description (prefix match)
+        :param enabled: scheduleEnabled and executionEnabled
+        :rtype: list of int
+        """
+        candidates = []
+        if env is not None:
+            candidates.append(self.by_env.get(env, []))
+        if project is not None:
+            candidates.append(self.by_project.get(project, []))
+        if group is not None:
+            candidates.append(self.by_group.get(group, []))
+        if parent is not None:
+            candidates.append(self.by_parent.get(parent, []))
+        if enabled is not None:
+            candidates.append(self.by_enabled.get(enabled, []))
+        for token in tokenize(q):
+            candidates.append(self.search_token(token))
+
+        if not candidates:
+            return list(range(len(self.ids)))
+
+        # start from the smallest list and check the others with sets
+        candidates.sort(key=len)
+        others = [set(positions) for positions in candidates[1:]]
+        return sorted(
+            position
+            for position in candidates[0]
+            if all(position in other for other in others)
+        )
+
+    def page(self, positions, offset=0, limit=None, cursor=None):
+        """Get one page of positions
+
+        :param positions: result of search
+        :param offset: skip this number of jobs
+        :param limit: maximum number of jobs
+        :param cursor: start after the job of this cursor, see next_cursor
+        :return: ids of the jobs in the page, cursor for the next page or None
+        """
+        start = 0
+        if cursor:
+            # first job after the cursor, works even if the data changed
+            after = bisect_right(self.keys, decode_cursor(cursor))
+            start = bisect_left(positions, after)
+        start += offset
+        end = start + limit if limit else len(positions)
+        page = positions[start:end]
+
+        next_cursor = None
+        if page and end < len(positions):
+            next_cursor = encode_cursor(self.keys[page[-1]])
+        return [self.ids[position] for position in page], next_cursor
+
+
+job_query_cache = VersionedCache(lambda rows, version: JobQuery(rows, version=version))
+
+
+def get_job_query():
+    """Get the indexes for the current version of the combined data
+    Indexes are rebuilt only when the version changes
+    """
+    return job_query_cache.get()
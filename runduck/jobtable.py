@@ -0,0 +1,104 @@
+"""Compact copy of the combined jobs kept in memory by each process
+
+Each job is a JobRecord with __slots__ instead of a dict, and the strings that
+repeat in many jobs (environment, project, group, cron...) are interned so all
+the records point to the same string. The table is built once per version of
+the combined data and never changed, requests only read it and get new dicts.
+"""
+import sys
+from operator import attrgetter
+from runduck.localcache import VersionedCache
+
+# fields of the combined jobs, see jobinfo.append_info and jobinfo.link_jobs
+FIELDS = (
+    "uuid",
+    "group",
+    "name",
+    "scheduleEnabled",
+    "executionEnabled",
+    "description",
+    "permalink",
+    "project_name",
+    "project_description",
+    "env",
+    "env_order",
+    "id",
+    "cron",
+    "schedule_description",
+    "parentId",
+    "sortkey",
+)
+# fields with few different values
+INTERNED_FIELDS = {
+    "group",
+    "project_name",
+    "project_description",
+    "env",
+    "cron",
+    "schedule_description",
+}
+
+get_values = attrgetter(*FIELDS)
+
+# value of the fields a job doesn't have, so they're not added to its dict
+MISSING = object()
+
+
+class JobRecord(object):
+    """One combined job, fields that are not in FIELDS are kept in extra"""
+
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self, row):
+        for field in FIELDS:
+            value = row.get(field, MISSING)
+            if field in INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, field, value)
+        extra = {key: row[key] for key in row if key not in self.__slots__}
+        self.extra = extra or None
+
+    def to_dict(self):
+        """New dict with the fields of the job"""
+        row = {
+            field: value
+            for field, value in zip(FIELDS, get_values(self))
+            if value is not MISSING
+        }
+        if self.extra:
+            row.update(self.extra)
+        return row
+
+
+class JobTable(object):
+    """Combined jobs in order, by position and by id"""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        self.records = tuple(JobRecord(row) for row in rows)
+        self.by_id = {record.id: record for record in self.records}
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, row_id):
+        return self.by_id.get(row_id)
+
+    def get_rows(self, ids=None):
+        """Jobs as dicts, that can be changed without changing the table
+
+        :param ids: only these jobs, in this order, defaults to all of them
+        :return: list of dict, jobs that are not in the table are skipped
+        """
+        if ids is None:
+            return [record.to_dict() for record in self.records]
+        records = (self.by_id.get(row_id) for row_id in ids)
+        return [record.to_dict() for record in records if record is not None]
+
+
+job_table_cache = VersionedCache(JobTable)
+
+
+def get_job_table():
+    """Table of the current version of the combined data"""
+    return job_table_cache.get()
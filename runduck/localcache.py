@@ -0,0 +1,94 @@
+"""Objects built from the combined data and kept in memory by each process
+
+The combined data gets a new version every time it's saved (see
+jobinfo.save_combined). Objects are rebuilt the first time they are used after
+the version changes.
+
+While the invalidation listener is connected (see invalidation.py) it keeps the
+current meta up to date, so it's not read from redis on every request.
+"""
+import threading
+from runduck.datainteraction import DataInteraction
+
+_caches = []
+# meta received by the invalidation listener, None to read it from redis
+_known_meta = None
+
+
+def get_combined_meta(interaction=None):
+    """Version, number of jobs and update time of the combined data"""
+    if _known_meta is not None:
+        return dict(_known_meta)
+    interaction = interaction or DataInteraction()
+    return interaction.get_redis("combined.meta") or {}
+
+
+def set_known_meta(meta):
+    """Use this meta until the next one, and drop objects of older versions
+
+    :param meta: current meta of the combined data, None to read it from redis
+    """
+    global _known_meta
+    _known_meta = None if meta is None else dict(meta)
+    if meta is not None:
+        for cache in _caches:
+            if cache.meta_key == "combined.meta":
+                cache.discard(meta.get("version"))
+
+
+def get_combined_version(interaction=None):
+    """Version of the combined data, changes every time it's saved"""
+    return get_combined_meta(interaction).get("version")
+
+
+class VersionedCache(object):
+    """Keep an object built from the combined data until the data changes
+
+    :param build: function that receives the combined rows and the version
+    :param data_key: data the object is built from, defaults to the combined rows
+    :param meta_key: meta with the version of the data
+    :param load: function that reads the data from a DataInteraction, instead
+        of data_key
+    """
+
+    def __init__(self, build, data_key="combined", meta_key="combined.meta", load=None):
+        self.build = build
+        self.data_key = data_key
+        self.meta_key = meta_key
+        self.load = load or (lambda interaction: interaction.get_redis(data_key))
+        self.value = None
+        self.version = None
+        self.lock = threading.Lock()
+        _caches.append(self)
+
+    def get(self):
+        """Get the object for the current version of the combined data"""
+        interaction = DataInteraction()
+        version = self.get_version(interaction)
+        if self.value is not None and self.version == version:
+            return self.value
+
+        with self.lock:
+            if self.value is None or self.version != version:
+                rows = self.load(interaction) or []
+                self.value = self.build(rows, version)
+                self.version = version
+            return self.value
+
+    def get_version(self, interaction):
+        if self.meta_key == "combined.meta":
+            return get_combined_version(interaction)
+        return (interaction.get_redis(self.meta_key) or {}).get("version")
+
+    def clear(self):
+        """Drop the object, it's rebuilt on the next get"""
+        with self.lock:
+            self.value = None
+            self.version = None
+
+    def discard(self, version):
+        """Drop the object if it's not for this version"""
+        with self.lock:
+            if self.version != version:
+                self.value = None
+                self.version = None
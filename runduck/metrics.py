@@ -0,0 +1,214 @@
+"""Counters and latency histograms in the Prometheus text format
+
+Metrics are kept in memory by each process and served at /metrics.
+"""
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# seconds, from a redis call to a full combine
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+)
+
+# metrics served at /metrics
+_metrics = []
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (
+            name,
+            f"{value}".replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric(object):
+    """Values of a metric by label values
+
+    :param registry: list the metric is added to, defaults to the metrics
+        served at /metrics
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        (_metrics if registry is None else registry).append(self)
+
+    def get_key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(f"{labels[name]}" for name in self.labelnames)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self.render_value(list(zip(self.labelnames, key)), value))
+        return lines
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.get_key(labels), 0)
+
+    def render_value(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {format_value(value)}"]
+
+
+class Histogram(Metric):
+    """Count of observations per bucket, plus their sum and count"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None
+    ):
+        super().__init__(name, documentation, labelnames, registry=registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # count per bucket (not cumulative), sum
+                counts = self.values[key] = [[0] * len(self.buckets), 0]
+            counts[0][bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def get_count(self, **labels):
+        counts = self.values.get(self.get_key(labels))
+        return sum(counts[0]) if counts else 0
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the block takes, labels can be changed in the block"""
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render_value(self, labels, value):
+        bucket_counts, total = value
+        lines = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets, bucket_counts):
+            cumulative += count
+            bucket_labels = labels + [("le", format_value(bucket))]
+            lines.append(
+                f"{self.name}_bucket{format_labels(bucket_labels)} {cumulative}"
+            )
+        lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+def render(registry=None):
+    """All the metrics in the Prometheus text format"""
+    lines = []
+    for metric in _metrics if registry is None else registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def clear(registry=None):
+    for metric in _metrics if registry is None else registry:
+        metric.clear()
+
+
+rundeck_request_seconds = Histogram(
+    "runduck_rundeck_request_seconds",
+    "Rundeck API calls, until the response headers are received",
+    ("env", "data_key", "status"),
+)
+redis_requests = Counter(
+    "runduck_redis_requests_total",
+    "Values read from (hit or miss) and written to the redis cache",
+    ("data_key", "operation", "result"),
+)
+redis_bytes = Counter(
+    "runduck_redis_bytes_total",
+    "Size of the values read from and written to the redis cache",
+    ("data_key", "operation"),
+)
+combine_phase_seconds = Histogram(
+    "runduck_combine_phase_seconds",
+    "Phases of combine_data: read, combine and save",
+    ("phase",),
+)
+http_request_seconds = Histogram(
+    "runduck_http_request_seconds",
+    "Requests to the runduck API, by route",
+    ("method", "route", "status"),
+)
+
+
+def observe_redis_read(data_key, raw_values):
+    """Count hits, misses and bytes of values read from redis"""
+    hits = [raw for raw in raw_values if raw is not None]
+    if hits:
+        redis_requests.inc(len(hits), data_key=data_key, operation="get", result="hit")
+        redis_bytes.inc(sum(map(len, hits)), data_key=data_key, operation="get")
+    if len(hits) < len(raw_values):
+        redis_requests.inc(
+            len(raw_values) - len(hits),
+            data_key=data_key,
+            operation="get",
+            result="miss",
+        )
+
+
+def observe_redis_write(data_key, raw_values):
+    """Count values and bytes written to redis"""
+    redis_requests.inc(len(raw_values), data_key=data_key, operation="set", result="ok")
+    redis_bytes.inc(sum(map(len, raw_values)), data_key=data_key, operation="set")
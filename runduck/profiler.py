@@ -0,0 +1,170 @@
+"""Profile API requests on demand
+
+With PROFILING_ENABLED in app.cfg, a request with the header
+"X-Runduck-Profile: 1" or the query parameter "profile=true" runs with cProfile.
+The profile is saved in PROFILING_DIR, only the last PROFILING_MAX_FILES are
+kept, and the slowest functions can be seen with /api/profiles/<profile_id>.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import tempfile
+import threading
+from functools import wraps
+from flask import request
+from runduck import app
+
+PROFILE_HEADER = "X-Runduck-Profile"
+SORT_KEYS = ("cumulative", "tottime", "calls")
+
+_files_lock = threading.Lock()
+
+
+class ProfileNotFoundError(Exception):
+    code = 404
+
+
+def is_enabled():
+    return bool(app.config.get("PROFILING_ENABLED", False))
+
+
+def get_profile_dir():
+    return app.config.get(
+        "PROFILING_DIR", os.path.join(tempfile.gettempdir(), "runduck-profiles")
+    )
+
+
+def is_requested():
+    """Profiling is enabled and the request asks for it"""
+    if not is_enabled():
+        return False
+    value = request.headers.get(PROFILE_HEADER) or request.args.get("profile")
+    return (value or "").lower() in ("1", "true", "yes")
+
+
+def profile_request(view):
+    """Decorator for the API resources, profiles the request if requested"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_requested():
+            return view(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        response = None
+        profiler.enable()
+        try:
+            response = view(*args, **kwargs)
+            return response
+        finally:
+            profiler.disable()
+            profile_id = save_profile(
+                profiler,
+                {
+                    "method": request.method,
+                    "path": request.full_path.rstrip("?"),
+                    "status": getattr(response, "status_code", None),
+                    "duration": round(time.perf_counter() - start, 4),
+                },
+            )
+            if response is not None and hasattr(response, "headers"):
+                response.headers[PROFILE_HEADER + "-Id"] = profile_id
+
+    return wrapper
+
+
+def save_profile(profiler, info):
+    """Save the profile and its info, and delete the oldest ones
+    Ids start with the time so they sort in order
+
+    :return: id of the profile
+    """
+    profile_dir = get_profile_dir()
+    os.makedirs(profile_dir, exist_ok=True)
+    # microseconds, time.time_ns is not available in python 3.6
+    profile_id = f"{int(time.time() * 1e6)}-{uuid.uuid4().hex[:8]}"
+    info = dict(info, id=profile_id, time=time.strftime("%Y-%m-%dT%H:%M:%S%z"))
+    profiler.dump_stats(os.path.join(profile_dir, f"{profile_id}.prof"))
+    with open(os.path.join(profile_dir, f"{profile_id}.json"), "w") as file_obj:
+        json.dump(info, file_obj)
+
+    max_files = int(app.config.get("PROFILING_MAX_FILES", 20))
+    with _files_lock:
+        for old_id in list_profile_ids()[:-max_files]:
+            for extension in ("prof", "json"):
+                try:
+                    os.remove(os.path.join(profile_dir, f"{old_id}.{extension}"))
+                except FileNotFoundError:
+                    pass
+    return profile_id
+
+
+def list_profile_ids():
+    """Ids of the saved profiles, oldest first"""
+    profile_dir = get_profile_dir()
+    if not os.path.isdir(profile_dir):
+        return []
+    return sorted(
+        name[: -len(".prof")]
+        for name in os.listdir(profile_dir)
+        if name.endswith(".prof")
+    )
+
+
+def get_profile_path(profile_id, extension):
+    if not re.fullmatch(r"[0-9]+-[0-9a-f]+", profile_id or ""):
+        raise ProfileNotFoundError(f"{profile_id} is not a valid profile id")
+    path = os.path.join(get_profile_dir(), f"{profile_id}.{extension}")
+    if not os.path.exists(path):
+        raise ProfileNotFoundError(f"Profile {profile_id} not found")
+    return path
+
+
+def get_profile_info(profile_id):
+    with open(get_profile_path(profile_id, "json")) as file_obj:
+        return json.load(file_obj)
+
+
+def list_profiles():
+    """Info of the saved profiles, newest first"""
+    profiles = []
+    for profile_id in reversed(list_profile_ids()):
+        try:
+            profiles.append(get_profile_info(profile_id))
+        except (ProfileNotFoundError, ValueError):
+            # deleted or being written
+            continue
+    return profiles
+
+
+def get_top_functions(profile_id, top=30, sort="cumulative"):
+    """Functions of a profile that took the most time
+
+    :param sort: one of SORT_KEYS
+    :return: info of the profile with a list of functions
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    stats = pstats.Stats(get_profile_path(profile_id, "prof"))
+    stats.sort_stats(sort)
+    functions = []
+    for function in stats.fcn_list[:top]:
+        primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[function]
+        file_name, line, name = function
+        functions.append(
+            {
+                "function": f"{file_name}:{line}({name})",
+                "calls": calls,
+                "primitive_calls": primitive_calls,
+                "total_time": round(total_time, 6),
+                "cumulative_time": round(cumulative_time, 6),
+            }
+        )
+    return dict(
+        get_profile_info(profile_id), total_time=stats.total_tt, functions=functions
+    )
@@ -0,0 +1,244 @@
+"""Keep the cached data fresh by refreshing a few jobs at a time
+
+Each environment has a sorted set with the time each job was last refreshed.
+Every REFRESH_INTERVAL seconds the jobs that are older than REFRESH_JOB_TTL
+are read again from rundeck, at most REFRESH_BATCH_SIZE at a time and at most
+REFRESH_RATE requests per second, and the combined data is patched with the
+jobs that changed. Projects and job lists are read again every
+REFRESH_LIST_TTL seconds, and the data is recombined from the cache when jobs
+were added or removed, after reading the jobs that were added.
+
+Start it with:
+    python worker.py
+"""
+import time
+import random
+import threading
+from datetime import datetime
+from runduck import app
+from runduck.datainteraction import DataSource
+from runduck.datainteraction import DataInteraction
+from runduck.datainteraction import RundeckApiError
+from runduck.datainteraction import get_env_setting
+from runduck.jobinfo import update_combined
+from runduck.combinetask import start_combine
+
+# job id -> time of last refresh
+REFRESH_KEY = "runduck:{env}:refresh"
+# time of last refresh of projects and job lists
+LISTS_KEY = "runduck:{env}:lists_refreshed"
+
+
+class TokenBucket(object):
+    """Allow rate requests per second on average, and bursts up to capacity"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Wait until there are enough tokens and take them"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_updated(updated):
+    """Timestamp of the date set by DataInteraction.set_redis, 0 if missing"""
+    if not updated:
+        return 0
+    return datetime.strptime(updated, "%Y-%m-%dT%H:%M:%S%z").timestamp()
+
+
+class EnvironmentRefresher(object):
+    """Refresh the cached data of one environment"""
+
+    def __init__(self, env, live_data_source=DataSource.API):
+        self.env = env
+        self.interaction = DataInteraction(live_data_source=live_data_source, env=env)
+        self.redis = self.interaction.redis
+        self.refresh_key = REFRESH_KEY.format(env=env)
+        self.lists_key = LISTS_KEY.format(env=env)
+        self.bucket = TokenBucket(
+            rate=float(get_env_setting(env, "REFRESH_RATE", 2)),
+            capacity=int(get_env_setting(env, "REFRESH_BURST", 5)),
+        )
+
+    def fetch(self, data_key, **args):
+        """Read from the live data source, waiting for the rate limit"""
+        self.bucket.acquire()
+        return self.interaction.fetch_data(data_key, **args)
+
+    def refresh_lists(self, force=False):
+        """Read projects and job lists again if they are older than REFRESH_LIST_TTL
+
+        :return: True if jobs were added or removed
+        :rtype: bool
+        """
+        ttl = float(get_env_setting(self.env, "REFRESH_LIST_TTL", 900))
+        last_refresh = self.redis.get(self.lists_key)
+        if not force and last_refresh and time.time() - float(last_refresh) < ttl:
+            return False
+
+        projects = self.fetch("projects")
+        self.interaction.set_redis("projects", projects)
+        job_ids = set()
+        for project in projects:
+            jobs = self.fetch("jobs", project=project["name"])
+            self.interaction.set_redis("jobs", jobs, project=project["name"])
+            job_ids.update(job["id"] for job in jobs)
+
+        known_ids = {
+            member.decode("utf-8")
+            for member in self.redis.zrange(self.refresh_key, 0, -1)
+        }
+        added = sorted(job_ids - known_ids)
+        removed = sorted(known_ids - job_ids)
+        pipe = self.redis.pipeline(transaction=False)
+        if added:
+            # jobs that are already cached keep the time they were cached
+            metadata = self.interaction.get_many(
+                "job.metadata", [{"jobid": job_id} for job_id in added]
+            )
+            pipe.zadd(
+                self.refresh_key,
+                {
+                    job_id: parse_updated((job_metadata or {}).get("updated"))
+                    for job_id, job_metadata in zip(added, metadata)
+                },
+                nx=True,
+            )
+        if removed:
+            pipe.zrem(self.refresh_key, *removed)
+        pipe.set(self.lists_key, time.time())
+        pipe.execute()
+
+        if added or removed:
+            app.logger.info(
+                f"[{self.env}] {len(added)} jobs added, {len(removed)} removed"
+            )
+        return bool(added or removed)
+
+    def refresh_batch(self):
+        """Read the jobs that are older than REFRESH_JOB_TTL again, a batch at a time
+
+        :return: number of jobs refreshed
+        """
+        ttl = float(get_env_setting(self.env, "REFRESH_JOB_TTL", 3600))
+        batch_size = int(get_env_setting(self.env, "REFRESH_BATCH_SIZE", 20))
+        job_ids = [
+            member.decode("utf-8")
+            for member in self.redis.zrangebyscore(
+                self.refresh_key, "-inf", time.time() - ttl, start=0, num=batch_size
+            )
+        ]
+        self.refresh_jobs(job_ids)
+        return len(job_ids)
+
+    def uncached_job_ids(self):
+        """Ids of the jobs that were added to the lists but were never cached"""
+        return [
+            member.decode("utf-8")
+            for member in self.redis.zrangebyscore(self.refresh_key, 0, 0)
+        ]
+
+    def refresh_jobs(self, job_ids, update=True):
+        """Read the jobs again and mark them as refreshed
+
+        :param job_ids: ids of the jobs to read
+        :param update: patch the combined data with the jobs that changed, jobs
+            that are not combined yet don't need it
+        """
+        refreshed = {}
+        removed = []
+        changes = []
+        for job_id in job_ids:
+            try:
+                metadata = self.fetch("job.metadata", jobid=job_id)
+                definition = self.fetch("job.definition", jobid=job_id)
+            except RundeckApiError as ex:
+                if ex.status_code == 404:
+                    removed.append(job_id)
+                    changes.append((self.env, job_id, None))
+                else:
+                    # try again after the ttl
+                    app.logger.error(f"[{self.env}] Error refreshing {job_id}: {ex}")
+                    self.redis.zadd(self.refresh_key, {job_id: time.time()})
+                continue
+            refreshed[job_id] = (metadata, definition)
+
+        if refreshed:
+            args_list = [{"jobid": job_id} for job_id in refreshed]
+            self.interaction.set_many(
+                "job.metadata", [value[0] for value in refreshed.values()], args_list
+            )
+            self.interaction.set_many(
+                "job.definition", [value[1] for value in refreshed.values()], args_list
+            )
+            for job_id, (metadata, definition) in refreshed.items():
+                job = dict(metadata)
+                job.update(next(iter(definition)))
+                changes.append((self.env, job_id, job))
+
+        if changes and update:
+            # raises CombineLockedError if a combine takes too long, the jobs
+            # are not marked as refreshed so they are read again next time
+            update_combined(changes)
+        pipe = self.redis.pipeline(transaction=False)
+        if refreshed:
+            pipe.zadd(self.refresh_key, {job_id: time.time() for job_id in refreshed})
+        if removed:
+            pipe.zrem(self.refresh_key, *removed)
+        pipe.execute()
+
+    def run(self, stop_event):
+        """Refresh until stop_event is set"""
+        interval = float(get_env_setting(self.env, "REFRESH_INTERVAL", 10))
+        # environments don't start at the same time
+        stop_event.wait(random.uniform(0, interval))
+        while not stop_event.is_set():
+            try:
+                if self.refresh_lists():
+                    # new jobs are read first, or they are combined without
+                    # their definitions
+                    self.refresh_jobs(self.uncached_job_ids(), update=False)
+                    # waits for a combine that is already running
+                    start_combine(cache_only=True, wait=True)
+                self.refresh_batch()
+            except Exception:
+                app.logger.exception(f"[{self.env}] Error refreshing data")
+            stop_event.wait(interval)
+
+
+def run_forever(live_data_source=DataSource.API, stop_event=None):
+    """Refresh all the environments, each one in its own thread"""
+    stop_event = stop_event or threading.Event()
+    threads = [
+        threading.Thread(
+            target=EnvironmentRefresher(env, live_data_source).run,
+            args=(stop_event,),
+            name=f"runduck-refresh-{env}",
+            daemon=True,
+        )
+        for env in app.config["ENV"]
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        stop_event.set()
@@ -0,0 +1,121 @@
+"""Keep serialized API responses in memory and answer conditional requests
+
+Responses are cached per version of the combined data and per query string.
+A response can also expire before the data changes, for example the job list
+has the next execution of each job, which changes when that time has passed.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from flask import request
+from runduck import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class CachedResponse(object):
+    """Serialized response body, with compressed copies made on first use"""
+
+    def __init__(self, body, etag, last_modified=None, expires=None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+        self.encoded = {}
+        self.lock = threading.Lock()
+
+    def is_expired(self, now_date=None):
+        return self.expires is not None and self.expires <= (now_date or datetime.now())
+
+    def get_body(self, encoding=None):
+        """Get the body, compressed with gzip or br"""
+        if not encoding:
+            return self.body
+        with self.lock:
+            if encoding not in self.encoded:
+                if encoding == "br":
+                    self.encoded[encoding] = brotli.compress(self.body, quality=5)
+                else:
+                    self.encoded[encoding] = gzip.compress(self.body, 6)
+            return self.encoded[encoding]
+
+
+class ResponseCache(object):
+    """Least recently used cache of responses"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Get a response that hasn't expired, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.is_expired():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, match):
+        """Remove the entries with a key for which match(key) is true"""
+        with self.lock:
+            for key in [key for key in self.entries if match(key)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+response_cache = ResponseCache(app.config.get("RESPONSE_CACHE_ENTRIES", 64))
+
+
+def make_etag(*parts):
+    """ETag from the values the response depends on"""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+
+
+def get_accepted_encoding():
+    """Best compression accepted by the client"""
+    accepted = request.accept_encodings
+    if brotli and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def make_response(entry):
+    """Response for a cached entry, 304 if the client has the same version"""
+    if entry.etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        encoding = get_accepted_encoding()
+        response = app.response_class(
+            entry.get_body(encoding), mimetype="application/json"
+        )
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(entry.etag)
+    response.vary.add("Accept-Encoding")
+    if entry.last_modified:
+        response.last_modified = entry.last_modified
+    # clients have to check the ETag every time
+    response.cache_control.no_cache = True
+    return response
@@ -1,8 +1,12 @@
 """Runduck API"""
 import os
+import time
+from flask import g
+from flask import request
 from flask import render_template
 from flask import send_from_directory
 from runduck import app
+from runduck import metrics
 
 build_path = os.path.abspath("build")
 
@@ -33,3 +37,29 @@ def serve_static(path):
     static_path = f"{build_path}/static"
     return send_from_directory(static_path, path)
 
+
+@app.route("/metrics")
+def serve_metrics():
+    """Metrics of this process in the Prometheus text format"""
+    return app.response_class(
+        metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    """Time each request by route, e.g. /api/job/<string:env>/<string:jobid>"""
+    start = g.get("request_start")
+    if start is not None:
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=request.url_rule.rule if request.url_rule else "unmatched",
+            status=response.status_code,
+        )
+    return response
@@ -0,0 +1,234 @@
+"""Calculate next executions of cron schedules without parsing them every time"""
+import heapq
+import threading
+from bisect import bisect_left
+from bisect import bisect_right
+from datetime import datetime
+from datetime import timedelta
+from functools import lru_cache
+from itertools import islice
+import croniter
+from runduck.jobquery import is_enabled
+from runduck.localcache import VersionedCache
+
+# distinct cron expressions kept parsed
+CRON_CACHE_SIZE = 4096
+
+
+class InvalidCronError(ValueError):
+    """Cron expression that already failed before"""
+
+
+@lru_cache(maxsize=CRON_CACHE_SIZE)
+def parse_cron(cron):
+    """Parse a cron expression once, raises croniter errors if it's invalid"""
+    return croniter.croniter.expand(cron)
+
+
+class CompiledCroniter(croniter.croniter):
+    """croniter that reuses the parsed expression from parse_cron"""
+
+    @classmethod
+    def expand(cls, expr_format, *args, **kwargs):
+        if args or kwargs:
+            return super().expand(expr_format, *args, **kwargs)
+        expanded, nth_weekday_of_month = parse_cron(expr_format)
+        # croniter changes these while calculating, each instance gets a copy
+        return (
+            [list(field) for field in expanded],
+            {key: set(value) for key, value in nth_weekday_of_month.items()},
+        )
+
+
+def get_next_fire_time(cron, now_date):
+    """Next time the cron expression fires after now_date"""
+    return CompiledCroniter(cron, now_date).get_next(datetime)
+
+
+class ScheduleCache(object):
+    """Next execution of each cron expression, recalculated only when it's past
+    The next execution only depends on the cron and the current time, so jobs
+    with the same schedule share the same entry
+    """
+
+    def __init__(self):
+        # cron -> (datetime, iso date) or error message
+        self.next_executions = {}
+
+    def get_next_execution(self, cron, now_date=None):
+        """Get next execution as ISO date
+        Raises the croniter error the first time an expression fails, and
+        InvalidCronError after that
+        """
+        if not cron:
+            return None
+        if not now_date:
+            now_date = datetime.now()
+
+        cached = self.next_executions.get(cron)
+        if isinstance(cached, str):
+            raise InvalidCronError(cached)
+        if cached is None or cached[0] <= now_date:
+            try:
+                next_date = get_next_fire_time(cron, now_date)
+            except Exception as ex:
+                self.next_executions[cron] = f"{cron}: {ex}"
+                raise
+            cached = (next_date, next_date.isoformat())
+            self.next_executions[cron] = cached
+        return cached[1]
+
+
+schedule_cache = ScheduleCache()
+
+
+class ScheduleIndex(object):
+    """Upcoming executions of all the enabled jobs, in order of time
+
+    The heap has the next execution of each job. Executions of each job are
+    calculated once up to the latest time requested and kept in a list, and
+    executions that are past are dropped when the heap is advanced.
+    """
+
+    # fields of the combined rows returned with each execution
+    FIELDS = ("id", "env", "project_name", "group", "name")
+    # executions are kept in memory up to this number of hours from now
+    CACHE_HOURS = 48
+
+    def __init__(self, rows, version=None, now_date=None):
+        self.version = version
+        self.lock = threading.Lock()
+        self.now_date = now_date or datetime.now()
+        self.jobs = {}
+        # job id -> next executions (all of them until horizon), horizon
+        self.fire_times = {}
+        self.horizons = {}
+        self.heap = []
+        for row in rows:
+            if not (is_enabled(row) and row.get("cron")):
+                continue
+            try:
+                next_date = get_next_fire_time(row["cron"], self.now_date)
+            except Exception:
+                # logged by get_jobs
+                continue
+            self.jobs[row["id"]] = {field: row.get(field) for field in self.FIELDS}
+            self.jobs[row["id"]]["cron"] = row["cron"]
+            self.fire_times[row["id"]] = [next_date]
+            self.horizons[row["id"]] = next_date
+            self.heap.append((next_date, row["id"]))
+        heapq.heapify(self.heap)
+
+    def advance(self, now_date):
+        """Drop executions that happened before now_date"""
+        if now_date <= self.now_date:
+            return
+        self.now_date = now_date
+        while self.heap and self.heap[0][0] <= now_date:
+            _, job_id = heapq.heappop(self.heap)
+            fire_times = self.fire_times[job_id]
+            del fire_times[: bisect_right(fire_times, now_date)]
+            if not fire_times:
+                next_date = get_next_fire_time(self.jobs[job_id]["cron"], now_date)
+                fire_times.append(next_date)
+                self.horizons[job_id] = max(self.horizons[job_id], next_date)
+            heapq.heappush(self.heap, (fire_times[0], job_id))
+
+    def extend(self, job_id, to_date):
+        """Calculate executions of a job until to_date"""
+        if self.horizons[job_id] >= to_date:
+            return
+        fire_times = self.fire_times[job_id]
+        iterator = CompiledCroniter(self.jobs[job_id]["cron"], fire_times[-1])
+        next_date = iterator.get_next(datetime)
+        while next_date <= to_date:
+            fire_times.append(next_date)
+            next_date = iterator.get_next(datetime)
+        # the first one after to_date is kept so the horizon is past to_date
+        fire_times.append(next_date)
+        self.horizons[job_id] = next_date
+
+    def expand(self, job_id, from_date, to_date):
+        """Calculate executions of a job between from_date and to_date without
+        keeping them, for time windows that are far from now"""
+        iterator = CompiledCroniter(
+            self.jobs[job_id]["cron"], from_date - timedelta(seconds=1)
+        )
+        fire_times = []
+        next_date = iterator.get_next(datetime)
+        while next_date <= to_date:
+            fire_times.append(next_date)
+            next_date = iterator.get_next(datetime)
+        return fire_times
+
+    def get_job_ids_until(self, to_date):
+        """Jobs with their next execution before to_date
+        Only visits the part of the heap that is before to_date
+        """
+        job_ids = []
+        stack = [0] if self.heap else []
+        while stack:
+            position = stack.pop()
+            next_date, job_id = self.heap[position]
+            if next_date > to_date:
+                continue
+            job_ids.append(job_id)
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(self.heap):
+                    stack.append(child)
+        return job_ids
+
+    def get_executions(self, from_date=None, to_date=None, env=None, limit=None):
+        """Executions between from_date and to_date (both included)
+
+        :param from_date: defaults to now, executions before now are not known
+        :param to_date: defaults to 24 hours after from_date
+        :param env: only jobs of this environment
+        :param limit: maximum number of executions
+        :return: list of (datetime, job) in order of time
+        """
+        now_date = datetime.now()
+        from_date = max(from_date or now_date, now_date)
+        to_date = to_date or from_date + timedelta(hours=24)
+
+        with self.lock:
+            self.advance(now_date)
+            executions = []
+            for job_id in self.get_job_ids_until(to_date):
+                job = self.jobs[job_id]
+                if env and job["env"] != env:
+                    continue
+                if to_date > now_date + timedelta(hours=self.CACHE_HOURS):
+                    fire_times = self.expand(job_id, from_date, to_date)
+                else:
+                    self.extend(job_id, to_date)
+                    fire_times = self.fire_times[job_id]
+                start = bisect_left(fire_times, from_date)
+                end = bisect_right(fire_times, to_date)
+                executions.append(
+                    [(fire_time, job_id) for fire_time in fire_times[start:end]]
+                )
+
+        merged = heapq.merge(*executions)
+        if limit:
+            merged = islice(merged, limit)
+        return [(fire_time, self.jobs[job_id]) for fire_time, job_id in merged]
+
+
+schedule_index_cache = VersionedCache(
+    lambda rows, version: ScheduleIndex(rows, version=version)
+)
+
+
+def get_upcoming_executions(from_date=None, to_date=None, env=None, limit=None):
+    """Upcoming executions of all the jobs, see ScheduleIndex.get_executions"""
+    executions = schedule_index_cache.get().get_executions(
+        from_date=from_date, to_date=to_date, env=env, limit=limit
+    )
+    return [
+        dict(
+            {key: value for key, value in job.items() if key != "cron"},
+            execution=fire_time.isoformat(),
+        )
+        for fire_time, job in executions
+    ]
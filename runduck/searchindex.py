@@ -0,0 +1,286 @@
+"""Full text search over the job definitions
+
+When the data is combined, the words of each job (name, group, description,
+options and workflow commands) are counted and saved as one document per job,
+in a field of a redis hash, so refreshing a job only writes its document.
+Each process builds an inverted index from the documents, once per version,
+and ranks the jobs that have all the searched words with BM25.
+"""
+import math
+import uuid
+from collections import defaultdict
+from bisect import bisect_left
+from runduck import codec
+from runduck.datainteraction import DataInteraction
+from runduck.jobdiff import read_definitions
+from runduck.jobquery import tokenize
+from runduck.jobtable import get_job_table
+from runduck.localcache import VersionedCache
+
+# fields of a document and the weight of their words
+FIELDS = (
+    ("name", 3),
+    ("group", 2),
+    ("description", 1),
+    ("options", 1),
+    ("workflow", 1),
+)
+# hash with the document of each job, by combined id
+DOCUMENTS_KEY = "runduck:search"
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# keys of the workflow commands with text to search
+COMMAND_KEYS = ("exec", "script", "scriptfile", "scripturl", "args", "description")
+
+
+def get_command_texts(command):
+    texts = [command.get(key) for key in COMMAND_KEYS]
+    jobref = command.get("jobref") or {}
+    texts.extend([jobref.get("group"), jobref.get("name"), jobref.get("args")])
+    errorhandler = command.get("errorhandler")
+    if errorhandler:
+        texts.extend(get_command_texts(errorhandler))
+    return texts
+
+
+def get_texts(job):
+    """Text of each field of a job definition"""
+    options = []
+    for option in job.get("options") or []:
+        options.extend(
+            [option.get("name"), option.get("value"), option.get("description")]
+        )
+        options.extend(option.get("values") or [])
+    commands = (job.get("sequence") or {}).get("commands") or []
+    return {
+        "name": [job.get("name")],
+        "group": [job.get("group")],
+        "description": [job.get("description")],
+        "options": options,
+        "workflow": [
+            text for command in commands for text in get_command_texts(command)
+        ],
+    }
+
+
+def index_document(job):
+    """Weighted count of the words of a job, and in which fields they are
+
+    :return: {"terms": {word: [weight, field bits]}, "length": number of words}
+    """
+    texts = get_texts(job)
+    terms = {}
+    length = 0
+    for bit, (field, weight) in enumerate(FIELDS):
+        for text in texts[field]:
+            if not isinstance(text, str):
+                continue
+            for token in tokenize(text):
+                term = terms.setdefault(token, [0, 0])
+                term[0] += weight
+                term[1] |= 1 << bit
+                length += 1
+    return {"terms": terms, "length": length}
+
+
+def build_documents(definitions):
+    """Documents of the jobs by combined id
+
+    :param definitions: job definitions by combined id, see jobdiff.get_definitions
+    """
+    return {
+        row_id: index_document(job)
+        for row_id, job in definitions.items()
+        if job is not None
+    }
+
+
+def save_meta(interaction, count):
+    """New version of the documents, so the indexes are rebuilt"""
+    interaction.set_redis("search.meta", {"version": uuid.uuid4().hex, "count": count})
+
+
+def save_documents(documents, interaction=None):
+    """Replace all the documents, one hash field per job"""
+    interaction = interaction or DataInteraction()
+    pipe = interaction.redis.pipeline(transaction=True)
+    pipe.delete(DOCUMENTS_KEY)
+    for row_id, document in documents.items():
+        pipe.hset(DOCUMENTS_KEY, row_id, codec.encode(document))
+    pipe.execute()
+    save_meta(interaction, len(documents))
+
+
+def load_documents(interaction=None):
+    """All the documents by combined id"""
+    interaction = interaction or DataInteraction()
+    return {
+        row_id.decode("utf-8"): codec.decode(raw)
+        for row_id, raw in interaction.redis.hgetall(DOCUMENTS_KEY).items()
+    }
+
+
+def update_documents(rows, removed_ids=()):
+    """Index again the jobs that were refreshed individually, with their
+    cached definitions. Only the documents that changed are written
+
+    :param rows: combined jobs that changed, with id and env
+    :param removed_ids: ids of jobs that were removed
+    :return: True if the documents changed
+    """
+    interaction = DataInteraction()
+    if interaction.get_redis("search.meta") is None:
+        # not combined yet
+        return False
+    definitions = read_definitions(rows)
+    row_ids = list(definitions) + list(removed_ids)
+    if not row_ids:
+        return False
+    saved = dict(zip(row_ids, interaction.redis.hmget(DOCUMENTS_KEY, row_ids)))
+
+    pipe = interaction.redis.pipeline(transaction=True)
+    changed = False
+    for row_id in removed_ids:
+        if saved[row_id] is not None:
+            pipe.hdel(DOCUMENTS_KEY, row_id)
+            changed = True
+    for row_id, job in definitions.items():
+        document = None if job is None else index_document(job)
+        old_document = saved[row_id] and codec.decode(saved[row_id])
+        if document == old_document:
+            continue
+        changed = True
+        if document is None:
+            pipe.hdel(DOCUMENTS_KEY, row_id)
+        else:
+            pipe.hset(DOCUMENTS_KEY, row_id, codec.encode(document))
+    if changed:
+        pipe.hlen(DOCUMENTS_KEY)
+        save_meta(interaction, pipe.execute()[-1])
+    return changed
+
+
+class SearchIndex(object):
+    """Inverted index of the documents: list of (position, weight, field bits)
+    for each word
+    """
+
+    def __init__(self, documents, version=None):
+        """
+        :param documents: {id: document}, see index_document
+        """
+        self.version = version
+        documents = documents or {}
+        self.ids = list(documents)
+        self.lengths = [documents[row_id]["length"] for row_id in self.ids]
+        average_length = sum(self.lengths) / len(self.lengths) if self.ids else 0
+        # part of the BM25 score that only depends on the document length
+        self.norms = [
+            K1 * (1 - B + B * length / (average_length or 1)) for length in self.lengths
+        ]
+        self.postings = defaultdict(list)
+        for position, row_id in enumerate(self.ids):
+            for token, (weight, fields) in documents[row_id]["terms"].items():
+                self.postings[token].append((position, weight, fields))
+        # sorted words for prefix search
+        self.vocabulary = sorted(self.postings)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_words(self, token):
+        """Words starting with token"""
+        words = []
+        for word in self.vocabulary[bisect_left(self.vocabulary, token) :]:
+            if not word.startswith(token):
+                break
+            words.append(word)
+        return words
+
+    def score_words(self, words, candidates=None):
+        """Score and fields of the documents with any of the words
+
+        :param candidates: only score these positions, defaults to all
+        :return: {position: (score, field bits)}
+        """
+        scores = {}
+        norms = self.norms
+        for word in words:
+            postings = self.postings[word]
+            idf = math.log(
+                1 + (len(self.ids) - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for position, weight, fields in postings:
+                if candidates is not None and position not in candidates:
+                    continue
+                score = idf * weight * (K1 + 1) / (weight + norms[position])
+                if position in scores:
+                    # the best matching word counts
+                    best, best_fields = scores[position]
+                    score, fields = max(score, best), fields | best_fields
+                scores[position] = (score, fields)
+        return scores
+
+    def search(self, q):
+        """Jobs with all the words of q (prefix match), best first
+
+        :return: list of (id, score, names of the fields that matched)
+        """
+        words = {token: self.get_words(token) for token in set(tokenize(q))}
+        if not words:
+            return []
+
+        # start with the word in less documents, the others only score those
+        scores = None
+        for token in sorted(
+            words, key=lambda token: sum(len(self.postings[w]) for w in words[token])
+        ):
+            token_scores = self.score_words(words[token], scores)
+            if scores is not None:
+                token_scores = {
+                    position: (
+                        scores[position][0] + score,
+                        scores[position][1] | fields,
+                    )
+                    for position, (score, fields) in token_scores.items()
+                }
+            scores = token_scores
+            if not scores:
+                return []
+
+        hits = sorted(scores.items(), key=lambda item: (-item[1][0], self.ids[item[0]]))
+        return [
+            (
+                self.ids[position],
+                round(score, 4),
+                [field for bit, (field, _) in enumerate(FIELDS) if fields & 1 << bit],
+            )
+            for position, (score, fields) in hits
+        ]
+
+
+search_index_cache = VersionedCache(
+    lambda documents, version: SearchIndex(documents, version=version),
+    meta_key="search.meta",
+    load=load_documents,
+)
+
+
+def search_jobs(q, env=None, limit=50):
+    """Jobs with all the words in their definition, best first
+
+    :param q: words to search, the last letters of a word can be left out
+    :param env: only jobs of this environment
+    :param limit: maximum number of jobs
+    :return: {"total", "data"}, each job has its score and the fields that matched
+    """
+    job_table = get_job_table()
+    rows = []
+    for row_id, score, fields in search_index_cache.get().search(q):
+        record = job_table.get(row_id)
+        if record is None or (env is not None and record.env != env):
+            continue
+        rows.append(dict(record.to_dict(), score=score, matches=fields))
+    return {"total": len(rows), "data": rows[:limit]}
@@ -0,0 +1,98 @@
+"""Test the cache codec
+python -m pytest runduck/tests/test_codec.py -v -s
+"""
+import timeit
+import unittest
+from functools import partial
+import jsonpickle
+import pytest
+from runduck import app
+from runduck import codec
+from runduck.datainteraction import DataInteraction
+
+
+class CodecTestCase(unittest.TestCase):
+    """Tests for codec module"""
+
+    def setUp(self):
+        app.config.from_pyfile("../app.cfg")
+        self.value = {
+            "name": "daily run",
+            "jobs": [{"id": index, "enabled": index % 2 == 0} for index in range(100)],
+        }
+
+    def test_encode_decode(self):
+        for name in ("json", "orjson", "msgpack"):
+            if name != "json" and not getattr(codec, name):
+                continue
+            encoded = codec.encode(self.value, codec=name)
+            assert encoded.startswith(codec.MAGIC)
+            assert codec.decode(encoded) == self.value
+
+    def test_compression(self):
+        encoded = codec.encode(
+            self.value, codec="json", compression="zlib", threshold=0
+        )
+        assert encoded[len(codec.MAGIC) + 1 : codec.HEADER_SIZE] == b"z"
+        assert codec.decode(encoded) == self.value
+
+    def test_compression_threshold(self):
+        encoded = codec.encode(
+            self.value, codec="json", compression="zlib", threshold=10 ** 9
+        )
+        assert encoded[len(codec.MAGIC) + 1 : codec.HEADER_SIZE] == b"-"
+
+    def test_decode_jsonpickle(self):
+        """Values cached before the codec was added"""
+        legacy = jsonpickle.encode(self.value).encode("utf-8")
+        assert codec.decode(legacy) == self.value
+
+    def test_decode_invalid_header(self):
+        with pytest.raises(ValueError):
+            codec.decode(codec.MAGIC + b"x-{}")
+
+    @pytest.mark.skip
+    def test_benchmark(self):
+        """Compare codecs on the combined data
+        uncomment skip annotation and run with:
+        python -m pytest -v -s -k benchmark --disable-pytest-warnings
+        """
+        interaction = DataInteraction()
+        key, field = interaction.get_redis_location("combined")
+        value = codec.decode(interaction.redis.hget(key, field))
+        benchmark_key = "runduck:benchmark"
+        print(f"\n{len(value)} combined jobs")
+        variants = [("jsonpickle", None, None)] + [
+            (name, compression, 0)
+            for name in codec.FORMATS
+            for compression in (None, "zlib", "zstd")
+        ]
+        for name, compression, threshold in variants:
+            if name in ("orjson", "msgpack") and not getattr(codec, name):
+                continue
+            if compression == "zstd" and not codec.zstandard:
+                continue
+            if name == "jsonpickle":
+                encode = partial(jsonpickle.encode, value)
+                decode = jsonpickle.decode
+            else:
+                encode = partial(
+                    codec.encode,
+                    value,
+                    codec=name,
+                    compression=compression,
+                    threshold=threshold if compression else float("inf"),
+                )
+                decode = codec.decode
+            raw = encode()
+            encode_time = timeit.timeit(encode, number=5) / 5
+            decode_time = timeit.timeit(lambda: decode(raw), number=5) / 5
+            interaction.redis.hset(benchmark_key, field, raw)
+            memory = interaction.redis.memory_usage(benchmark_key)
+            interaction.redis.delete(benchmark_key)
+            print(
+                f"{name:>10} {str(compression):>5}: "
+                f"encode {encode_time * 1000:8.1f}ms "
+                f"decode {decode_time * 1000:8.1f}ms "
+                f"redis {memory / 1024:10.1f}KB"
+            )
@@ -0,0 +1,86 @@
+"""Test the background combine
+python -m pytest runduck/tests/test_combinetask.py -v -s
+"""
+import time
+import unittest
+from runduck import app
+from runduck.datainteraction import DataInteraction
+from runduck.combinelock import LOCK_KEY
+from runduck.combinetask import CombineProgress
+from runduck.combinetask import CombineRunningError
+from runduck.combinetask import start_combine
+from runduck.combinetask import get_task_status
+
+
+class CombineTaskTestCase(unittest.TestCase):
+    """Tests for combinetask module"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        app.config.from_pyfile("../app.cfg")
+        self.redis = DataInteraction().redis
+        self.redis.delete(LOCK_KEY)
+
+    def wait_for(self, task_id, timeout=10):
+        deadline = time.time() + timeout
+        status = get_task_status(task_id)
+        while status["state"] == "running" and time.time() < deadline:
+            time.sleep(0.05)
+            status = get_task_status(task_id)
+        return status
+
+    def test_progress(self):
+        progress = CombineProgress("test", ["prod", "qa"])
+        progress.start_environment("prod", 4)
+        assert progress.get_status()["eta_seconds"] is None
+        progress.start_environment("qa", 2)
+        progress.project_done("prod", 10)
+        progress.project_done("qa", 5)
+        progress.environment_failed("qa", "unreachable")
+        progress.start_time -= 10
+
+        status = progress.get_status()
+        assert status["projects_done"] == 2
+        assert status["jobs_processed"] == 15
+        assert status["environments_done"] == 1
+        assert status["errors"] == ["[qa] unreachable"]
+        # 1 of 4 projects of prod in 10 seconds
+        assert 29 <= status["eta_seconds"] <= 31
+
+        progress.environment_done("prod")
+        progress.finish()
+        saved = get_task_status("test")
+        assert saved["state"] == "done"
+        assert saved["eta_seconds"] is None
+
+    def test_start_combine(self):
+        task_id = start_combine(cache_only=True, wait=True)
+        status = get_task_status(task_id)
+        assert status["state"] == "done"
+        assert status["environments_done"] == len(app.config["ENV"])
+        assert get_task_status()["id"] == task_id
+        assert not self.redis.exists(LOCK_KEY)
+
+    def test_one_combine_at_a_time(self):
+        lock = self.redis.lock(LOCK_KEY, timeout=10)
+        lock.acquire()
+        try:
+            with self.assertRaises(CombineRunningError):
+                start_combine(cache_only=True)
+            response = self.app.post("/api/jobs/combine")
+            assert response.status_code == 409
+        finally:
+            lock.release()
+
+    def test_combine_api(self):
+        response = self.app.post("/api/jobs/combine")
+        assert response.status_code == 202
+        task_id = response.get_json()["task_id"]
+        assert response.headers["Location"].endswith(f"/api/jobs/combine/{task_id}")
+
+        status = self.wait_for(task_id)
+        assert status["state"] == "done"
+        response = self.app.get(f"/api/jobs/combine/{task_id}")
+        assert response.get_json()["id"] == task_id
+        assert self.app.get("/api/jobs/combine/unknown").status_code == 404
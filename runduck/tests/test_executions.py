@@ -0,0 +1,134 @@
+"""Test the execution history
+python -m pytest runduck/tests/test_executions.py -v -s
+"""
+import unittest
+from unittest.mock import patch
+from runduck import app
+from runduck.datainteraction import DataSource
+from runduck.datainteraction import DataInteraction
+from runduck.executions import percentile
+from runduck.executions import get_stats
+from runduck.executions import ingest_executions
+from runduck.executions import get_execution_summary
+
+JOB_ID = "a694aa5e-360c-4559-bcdf-1a97afb2cac1"
+
+
+def make_execution(execution_id, status="succeeded", duration=60000):
+    started = 1587333900000 + execution_id * 3600000
+    execution = {
+        "id": execution_id,
+        "status": status,
+        "date-started": {"unixtime": started},
+    }
+    if status != "running":
+        execution["date-ended"] = {"unixtime": started + duration}
+    return execution
+
+
+class FakeRundeck(object):
+    """Executions API over a list, newest first"""
+
+    def __init__(self, executions):
+        self.executions = executions
+        self.calls = 0
+
+    def fetch_data(self, data_key, jobid, max, offset):
+        self.calls += 1
+        return {
+            "paging": {"total": len(self.executions)},
+            "executions": self.executions[offset : offset + max],
+        }
+
+
+class ExecutionsTestCase(unittest.TestCase):
+    """Tests for executions module"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        app.config.from_pyfile("../app.cfg")
+        app.config["EXECUTION_PAGE_SIZE"] = 2
+        DataInteraction(env="qa").redis.hdel(f"runduck:qa:jobs:{JOB_ID}", "history")
+
+    def tearDown(self):
+        app.config.pop("EXECUTION_PAGE_SIZE")
+
+    def ingest(self, rundeck):
+        with patch.object(
+            DataInteraction, "fetch_data", side_effect=rundeck.fetch_data
+        ):
+            return ingest_executions("qa", JOB_ID)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 95) == 95
+        assert percentile([7], 95) == 7
+        assert percentile([], 50) is None
+
+    def test_get_stats(self):
+        executions = [
+            [4, "failed", 0, 1000],
+            [3, "succeeded", 0, 3000],
+            [2, "succeeded", 0, 1000],
+            [1, "aborted", 0, 5000],
+        ]
+        stats = get_stats(executions)
+        assert stats["failure_rate"] == 0.5
+        assert stats["duration_p50"] == 1000
+        assert stats["duration_p95"] == 3000
+        assert stats["last_success_id"] == 3
+
+    def test_ingest_incremental(self):
+        rundeck = FakeRundeck([make_execution(i) for i in range(5, 0, -1)])
+        history = self.ingest(rundeck)
+        assert [execution[0] for execution in history["executions"]] == [5, 4, 3, 2, 1]
+        assert history["last"]["duration"] == "01m 00s"
+        assert rundeck.calls == 3
+
+        # only the new ones are read
+        rundeck.executions = [
+            make_execution(7, status="running"),
+            make_execution(6, status="failed"),
+        ] + rundeck.executions
+        rundeck.calls = 0
+        history = self.ingest(rundeck)
+        assert rundeck.calls == 2
+        assert history["last"]["id"] == 7
+        assert [execution[0] for execution in history["executions"]][:2] == [6, 5]
+        assert history["stats"]["failure_rate"] == round(1 / 6, 4)
+
+        # the running one is read again when it's done
+        rundeck.executions[0] = make_execution(7, duration=120000)
+        history = self.ingest(rundeck)
+        assert [execution[0] for execution in history["executions"]][:3] == [7, 6, 5]
+        assert history["last"]["status"] == "succeeded"
+
+    def test_history_size(self):
+        app.config["EXECUTION_HISTORY_SIZE"] = 3
+        try:
+            rundeck = FakeRundeck([make_execution(i) for i in range(10, 0, -1)])
+            history = self.ingest(rundeck)
+        finally:
+            app.config.pop("EXECUTION_HISTORY_SIZE")
+        assert [execution[0] for execution in history["executions"]] == [10, 9, 8]
+
+    def test_ingest_without_start_date(self):
+        execution = make_execution(1)
+        del execution["date-started"]
+        history = self.ingest(FakeRundeck([execution]))
+        assert history["last"]["id"] == 1
+        assert "duration" not in history["last"]
+
+    def test_get_execution_summary(self):
+        summary = get_execution_summary(
+            "qa", JOB_ID, live_data_source=DataSource.FILE_SYSTEM
+        )
+        assert summary["duration"] == "07m 12s"
+        assert summary["stats"]["count"] == 1
+        # served from the cache
+        with patch.object(DataInteraction, "fetch_data") as fetch_data:
+            cached = get_execution_summary("qa", JOB_ID)
+            assert not fetch_data.called
+        assert cached == summary
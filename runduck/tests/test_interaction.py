@@ -8,6 +8,9 @@ from runduck import app
 from runduck.datainteraction import DataSource
 from runduck.datainteraction import DataInteraction
 from runduck.datainteraction import get_now_str
+from runduck.datainteraction import get_session
+from runduck.datainteraction import get_redis_pool_stats
+from runduck.datainteraction import RundeckConnectionError
 
 
 class DataInteractionTestCase(unittest.TestCase):
@@ -45,15 +48,77 @@ class DataInteractionTestCase(unittest.TestCase):
         )
         assert data
 
+    def test_iter_data_definitions(self):
+        job_id = "a694aa5e-360c-4559-bcdf-1a97afb2cac1"
+        exported = list(
+            self.interaction.iter_data(
+                "project.definitions", project="App-Integrations"
+            )
+        )
+        assert exported == self.interaction.get_filesystem(
+            "job.definition", jobid=job_id
+        )
+
     def test_redis_save(self):
         data = self.interaction.get_filesystem("projects")
         self.interaction.set_redis("projects", data)
 
+    def test_get_many(self):
+        job_id = "a694aa5e-360c-4559-bcdf-1a97afb2cac1"
+        data = self.interaction.get_filesystem("job.metadata", jobid=job_id)
+        self.interaction.set_many("job.metadata", [data], [{"jobid": job_id}])
+        values = self.interaction.get_many(
+            "job.metadata", [{"jobid": job_id}, {"jobid": "missing"}]
+        )
+        assert values == [data, None]
+
+    def test_set_many_skips_none(self):
+        """Values that were not available are not cached as hits"""
+        key, field = self.interaction.get_redis_location(
+            "job.metadata", jobid="not-available"
+        )
+        self.interaction.redis.hdel(key, field)
+        self.interaction.set_many("job.metadata", [None], [{"jobid": "not-available"}])
+        assert not self.interaction.redis.hexists(key, field)
+
     def test_api(self):
         projects = self.interaction.get_api("projects")
         print(projects)
         assert projects
 
+    def test_api_unreachable(self):
+        app.config["ENV"]["unreachable"] = {
+            "base_url": "http://127.0.0.1:9/rundeck",
+            "authtoken": "",
+            "http_retries": 0,
+        }
+        try:
+            interaction = DataInteraction(env="unreachable")
+            with pytest.raises(RundeckConnectionError):
+                interaction.get_api("projects")
+        finally:
+            app.config["ENV"].pop("unreachable")
+
+    def test_get_session(self):
+        assert get_session("qa") is get_session("qa")
+
+    def test_shared_redis_pool(self):
+        other = DataInteraction(live_data_source=DataSource.FILE_SYSTEM)
+        assert other.pool is self.interaction.pool
+
+    def test_get_redis_pool_stats(self):
+        self.interaction.get_redis("projects")
+        stats = get_redis_pool_stats()
+        assert stats["in_use"] + stats["idle"] == stats["created"]
+        assert stats["idle"] >= 1
+
+        connection = self.interaction.pool.get_connection("GET")
+        try:
+            assert get_redis_pool_stats()["in_use"] == stats["in_use"] + 1
+        finally:
+            self.interaction.pool.release(connection)
+        assert get_redis_pool_stats()["in_use"] == stats["in_use"]
+
     def test_clear_redis(self):
         data = self.interaction.get_filesystem("projects")
         self.interaction.set_redis("projects", data)
@@ -0,0 +1,85 @@
+"""Test the invalidation of the local caches
+python -m pytest runduck/tests/test_invalidation.py -v -s
+"""
+import time
+import unittest
+from runduck import app
+from runduck import localcache
+from runduck.datainteraction import DataInteraction
+from runduck.invalidation import start_listener
+from runduck.invalidation import stop_listener
+from runduck.jobinfo import save_combined
+from runduck.jobtable import job_table_cache
+from runduck.responsecache import CachedResponse
+from runduck.responsecache import response_cache
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+class InvalidationTestCase(unittest.TestCase):
+    """Tests for invalidation module"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        app.config.from_pyfile("../app.cfg")
+        self.rows = [
+            {
+                "id": f"qa.{index}",
+                "env": "qa",
+                "project_name": "project",
+                "name": f"job {index}",
+                "sortkey": f"project job {index}",
+            }
+            for index in range(3)
+        ]
+
+    def tearDown(self):
+        stop_listener()
+        app.config.pop("META_CHECK_INTERVAL", None)
+
+    def test_listener(self):
+        save_combined(self.rows, [[row["id"], ""] for row in self.rows])
+        listener = start_listener()
+        assert listener.connected.wait(5)
+        version = DataInteraction().get_redis("combined.meta")["version"]
+        assert localcache.get_combined_version() == version
+
+        assert len(job_table_cache.get()) == 3
+        response_cache.set((version, ()), CachedResponse(b"{}", "a"))
+
+        save_combined(self.rows[:2], [[row["id"], ""] for row in self.rows[:2]])
+        assert wait_for(lambda: localcache.get_combined_version() != version)
+        # objects of the old version are dropped, not only replaced on next use
+        assert job_table_cache.value is None
+        assert response_cache.get((version, ())) is None
+        assert len(job_table_cache.get()) == 2
+
+    def test_disconnected(self):
+        save_combined(self.rows, [[row["id"], ""] for row in self.rows])
+        listener = start_listener()
+        assert listener.connected.wait(5)
+        stop_listener()
+        # the version is read from redis again
+        assert localcache._known_meta is None
+        version = DataInteraction().get_redis("combined.meta")["version"]
+        assert localcache.get_combined_version() == version
+
+    def test_unpublished_change(self):
+        save_combined(self.rows, [[row["id"], ""] for row in self.rows])
+        app.config["META_CHECK_INTERVAL"] = 0.1
+        listener = start_listener()
+        assert listener.connected.wait(5)
+        version = localcache.get_combined_version()
+
+        # saved without publishing it, it's read by the listener
+        DataInteraction().set_redis("combined.meta", {"version": "unpublished"})
+        assert wait_for(lambda: localcache.get_combined_version() == "unpublished")
+        assert localcache.get_combined_version() != version
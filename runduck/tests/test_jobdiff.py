@@ -0,0 +1,159 @@
+"""Test the differences between environments
+python -m pytest runduck/tests/test_jobdiff.py -v -s
+"""
+import copy
+import unittest
+from unittest.mock import patch
+from runduck import app
+from runduck.datainteraction import DataInteraction
+from runduck.jobdiff import build_diffs
+from runduck.jobdiff import delete_diffs
+from runduck.jobdiff import diff_jobs
+from runduck.jobdiff import get_definitions
+from runduck.jobdiff import get_job_diff
+from runduck.jobdiff import normalize_job
+from runduck.jobdiff import save_diffs
+from runduck.jobdiff import update_diffs
+
+
+def make_definition(job_id):
+    return {
+        "id": job_id,
+        "name": "daily run",
+        "group": "daily runs",
+        "scheduleEnabled": True,
+        "executionEnabled": True,
+        "schedule": {"month": "*", "time": {"hour": "18", "minute": "05"}},
+        "options": [
+            {"name": "date", "value": "today"},
+            {"name": "mode", "value": "full", "required": True},
+        ],
+        "sequence": {
+            "keepgoing": False,
+            "strategy": "node-first",
+            "commands": [
+                {"description": "run", "exec": "python -m daily_run"},
+                {"script": "echo start\necho done\n"},
+            ],
+        },
+        "nodefilters": {"filter": "name: web.*"},
+    }
+
+
+class JobDiffTestCase(unittest.TestCase):
+    """Tests for jobdiff module"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        app.config.from_pyfile("../app.cfg")
+        self.parent = make_definition("a")
+        self.job = make_definition("b")
+
+    def test_normalize(self):
+        self.job["options"].reverse()
+        self.job["sequence"]["commands"][1]["script"] = "echo start  \r\necho done"
+        self.job["id"] = "other"
+        assert normalize_job(self.parent) == normalize_job(self.job)
+
+    def test_diff_jobs(self):
+        self.job["schedule"]["time"]["hour"] = "19"
+        self.job["options"][1]["value"] = "partial"
+        self.job["options"].append({"name": "debug", "value": "1"})
+        del self.job["sequence"]["commands"][1]
+        self.job["executionEnabled"] = False
+
+        differences = diff_jobs(normalize_job(self.parent), normalize_job(self.job))
+        assert [(item["path"], item["change"]) for item in differences] == [
+            ("schedule.time.hour", "changed"),
+            ("options.debug", "added"),
+            ("options.mode.value", "changed"),
+            ("workflow.commands[1]", "removed"),
+            ("enabled.executionEnabled", "changed"),
+        ]
+        assert differences[0]["parent"] == "18"
+        assert differences[0]["job"] == "19"
+        assert diff_jobs(normalize_job(self.parent), normalize_job(self.parent)) == []
+
+    def test_build_diffs(self):
+        changed = copy.deepcopy(self.job)
+        changed["nodefilters"]["filter"] = "name: db.*"
+        rows = [
+            {"id": "prod.a", "env": "prod", "parentId": None},
+            {"id": "qa.b", "env": "qa", "parentId": "prod.a"},
+            {"id": "test.c", "env": "test", "parentId": "prod.a"},
+            {"id": "test.d", "env": "test", "parentId": "prod.a"},
+        ]
+        raw_data = {
+            "prod": [{"name": "p", "jobs": [self.parent]}],
+            "qa": [{"name": "p", "jobs": [self.job]}],
+            "test": [{"name": "p", "jobs": [dict(changed, id="c"), {"id": "d"}]}],
+        }
+        diffs = build_diffs(rows, get_definitions(raw_data))
+        assert diffs["qa.b"]["identical"] is True
+        assert diffs["qa.b"]["hash"] == diffs["prod.a"]["hash"]
+        assert diffs["test.c"]["identical"] is False
+        assert [item["path"] for item in diffs["test.c"]["differences"]] == [
+            "nodefilters.filter"
+        ]
+        # without definition
+        assert diffs["test.d"]["identical"] is None
+        assert diffs["prod.a"]["identical"] is None
+        assert diffs["prod.a"]["children"] == [
+            {"id": "qa.b", "identical": True, "differences": 0},
+            {"id": "test.c", "identical": False, "differences": 1},
+            {"id": "test.d", "identical": None, "differences": 0},
+        ]
+
+    def test_update_diffs(self):
+        rows = [
+            {"id": "prod.a", "env": "prod", "parentId": None},
+            {"id": "qa.b", "env": "qa", "parentId": "prod.a"},
+        ]
+        DataInteraction(env="prod").set_redis(
+            "job.definition", [self.parent], jobid="a"
+        )
+        DataInteraction(env="qa").set_redis("job.definition", [self.job], jobid="b")
+        update_diffs(rows, ["qa.b"])
+        assert get_job_diff("qa", "b")["identical"] is True
+
+        self.job["options"].pop()
+        DataInteraction(env="qa").set_redis("job.definition", [self.job], jobid="b")
+        update_diffs(rows, ["qa.b"])
+        assert get_job_diff("qa", "b")["identical"] is False
+        assert get_job_diff("prod", "a")["children"][0]["differences"] == 1
+
+        # same hash and parent as the saved diff
+        with patch("runduck.jobdiff.build_diffs") as build:
+            update_diffs(rows, ["qa.b", "prod.a"])
+        build.assert_not_called()
+
+        # linked to another job, both parents are saved again
+        rows.append({"id": "prod.c", "env": "prod", "parentId": None})
+        rows[1]["parentId"] = "prod.c"
+        update_diffs(rows, ["qa.b"])
+        assert get_job_diff("prod", "a")["children"] == []
+        assert get_job_diff("prod", "c")["children"][0]["id"] == "qa.b"
+
+    def test_delete_diffs(self):
+        rows = [{"id": "qa.b", "env": "qa", "parentId": None}]
+        save_diffs(build_diffs(rows, {"qa.b": self.job}))
+        assert get_job_diff("qa", "b") is not None
+        delete_diffs(rows)
+        assert get_job_diff("qa", "b") is None
+
+    def test_api(self):
+        diffs = build_diffs(
+            [
+                {"id": "prod.a", "env": "prod", "parentId": None},
+                {"id": "qa.b", "env": "qa", "parentId": "prod.a"},
+            ],
+            {"prod.a": self.parent, "qa.b": self.job},
+        )
+        save_diffs(diffs)
+        response = self.app.get("/api/job/qa/b/diff")
+        assert response.status_code == 200
+        assert response.get_json()["identical"] is True
+
+        response = self.app.get("/api/job/qa/missing/diff")
+        assert response.status_code == 404
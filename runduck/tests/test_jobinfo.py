@@ -1,7 +1,12 @@
 """Test the JobInfo class
 python -m pytest -v -s
 """
+import random
+import threading
+import time
 import unittest
+from datetime import datetime
+from unittest.mock import patch
 import pytest
 from runduck import app
 from runduck.datainteraction import DataSource
@@ -10,8 +15,26 @@ from runduck.jobinfo import read_all_environments
 from runduck.jobinfo import combine_data
 from runduck.jobinfo import append_info
 from runduck.jobinfo import find_job
+from runduck.jobinfo import JobIndex
+from runduck.jobinfo import build_combined
+from runduck.jobinfo import get_job_info_list
+from runduck.jobinfo import hash_job
+from runduck.jobinfo import link_jobs
+from runduck.jobinfo import save_combined
+from runduck.jobinfo import update_combined
+from runduck.jobinfo import link_jobs as real_link_jobs
+from runduck.combinelock import CombineLockedError
+from runduck.combinelock import get_combine_lock
+from runduck.combinetask import CombineProgress
+from runduck.jobinfo import get_jobs
+from runduck.jobinfo import get_first_next_execution
+from runduck.datainteraction import DataInteraction
+from runduck.jobinfo import get_max_workers
+from runduck.jobinfo import fetch_definitions
+from runduck.datainteraction import RundeckApiError
 from runduck.jobinfo import get_job_details
-from runduck.jobinfo import get_last_execution
+from runduck.jobinfo import refresh_job_details
+from runduck.jobdiff import get_job_diff
 
 
 class JobInfoTestCase(unittest.TestCase):
@@ -26,6 +49,107 @@ class JobInfoTestCase(unittest.TestCase):
         data = read_environment(live_data_source=DataSource.FILE_SYSTEM)
         assert data
 
+    def test_read_environment_concurrent(self):
+        sequential = read_environment(
+            live_data_source=DataSource.FILE_SYSTEM, force_refresh=True
+        )
+        app.config["MAX_WORKERS"] = 4
+        try:
+            concurrent = read_environment(
+                live_data_source=DataSource.FILE_SYSTEM, force_refresh=True
+            )
+        finally:
+            app.config.pop("MAX_WORKERS")
+        assert concurrent == sequential
+
+    def test_read_environment_cache_only(self):
+        refreshed = read_environment(
+            live_data_source=DataSource.FILE_SYSTEM, force_refresh=True
+        )
+        cached = read_environment(
+            live_data_source=DataSource.FILE_SYSTEM, cache_only=True
+        )
+        assert cached == refreshed
+
+    def test_read_environment_delta(self):
+        refreshed = read_environment(
+            live_data_source=DataSource.FILE_SYSTEM, force_refresh=True
+        )
+        job_id = refreshed[0]["jobs"][0]["id"]
+        interaction = DataInteraction(env="qa")
+        interaction.redis.hset("runduck:qa:jobs:deleted", "metadata", "{}")
+        read_environment(live_data_source=DataSource.FILE_SYSTEM, delta=True)
+        assert interaction.get_redis("job.fingerprint", jobid=job_id)
+        assert not interaction.redis.exists("runduck:qa:jobs:deleted")
+
+        # same fingerprint, the cached definition is kept
+        definition = interaction.get_redis("job.definition", jobid=job_id)
+        definition[0]["description"] = "cached"
+        interaction.set_redis("job.definition", definition, jobid=job_id)
+        delta = read_environment(live_data_source=DataSource.FILE_SYSTEM, delta=True)
+        assert delta[0]["jobs"][0]["description"] == "cached"
+
+        # different fingerprint, the definition is read again
+        interaction.set_redis("job.fingerprint", "changed", jobid=job_id)
+        delta = read_environment(live_data_source=DataSource.FILE_SYSTEM, delta=True)
+        assert delta == refreshed
+
+    def test_read_environment_bulk_definitions(self):
+        app.config["BULK_DEFINITIONS_MIN"] = 0
+        try:
+            one_by_one = read_environment(
+                live_data_source=DataSource.FILE_SYSTEM, force_refresh=True
+            )
+            app.config["BULK_DEFINITIONS_MIN"] = 1
+            bulk = read_environment(
+                live_data_source=DataSource.FILE_SYSTEM, force_refresh=True
+            )
+        finally:
+            app.config.pop("BULK_DEFINITIONS_MIN")
+        assert bulk == one_by_one
+
+    def test_fetch_definitions_deleted(self):
+        """A job missing from the export that was deleted is None"""
+        interaction = DataInteraction(env="qa")
+        definition = [{"id": "a", "name": "job a"}]
+
+        def fetch_data(data_key, jobid):
+            if jobid == "deleted":
+                raise RundeckApiError("Not found", status_code=404)
+            return definition
+
+        app.config["BULK_DEFINITIONS_MIN"] = 1
+        try:
+            with patch.object(interaction, "iter_data", return_value=[]):
+                with patch.object(interaction, "fetch_data", side_effect=fetch_data):
+                    definitions = fetch_definitions(
+                        interaction, "project", [{"jobid": "a"}, {"jobid": "deleted"}]
+                    )
+        finally:
+            app.config.pop("BULK_DEFINITIONS_MIN")
+        assert definitions == [definition, None]
+
+    def test_fetch_definitions_small_delta(self):
+        """A few changed jobs of a large project are read one by one"""
+        interaction = DataInteraction(env="qa")
+        job_args = [{"jobid": str(index)} for index in range(10)]
+        with patch.object(interaction, "iter_data", return_value=[]) as iter_data:
+            with patch.object(interaction, "fetch_data", return_value=[{}]):
+                fetch_definitions(interaction, "project", job_args, project_size=1000)
+                assert not iter_data.called
+                # most of the project changed
+                fetch_definitions(interaction, "project", job_args, project_size=20)
+                assert iter_data.called
+
+    def test_get_max_workers(self):
+        env = next(iter(app.config["ENV"]))
+        assert get_max_workers(env) == 1
+        app.config["MAX_WORKERS"] = 8
+        try:
+            assert get_max_workers(env) == 8
+        finally:
+            app.config.pop("MAX_WORKERS")
+
     def test_read_environment(self):
         env = "test"
         data = read_environment(
@@ -40,6 +164,29 @@ class JobInfoTestCase(unittest.TestCase):
         env = next(iter(app.config["ENV"]))
         assert data[env]
 
+    def test_read_all_environments_failure(self):
+        """An environment that can't be read doesn't stop the others"""
+        environments = app.config["ENV"]
+        app.config["ENV"] = {"missing": {}, "qa": {}}
+        try:
+            data = read_all_environments(
+                live_data_source=DataSource.FILE_SYSTEM, force_refresh=True
+            )
+        finally:
+            app.config["ENV"] = environments
+        assert list(data) == ["qa"]
+        assert data["qa"]
+
+    def test_get_first_next_execution(self):
+        rows = [
+            {"next_execution": "2020-04-20T10:30:00"},
+            {"next_execution": None},
+            {"next_execution": "2020-04-19T22:05:00"},
+            {},
+        ]
+        assert get_first_next_execution(rows) == datetime(2020, 4, 19, 22, 5)
+        assert get_first_next_execution([{"next_execution": None}]) is None
+
     def test_combine_data(self):
         data = combine_data()
 
@@ -109,10 +256,234 @@ class JobInfoTestCase(unittest.TestCase):
         )
         print(job_details)
 
-    def test_get_last_execution(self):
-        job_id = "a694aa5e-360c-4559-bcdf-1a97afb2cac1"
-        env = "qa"
-        result = get_last_execution(
-            env=env, job_id=job_id, live_data_source=DataSource.FILE_SYSTEM
+
+def synthetic_raw_data(environments, jobs_per_env=2000, seed=1):
+    """Environments with jobs that share uuids or names between them"""
+    rand = random.Random(seed)
+    raw_data = {}
+    for env in environments:
+        projects = [
+            {"name": f"project{index}", "description": ""} for index in range(5)
+        ]
+        for project in projects:
+            project["jobs"] = []
+        for index in range(jobs_per_env):
+            project = rand.choice(projects)
+            project["jobs"].append(
+                {
+                    "id": f"{env}-{index}",
+                    "uuid": f"uuid{rand.randrange(jobs_per_env)}",
+                    "group": f"group{rand.randrange(10)}",
+                    "name": f"job{rand.randrange(jobs_per_env // 2)}",
+                }
+            )
+        raw_data[env] = projects
+    return raw_data
+
+
+class CombineTestCase(unittest.TestCase):
+    """Tests for combining the data of all environments"""
+
+    def setUp(self):
+        app.config.from_pyfile("../app.cfg")
+        self.environments = app.config["ENV"]
+        app.config["ENV"] = {env: {} for env in ("prod", "stag", "qa", "test")}
+
+    def tearDown(self):
+        app.config["ENV"] = self.environments
+
+    def test_job_index(self):
+        jobs = [
+            {"uuid": "a", "project_name": "p", "group": "g", "name": "one", "id": 1},
+            {"uuid": "b", "project_name": "p", "group": "g", "name": "two", "id": 2},
+        ]
+        job_index = JobIndex(jobs)
+        # matches the second by uuid and the first by name, first one wins
+        job = {"uuid": "b", "project_name": "p", "group": "g", "name": "one"}
+        assert job_index.find(job)["id"] == 1
+        assert find_job(jobs, job)["id"] == 1
+        job = {"uuid": "c", "project_name": "p", "group": "", "name": "one"}
+        assert job_index.find(job) is None
+        # jobs without a definition are not linked by uuid
+        jobs = [
+            {"uuid": None, "project_name": "p", "group": "g", "name": "one", "id": 1},
+            {"uuid": None, "project_name": "p", "group": "g", "name": "two", "id": 2},
+        ]
+        job_index = JobIndex(jobs)
+        job = {"uuid": None, "project_name": "p", "group": "g", "name": "three"}
+        assert job_index.find(job) is None
+        assert find_job(jobs, job) is None
+
+    def test_build_combined_same_as_find_job(self):
+        """Indexed matching links the same parents as find_job"""
+        raw_data = synthetic_raw_data(app.config["ENV"])
+        combined = build_combined(raw_data)
+
+        expected = {}
+        all_jobs = []
+        for env in raw_data:
+            for project in raw_data[env]:
+                for job in project["jobs"]:
+                    job_info = {
+                        "uuid": job["uuid"],
+                        "project_name": project["name"],
+                        "group": job["group"],
+                        "name": job["name"],
+                        "id": f"{env}.{job['id']}",
+                    }
+                    parent_job = find_job(all_jobs, job_info)
+                    expected[job_info["id"]] = parent_job["id"] if parent_job else None
+                    all_jobs.append(job_info)
+
+        assert len(combined) == len(expected)
+        assert {job["id"]: job["parentId"] for job in combined} == expected
+
+    def test_update_combined(self):
+        raw_data = synthetic_raw_data(app.config["ENV"], jobs_per_env=50)
+        jobs = get_job_info_list(raw_data)
+        order = [[job["id"], hash_job(job)] for job in jobs]
+        save_combined(link_jobs(jobs), order)
+
+        prod_job = raw_data["prod"][0]["jobs"][0]
+        test_job = raw_data["test"][0]["jobs"][0]
+        # unchanged job
+        assert not update_combined([("prod", prod_job["id"], dict(prod_job))])
+
+        # renamed so that it matches the prod job
+        renamed = dict(
+            test_job, uuid="new", name=prod_job["name"], group=prod_job["group"]
         )
-        assert result.get("duration")
+        raw_data["test"][0]["jobs"][0] = renamed
+        assert update_combined([("test", test_job["id"], renamed)])
+
+        # deleted
+        deleted = raw_data["stag"][1]["jobs"].pop(0)
+        assert update_combined([("stag", deleted["id"], None)])
+
+        combined = DataInteraction().get_redis("combined")
+        rows = {row["id"]: row for row in combined}
+        assert f"stag.{deleted['id']}" not in rows
+        assert rows[f"test.{test_job['id']}"]["name"] == prod_job["name"]
+        # same result as combining everything again
+        expected = build_combined(raw_data)
+        assert [(row["id"], row["parentId"]) for row in combined] == [
+            (row["id"], row["parentId"]) for row in expected
+        ]
+
+    def test_update_combined_overlapping(self):
+        raw_data = synthetic_raw_data(app.config["ENV"], jobs_per_env=50)
+        jobs = get_job_info_list(raw_data)
+        order = [[job["id"], hash_job(job)] for job in jobs]
+        save_combined(link_jobs(jobs), order)
+
+        test_job = raw_data["test"][0]["jobs"][0]
+        renamed = dict(test_job, uuid="new", name="renamed")
+        deleted = raw_data["stag"][1]["jobs"][0]
+
+        def slow_link_jobs(rows):
+            # both updates read the combined data before either saves it
+            time.sleep(0.2)
+            return real_link_jobs(rows)
+
+        with patch("runduck.jobinfo.link_jobs", slow_link_jobs):
+            threads = [
+                threading.Thread(
+                    target=update_combined, args=([("test", test_job["id"], renamed)],)
+                ),
+                threading.Thread(
+                    target=update_combined, args=([("stag", deleted["id"], None)],)
+                ),
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        rows = {row["id"]: row for row in DataInteraction().get_redis("combined")}
+        assert rows[f"test.{test_job['id']}"]["name"] == "renamed"
+        assert f"stag.{deleted['id']}" not in rows
+
+        # waits for a running combine, up to COMBINE_WAIT_TIMEOUT
+        lock = get_combine_lock()
+        lock.acquire()
+        app.config["COMBINE_WAIT_TIMEOUT"] = 0.1
+        try:
+            with pytest.raises(CombineLockedError):
+                update_combined([("test", test_job["id"], test_job)])
+        finally:
+            lock.release()
+            del app.config["COMBINE_WAIT_TIMEOUT"]
+
+    def test_refresh_job_details_locked(self):
+        """Forced refreshes return the details while a combine is running"""
+        job_id = "a694aa5e-360c-4559-bcdf-1a97afb2cac1"
+        lock = get_combine_lock()
+        lock.acquire()
+        app.config["COMBINE_WAIT_TIMEOUT"] = 0.1
+        try:
+            job = refresh_job_details(
+                "qa", job_id, live_data_source=DataSource.FILE_SYSTEM
+            )
+        finally:
+            lock.release()
+            del app.config["COMBINE_WAIT_TIMEOUT"]
+        assert job["id"] == job_id
+
+    def test_combine_data_failed_environment(self):
+        raw_data = synthetic_raw_data(app.config["ENV"], jobs_per_env=50)
+        jobs = get_job_info_list(raw_data)
+        order = [[job["id"], hash_job(job)] for job in jobs]
+        save_combined(link_jobs(jobs), order)
+
+        # stag can't be read, its jobs are kept
+        read = {env: projects for env, projects in raw_data.items() if env != "stag"}
+        progress = CombineProgress("test", list(app.config["ENV"]))
+        progress.environment_failed("stag", "unreachable")
+        with patch("runduck.jobinfo.read_all_environments", return_value=read):
+            combine_data(progress=progress)
+
+        combined = DataInteraction().get_redis("combined")
+        expected = build_combined(raw_data)
+        assert [(row["id"], row["parentId"]) for row in combined] == [
+            (row["id"], row["parentId"]) for row in expected
+        ]
+        status = progress.get_status()
+        assert status["environments"]["stag"]["state"] == "failed"
+        assert status["environments"]["stag"]["jobs_kept"] == 50
+        assert status["errors"] == ["[stag] unreachable"]
+
+    def test_combine_data_removed_diffs(self):
+        """Diffs of jobs that are not combined anymore are deleted"""
+        raw_data = synthetic_raw_data(app.config["ENV"], jobs_per_env=50)
+        with patch("runduck.jobinfo.read_all_environments", return_value=raw_data):
+            combine_data()
+        deleted = raw_data["stag"][1]["jobs"].pop(0)
+        assert get_job_diff("stag", deleted["id"]) is not None
+        with patch("runduck.jobinfo.read_all_environments", return_value=raw_data):
+            combine_data()
+        assert get_job_diff("stag", deleted["id"]) is None
+
+    def test_get_jobs_filtered(self):
+        raw_data = synthetic_raw_data(app.config["ENV"], jobs_per_env=50)
+        jobs = get_job_info_list(raw_data)
+        order = [[job["id"], hash_job(job)] for job in jobs]
+        all_jobs = link_jobs(jobs)
+        save_combined(all_jobs, order)
+        all_jobs.sort(key=lambda row: (row["sortkey"], row["id"]))
+
+        expected = [row["id"] for row in all_jobs if row["env"] == "qa"]
+        data = get_jobs(env="qa")
+        assert [row["id"] for row in data["data"]] == expected
+        assert data["total"] == len(expected)
+
+        data = get_jobs(env="qa", offset=10, limit=5)
+        assert [row["id"] for row in data["data"]] == expected[10:15]
+
+        # the cursor continues where the last page ended
+        data = get_jobs(env="qa", limit=5, cursor=data["next_cursor"])
+        assert [row["id"] for row in data["data"]] == expected[15:20]
+
+        parent = next(row for row in all_jobs if row["parentId"])["parentId"]
+        data = get_jobs(parent=parent)
+        assert data["data"]
+        assert all(row["parentId"] == parent for row in data["data"])
@@ -0,0 +1,79 @@
+"""Test the in memory job indexes
+python -m pytest runduck/tests/test_jobquery.py -v -s
+"""
+import base64
+import unittest
+import pytest
+from runduck.jobquery import JobQuery
+from runduck.jobquery import tokenize
+
+
+class JobQueryTestCase(unittest.TestCase):
+    """Tests for jobquery module"""
+
+    def setUp(self):
+        self.rows = [
+            {
+                "id": f"{env}.{index}",
+                "env": env,
+                "project_name": f"project{index % 3}",
+                "group": f"group{index % 2}",
+                "name": f"daily_run {index}",
+                "description": "Load sales" if index % 4 == 0 else "",
+                "scheduleEnabled": index % 5 != 0,
+                "executionEnabled": True,
+                "parentId": None if env == "prod" else f"prod.{index}",
+                "sortkey": f"project{index % 3} group{index % 2} {index:03d} {env}",
+            }
+            for env in ("prod", "qa")
+            for index in range(40)
+        ]
+        self.job_query = JobQuery(self.rows, version="1")
+        self.sorted_ids = [
+            row["id"]
+            for row in sorted(self.rows, key=lambda row: (row["sortkey"], row["id"]))
+        ]
+
+    def find(self, **filters):
+        ids, _ = self.job_query.page(self.job_query.search(**filters))
+        return ids
+
+    def test_tokenize(self):
+        assert tokenize("Daily_Run 2") == ["daily", "run", "2"]
+        assert tokenize(None) == []
+
+    def test_no_filters(self):
+        assert self.find() == self.sorted_ids
+
+    def test_filters(self):
+        expected = [
+            row_id
+            for row_id in self.sorted_ids
+            if row_id.startswith("qa.") and int(row_id.split(".")[1]) % 3 == 1
+        ]
+        assert self.find(env="qa", project="project1") == expected
+        assert len(self.find(enabled=False)) == 16
+        assert self.find(parent="prod.7") == ["qa.7"]
+
+    def test_search(self):
+        assert len(self.find(q="sales")) == 20
+        # prefix of a word
+        assert len(self.find(q="sal dai")) == 20
+        assert self.find(q="missing") == []
+
+    def test_page(self):
+        positions = self.job_query.search(env="prod")
+        ids, cursor = self.job_query.page(positions, limit=15)
+        assert len(ids) == 15
+        more, cursor = self.job_query.page(positions, limit=15, cursor=cursor)
+        rest, cursor = self.job_query.page(positions, limit=15, cursor=cursor)
+        assert ids + more + rest == self.find(env="prod")
+        assert cursor is None
+
+    def test_invalid_cursor(self):
+        with pytest.raises(ValueError):
+            self.job_query.page([], cursor="not a cursor")
+        # a list of two values that are not strings
+        cursor = base64.urlsafe_b64encode(b"[1, 2]").decode("ascii")
+        with pytest.raises(ValueError):
+            self.job_query.page([], cursor=cursor)
@@ -0,0 +1,71 @@
+"""Test the compact job table
+python -m pytest runduck/tests/test_jobtable.py -v -s
+"""
+import sys
+import unittest
+from runduck.jobtable import JobRecord
+from runduck.jobtable import JobTable
+
+
+class JobTableTestCase(unittest.TestCase):
+    """Tests for jobtable module"""
+
+    def setUp(self):
+        self.rows = [
+            {
+                "uuid": f"uuid{index}",
+                "group": f"group{index % 2}",
+                "name": f"daily_run {index}",
+                "scheduleEnabled": True,
+                "executionEnabled": index % 3 != 0,
+                "description": "",
+                "permalink": f"http://{env}/job/{index}",
+                # new strings, like the ones decoded from the cache
+                "project_name": "".join(["project", f"{index % 3}"]),
+                "project_description": "".join(["Project ", f"{index % 3}"]),
+                "env": "".join([env[:1], env[1:]]),
+                "env_order": 0 if env == "prod" else 1,
+                "id": f"{env}.{index}",
+                "cron": "0 0 1 ? * * *",
+                "parentId": None if env == "prod" else f"prod.{index}",
+                "sortkey": f"project{index % 3} group{index % 2} {index:03d} {env}",
+            }
+            for env in ("prod", "qa")
+            for index in range(10)
+        ]
+        self.rows[0]["schedule_description"] = "At 01:00 AM"
+
+    def test_same_rows(self):
+        table = JobTable(self.rows, version="1")
+        assert len(table) == len(self.rows)
+        assert table.get_rows() == self.rows
+        # fields that were not set are not added
+        assert "schedule_description" not in table.get_rows()[1]
+
+    def test_get_rows_by_id(self):
+        table = JobTable(self.rows, version="1")
+        rows = table.get_rows(["qa.3", "missing", "prod.1"])
+        assert [row["id"] for row in rows] == ["qa.3", "prod.1"]
+        assert table.get("qa.3").name == "daily_run 3"
+        assert table.get("missing") is None
+
+    def test_rows_are_copies(self):
+        table = JobTable(self.rows, version="1")
+        row = table.get_rows(["prod.0"])[0]
+        row["next_execution"] = "2020-01-01T00:00:00"
+        row["name"] = "changed"
+        assert table.get_rows(["prod.0"])[0] == self.rows[0]
+
+    def test_strings_are_shared(self):
+        table = JobTable(self.rows, version="1")
+        assert self.rows[0]["env"] is not self.rows[1]["env"]
+        assert table.records[0].env is table.records[1].env
+        assert table.records[0].project_name is table.records[3].project_name
+        assert table.records[0].cron is sys.intern("0 0 1 ? * * *")
+
+    def test_extra_fields(self):
+        row = dict(self.rows[0], next_execution="2020-01-01T00:00:00")
+        record = JobRecord(row)
+        assert record.extra == {"next_execution": "2020-01-01T00:00:00"}
+        assert record.to_dict() == row
+        assert JobRecord(self.rows[1]).extra is None
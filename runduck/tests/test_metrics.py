@@ -0,0 +1,74 @@
+"""Test the metrics
+python -m pytest runduck/tests/test_metrics.py -v -s
+"""
+import unittest
+from runduck import app
+from runduck import metrics
+from runduck.datainteraction import DataSource
+from runduck.datainteraction import DataInteraction
+
+
+class MetricsTestCase(unittest.TestCase):
+    """Tests for metrics module"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        app.config.from_pyfile("../app.cfg")
+        # test metrics are not served at /metrics
+        self.registry = []
+
+    def test_histogram(self):
+        histogram = metrics.Histogram(
+            "test_seconds", "Test", ("name",), buckets=(0.1, 1), registry=self.registry
+        )
+        histogram.observe(0.1, name="a")
+        histogram.observe(0.5, name="a")
+        histogram.observe(2, name="a")
+        lines = histogram.render()
+        assert 'test_seconds_bucket{name="a",le="0.1"} 1' in lines
+        assert 'test_seconds_bucket{name="a",le="1"} 2' in lines
+        assert 'test_seconds_bucket{name="a",le="+Inf"} 3' in lines
+        assert 'test_seconds_sum{name="a"} 2.6' in lines
+        assert 'test_seconds_count{name="a"} 3' in lines
+        with self.assertRaises(ValueError):
+            histogram.observe(1, other="a")
+
+    def test_counter(self):
+        counter = metrics.Counter(
+            "test_total", "Test", ("name",), registry=self.registry
+        )
+        counter.inc(name='say "hi"')
+        counter.inc(2, name='say "hi"')
+        assert counter.render()[-1] == 'test_total{name="say \\"hi\\""} 3'
+        assert metrics.render(self.registry).startswith("# HELP test_total Test")
+        assert "test_total" not in metrics.render()
+
+    def test_redis_metrics(self):
+        interaction = DataInteraction(live_data_source=DataSource.FILE_SYSTEM)
+        labels = {"data_key": "projects", "operation": "get"}
+        hits = metrics.redis_requests.get(result="hit", **labels)
+        misses = metrics.redis_requests.get(
+            data_key="job.metadata", operation="get", result="miss"
+        )
+        interaction.set_redis("projects", interaction.get_filesystem("projects"))
+        interaction.get_redis("projects")
+        interaction.get_many("projects", [{}])
+        interaction.get_many("job.metadata", [{"jobid": "missing"}])
+        assert metrics.redis_requests.get(result="hit", **labels) == hits + 2
+        assert (
+            metrics.redis_requests.get(
+                data_key="job.metadata", operation="get", result="miss"
+            )
+            == misses + 1
+        )
+        assert metrics.redis_bytes.get(**labels) > 0
+
+    def test_metrics_route(self):
+        self.app.get("/api/redis/pool")
+        response = self.app.get("/metrics")
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        text = response.get_data(as_text=True)
+        assert "# TYPE runduck_http_request_seconds histogram" in text
+        assert 'route="/api/redis/pool"' in text
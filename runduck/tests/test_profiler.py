@@ -0,0 +1,60 @@
+"""Test the request profiling
+python -m pytest runduck/tests/test_profiler.py -v -s
+"""
+import shutil
+import tempfile
+import unittest
+from runduck import app
+from runduck import profiler
+
+
+class ProfilerTestCase(unittest.TestCase):
+    """Tests for profiler module"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        app.config.from_pyfile("../app.cfg")
+        self.profile_dir = tempfile.mkdtemp()
+        app.config["PROFILING_ENABLED"] = True
+        app.config["PROFILING_DIR"] = self.profile_dir
+
+    def tearDown(self):
+        for name in ("PROFILING_ENABLED", "PROFILING_DIR", "PROFILING_MAX_FILES"):
+            app.config.pop(name, None)
+        shutil.rmtree(self.profile_dir)
+
+    def test_profile_request(self):
+        assert "X-Runduck-Profile-Id" not in self.app.get("/api/redis/pool").headers
+
+        response = self.app.get("/api/redis/pool", headers={"X-Runduck-Profile": "1"})
+        assert response.status_code == 200
+        profile_id = response.headers["X-Runduck-Profile-Id"]
+
+        profiles = self.app.get("/api/profiles").get_json()["data"]
+        assert profiles[0]["id"] == profile_id
+        assert profiles[0]["path"] == "/api/redis/pool"
+
+        response = self.app.get(f"/api/profiles/{profile_id}?top=5&sort=tottime")
+        functions = response.get_json()["functions"]
+        assert 0 < len(functions) <= 5
+        assert functions[0]["total_time"] >= functions[-1]["total_time"]
+
+    def test_ring_buffer(self):
+        app.config["PROFILING_MAX_FILES"] = 2
+        profile_ids = [
+            self.app.get("/api/redis/pool?profile=true").headers["X-Runduck-Profile-Id"]
+            for _ in range(3)
+        ]
+        assert profiler.list_profile_ids() == profile_ids[1:]
+        response = self.app.get(f"/api/profiles/{profile_ids[0]}")
+        assert response.status_code == 404
+
+    def test_disabled(self):
+        app.config["PROFILING_ENABLED"] = False
+        response = self.app.get("/api/redis/pool?profile=true")
+        assert "X-Runduck-Profile-Id" not in response.headers
+        assert self.app.get("/api/profiles").status_code == 404
+
+    def test_invalid_id(self):
+        assert self.app.get("/api/profiles/..%2Fapp").status_code == 404
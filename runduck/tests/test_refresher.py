@@ -0,0 +1,90 @@
+"""Test the background refresh
+python -m pytest runduck/tests/test_refresher.py -v -s
+"""
+import time
+import unittest
+import pytest
+from runduck import app
+from runduck.combinelock import CombineLockedError
+from runduck.combinelock import get_combine_lock
+from runduck.datainteraction import DataSource
+from runduck.datainteraction import DataInteraction
+from runduck.refresher import TokenBucket
+from runduck.refresher import EnvironmentRefresher
+
+JOB_ID = "a694aa5e-360c-4559-bcdf-1a97afb2cac1"
+
+
+class RefresherTestCase(unittest.TestCase):
+    """Tests for refresher module"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        app.config.from_pyfile("../app.cfg")
+        self.refresher = EnvironmentRefresher("qa", DataSource.FILE_SYSTEM)
+        self.refresher.redis.delete(self.refresher.refresh_key)
+        self.refresher.redis.delete(self.refresher.lists_key)
+
+    def tearDown(self):
+        for name in ("REFRESH_JOB_TTL", "REFRESH_LIST_TTL", "COMBINE_WAIT_TIMEOUT"):
+            app.config.pop(name, None)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=20, capacity=2)
+        start = time.monotonic()
+        for _ in range(4):
+            bucket.acquire()
+        # 2 tokens right away, the other 2 at 20 per second
+        assert time.monotonic() - start >= 0.09
+
+    def test_refresh_lists(self):
+        assert self.refresher.refresh_lists()
+        assert (
+            self.refresher.redis.zscore(self.refresher.refresh_key, JOB_ID) is not None
+        )
+        # not again until the ttl has passed
+        assert not self.refresher.refresh_lists()
+        assert not self.refresher.refresh_lists(force=True)
+
+    def test_refresh_batch(self):
+        self.refresher.refresh_lists()
+        app.config["REFRESH_JOB_TTL"] = 3600
+        self.refresher.redis.zadd(self.refresher.refresh_key, {JOB_ID: time.time()})
+        assert self.refresher.refresh_batch() == 0
+
+        self.refresher.redis.zadd(self.refresher.refresh_key, {JOB_ID: 0})
+        assert self.refresher.refresh_batch() == 1
+        assert self.refresher.redis.zscore(self.refresher.refresh_key, JOB_ID) > 0
+        metadata = DataInteraction(env="qa").get_redis("job.metadata", jobid=JOB_ID)
+        assert metadata["id"] == JOB_ID
+
+    def test_refresh_batch_locked(self):
+        self.refresher.refresh_lists()
+        app.config["REFRESH_JOB_TTL"] = 3600
+        app.config["COMBINE_WAIT_TIMEOUT"] = 0.1
+        self.refresher.redis.zadd(self.refresher.refresh_key, {JOB_ID: 0})
+        lock = get_combine_lock()
+        lock.acquire()
+        try:
+            with pytest.raises(CombineLockedError):
+                self.refresher.refresh_batch()
+        finally:
+            lock.release()
+        # read again next time
+        assert self.refresher.redis.zscore(self.refresher.refresh_key, JOB_ID) == 0
+        assert self.refresher.refresh_batch() == 1
+
+    def test_refresh_uncached_jobs(self):
+        self.refresher.refresh_lists()
+        app.config["COMBINE_WAIT_TIMEOUT"] = 0.1
+        self.refresher.redis.zadd(self.refresher.refresh_key, {JOB_ID: 0})
+        assert JOB_ID in self.refresher.uncached_job_ids()
+        # new jobs are not in the combined data, the lock is not needed
+        lock = get_combine_lock()
+        lock.acquire()
+        try:
+            self.refresher.refresh_jobs([JOB_ID], update=False)
+        finally:
+            lock.release()
+        assert JOB_ID not in self.refresher.uncached_job_ids()
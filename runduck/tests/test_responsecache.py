@@ -0,0 +1,55 @@
+"""Test the response cache
+python -m pytest runduck/tests/test_responsecache.py -v -s
+"""
+import gzip
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from runduck import app
+from runduck.responsecache import CachedResponse
+from runduck.responsecache import ResponseCache
+from runduck.responsecache import response_cache
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """Tests for responsecache module"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        app.config.from_pyfile("../app.cfg")
+
+    def test_expired(self):
+        cache = ResponseCache()
+        cache.set("old", CachedResponse(b"{}", "a", expires=datetime.now()))
+        cache.set(
+            "new",
+            CachedResponse(b"{}", "b", expires=datetime.now() + timedelta(hours=1)),
+        )
+        assert cache.get("old") is None
+        assert cache.get("new").etag == "b"
+
+    def test_max_entries(self):
+        cache = ResponseCache(max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.set(key, CachedResponse(b"{}", key))
+        assert cache.get("a") is None
+        assert cache.get("c").etag == "c"
+
+    def test_conditional_get(self):
+        response_cache.clear()
+        response = self.app.get("/api/jobs?limit=5")
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        response = self.app.get("/api/jobs?limit=5", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert not response.data
+
+    def test_gzip(self):
+        response = self.app.get("/api/jobs?limit=5")
+        compressed = self.app.get(
+            "/api/jobs?limit=5", headers={"Accept-Encoding": "gzip"}
+        )
+        assert compressed.headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(compressed.data) == response.data
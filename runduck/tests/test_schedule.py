@@ -0,0 +1,122 @@
+"""Test the schedule calculations
+python -m pytest runduck/tests/test_schedule.py -v -s
+"""
+import unittest
+import pytest
+from datetime import datetime
+from datetime import timedelta
+from runduck.schedule import ScheduleCache
+from runduck.schedule import InvalidCronError
+from runduck.schedule import parse_cron
+from runduck.schedule import ScheduleIndex
+from runduck.utils import get_next_execution
+
+
+class ScheduleTestCase(unittest.TestCase):
+    """Tests for schedule module"""
+
+    def setUp(self):
+        self.schedule_cache = ScheduleCache()
+        self.crons = [
+            "05 18 * * *",
+            "*/5 * * * *",
+            "0 9-23,0-2 * * *",
+            "30 6 1 * *",
+            "0 7 * * MON-FRI",
+            "0 12 * * 1#2",
+            "15 10 10,20 * 5",
+        ]
+
+    def test_same_as_croniter(self):
+        now_date = datetime(2020, 4, 19, 22, 5)
+        for minutes in range(0, 60 * 24 * 3, 37):
+            current = now_date + timedelta(minutes=minutes)
+            for cron in self.crons:
+                assert self.schedule_cache.get_next_execution(
+                    cron, current
+                ) == get_next_execution(cron, current)
+
+    def test_parse_once(self):
+        parse_cron.cache_clear()
+        now_date = datetime(2020, 4, 19, 22, 5)
+        for minutes in range(100):
+            self.schedule_cache.get_next_execution(
+                "*/5 * * * *", now_date + timedelta(minutes=minutes)
+            )
+        assert parse_cron.cache_info().misses == 1
+
+    def test_invalid_cron(self):
+        with pytest.raises(Exception):
+            self.schedule_cache.get_next_execution("not a cron")
+        with pytest.raises(InvalidCronError):
+            self.schedule_cache.get_next_execution("not a cron")
+
+    def test_empty_cron(self):
+        assert self.schedule_cache.get_next_execution("") is None
+
+
+class ScheduleIndexTestCase(unittest.TestCase):
+    """Tests for the upcoming executions"""
+
+    def setUp(self):
+        self.rows = [
+            {
+                "id": f"{env}.{index}",
+                "env": env,
+                "project_name": "project",
+                "group": "",
+                "name": f"job {index}",
+                "cron": cron,
+                "scheduleEnabled": True,
+                "executionEnabled": index != 3,
+            }
+            for env in ("prod", "qa")
+            for index, cron in enumerate(
+                ["*/15 * * * *", "05 18 * * *", "0 9-23,0-2 * * *", "0 * * * *"]
+            )
+        ]
+        self.now_date = datetime.now().replace(second=0, microsecond=0)
+
+    def expected(self, from_date, to_date, env=None):
+        """Expand every cron, like the index should do"""
+        executions = []
+        for row in self.rows:
+            if not row["executionEnabled"] or (env and row["env"] != env):
+                continue
+            fire_time = from_date - timedelta(seconds=1)
+            while True:
+                fire_time = datetime.strptime(
+                    get_next_execution(row["cron"], fire_time), "%Y-%m-%dT%H:%M:%S"
+                )
+                if fire_time > to_date:
+                    break
+                executions.append((fire_time, row["id"]))
+        return sorted(executions)
+
+    def test_get_executions(self):
+        schedule_index = ScheduleIndex(self.rows, now_date=self.now_date)
+        from_date = self.now_date + timedelta(hours=1)
+        for hours in (1, 24, 3, 48):
+            to_date = from_date + timedelta(hours=hours)
+            executions = schedule_index.get_executions(from_date, to_date)
+            assert [
+                (fire_time, job["id"]) for fire_time, job in executions
+            ] == self.expected(from_date, to_date)
+
+    def test_get_executions_env_limit(self):
+        schedule_index = ScheduleIndex(self.rows, now_date=self.now_date)
+        from_date = self.now_date + timedelta(minutes=1)
+        to_date = from_date + timedelta(hours=24)
+        executions = schedule_index.get_executions(
+            from_date, to_date, env="qa", limit=10
+        )
+        assert [(fire_time, job["id"]) for fire_time, job in executions] == (
+            self.expected(from_date, to_date, env="qa")[:10]
+        )
+
+    def test_advance(self):
+        schedule_index = ScheduleIndex(
+            self.rows, now_date=self.now_date - timedelta(hours=5)
+        )
+        schedule_index.advance(self.now_date)
+        assert all(next_date > self.now_date for next_date, _ in schedule_index.heap)
@@ -0,0 +1,110 @@
+"""Test the full text search
+python -m pytest runduck/tests/test_searchindex.py -v -s
+"""
+import unittest
+from runduck import app
+from runduck.datainteraction import DataInteraction
+from runduck.jobinfo import save_combined
+from runduck.searchindex import SearchIndex
+from runduck.searchindex import build_documents
+from runduck.searchindex import index_document
+from runduck.searchindex import load_documents
+from runduck.searchindex import save_documents
+from runduck.searchindex import update_documents
+
+
+def make_definition(job_id, name, command, option_value="daily"):
+    return {
+        "id": job_id,
+        "name": name,
+        "group": "loads",
+        "description": "",
+        "options": [{"name": "mode", "value": option_value}],
+        "sequence": {"commands": [{"exec": command}]},
+    }
+
+
+class SearchIndexTestCase(unittest.TestCase):
+    """Tests for searchindex module"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        app.config.from_pyfile("../app.cfg")
+        self.definitions = {
+            "qa.a": make_definition("a", "load sales", "python -m sales --host db01"),
+            "qa.b": make_definition("b", "load stock", "python -m stock --host db02"),
+            "prod.c": make_definition("c", "cleanup", "rm -rf /tmp/sales"),
+        }
+
+    def search(self, q):
+        index = SearchIndex(build_documents(self.definitions))
+        return index.search(q)
+
+    def test_index_document(self):
+        document = index_document(self.definitions["qa.a"])
+        # name has weight 3, workflow 1, field bits by position in FIELDS
+        assert document["terms"]["sales"] == [4, 0b10001]
+        assert document["terms"]["db01"] == [1, 0b10000]
+        assert document["terms"]["daily"] == [1, 0b1000]
+
+    def test_search(self):
+        # words in the name rank higher
+        hits = self.search("sales")
+        assert [hit[0] for hit in hits] == ["qa.a", "prod.c"]
+        assert hits[0][2] == ["name", "workflow"]
+        assert hits[1][2] == ["workflow"]
+
+        # all the words, prefix match
+        assert [hit[0] for hit in self.search("host db0")] == ["qa.a", "qa.b"]
+        assert [hit[0] for hit in self.search("python db02")] == ["qa.b"]
+        assert self.search("sales db02") == []
+        assert self.search("") == []
+
+    def test_update_documents(self):
+        save_documents(build_documents(self.definitions))
+        changed = make_definition("b", "load stock", "python -m stock --host db03")
+        DataInteraction(env="qa").set_redis("job.definition", [changed], jobid="b")
+        rows = [{"id": "qa.b", "env": "qa"}]
+        version = DataInteraction().get_redis("search.meta")["version"]
+        assert update_documents(rows, removed_ids=["prod.c"])
+        meta = DataInteraction().get_redis("search.meta")
+        assert meta["version"] != version
+        assert meta["count"] == 2
+        assert not update_documents(rows)
+        assert DataInteraction().get_redis("search.meta")["version"] == meta["version"]
+
+        documents = load_documents()
+        assert sorted(documents) == ["qa.a", "qa.b"]
+        index = SearchIndex(documents)
+        assert [hit[0] for hit in index.search("db03")] == ["qa.b"]
+        assert index.search("cleanup") == []
+
+    def test_api(self):
+        rows = [
+            {
+                "id": row_id,
+                "env": row_id.split(".")[0],
+                "project_name": "project",
+                "group": definition["group"],
+                "name": definition["name"],
+                "sortkey": f"project {definition['name']}",
+            }
+            for row_id, definition in self.definitions.items()
+        ]
+        save_documents(build_documents(self.definitions))
+        save_combined(rows, [[row["id"], ""] for row in rows])
+
+        response = self.app.get("/api/search?q=sales")
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["total"] == 2
+        assert [row["id"] for row in data["data"]] == ["qa.a", "prod.c"]
+        assert data["data"][0]["matches"] == ["name", "workflow"]
+        assert data["data"][0]["project_name"] == "project"
+
+        response = self.app.get("/api/search?q=sales&env=prod")
+        assert [row["id"] for row in response.get_json()["data"]] == ["prod.c"]
+
+        response = self.app.get("/api/search")
+        assert response.status_code == 400
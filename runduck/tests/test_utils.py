@@ -1,9 +1,9 @@
 """Test helper functions
-python -m pytest runduck/tests/test_utils.py -v -s --disable-warnings -k test_get_elapsed_time
+python -m pytest runduck/tests/test_utils.py -v -s --disable-warnings
 """
 import unittest
 import pytest
-from runduck.utils import get_elapsed_time
+from runduck.utils import format_duration
 from runduck.utils import get_object_property
 from runduck.utils import convert_hour_range
 
@@ -11,17 +11,9 @@ from runduck.utils import convert_hour_range
 class UtilsTestCase(unittest.TestCase):
     """Tests for  module"""
 
-    def test_get_elapsed_time(self):
-        start_date = "2020-04-19T22:05:00Z"
-        end_date = "2020-04-19T22:12:12Z"
-        elapsed = get_elapsed_time(start_date, end_date)
-        assert elapsed == "07m 12s"
-
-    def test_get_elapsed_time_hours(self):
-        start_date = "2020-04-19T22:05:00Z"
-        end_date = "2020-04-19T23:12:12Z"
-        elapsed = get_elapsed_time(start_date, end_date)
-        assert elapsed == "1h 07m 12s"
+    def test_format_duration(self):
+        assert format_duration(432509) == "07m 12s"
+        assert format_duration(4032000) == "1h 07m 12s"
 
     def test_get_object_property(self):
         obj = {
@@ -0,0 +1,77 @@
+"""Test the yaml parser
+python -m pytest runduck/tests/test_yamlparser.py -v -s
+"""
+import io
+import os
+import timeit
+import unittest
+import pytest
+import yaml
+from runduck import yamlparser
+from runduck.yamlparser import iter_yaml_sequence
+
+SAMPLE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "sampledata",
+    "qa.job.a694aa5e-360c-4559-bcdf-1a97afb2cac1.definition.yaml",
+)
+
+
+def get_sample_definitions(count):
+    """Export of a project with count copies of the sample definition"""
+    with open(SAMPLE_PATH, "r") as file_obj:
+        definition = file_obj.read()
+    return "".join(
+        definition.replace("a694aa5e", f"{index:08x}") for index in range(count)
+    )
+
+
+class YamlParserTestCase(unittest.TestCase):
+    """Tests for yamlparser module"""
+
+    def test_load(self):
+        text = get_sample_definitions(3)
+        assert yamlparser.load(text) == yaml.safe_load(text)
+
+    def test_iter_yaml_sequence(self):
+        text = get_sample_definitions(3)
+        items = list(iter_yaml_sequence(io.StringIO(text)))
+        assert items == yaml.safe_load(text)
+        assert list(iter_yaml_sequence(text, loader_class=yaml.SafeLoader)) == items
+
+    def test_iter_yaml_sequence_documents(self):
+        text = "- id: a\n  options: &opts {x: 1}\n- id: b\n  options: *opts\n"
+        items = iter_yaml_sequence(text)
+        assert next(items) == {"id": "a", "options": {"x": 1}}
+        assert next(items) == {"id": "b", "options": {"x": 1}}
+        assert list(items) == []
+        assert list(iter_yaml_sequence("")) == []
+        assert list(iter_yaml_sequence("[]")) == []
+        # one job per document
+        assert list(iter_yaml_sequence("id: a\n---\nid: b\n")) == [
+            {"id": "a"},
+            {"id": "b"},
+        ]
+        with self.assertRaises(yaml.YAMLError):
+            list(iter_yaml_sequence("- id: a\n id: b"))
+
+    @pytest.mark.skip
+    def test_benchmark(self):
+        """Compare the python and libyaml loaders on the sample definitions
+        uncomment skip annotation and run with:
+        python -m pytest runduck/tests/test_yamlparser.py -v -s -k benchmark
+        """
+        text = get_sample_definitions(300)
+        print(f"\n{len(text) / 1024:.0f}KB, libyaml: {yaml.__with_libyaml__}")
+        variants = [
+            ("safe_load", lambda: yaml.safe_load(text)),
+            ("load", lambda: yamlparser.load(text)),
+            (
+                "stream python",
+                lambda: list(iter_yaml_sequence(text, loader_class=yaml.SafeLoader)),
+            ),
+            ("stream", lambda: list(iter_yaml_sequence(text))),
+        ]
+        for name, parse in variants:
+            parse_time = timeit.timeit(parse, number=5) / 5
+            print(f"{name:>15}: {parse_time * 1000:8.1f}ms")
@@ -1,6 +1,5 @@
 """General helper functions"""
 import re
-import dateutil.parser
 import croniter
 from datetime import datetime
 from cron_descriptor import get_description
@@ -22,29 +21,13 @@ def get_object_property(obj, property_list, default=None):
     return obj
 
 
-def get_elapsed_time(start_date, end_date):
-    """Format elapsed time between start date and end date
-    
-    :param start_date: Start date
-    :type start_date: string
-    :param end_date: End Date
-    :type end_date: string
-    """
-    start = dateutil.parser.parse(start_date)
-    end = dateutil.parser.parse(end_date)
-    elapsed = str(end - start)
-
-    # try to get pieces to format for humans
-    matches = re.search("(?P<hours>\d+)(:?)(?P<minutes>\d+):(?P<seconds>\d+)$", elapsed)
-    if not matches:
-        return elapsed
-
-    hms = matches.groupdict()
-    formatted = ""
-    if int(hms["hours"]) > 0:
-        formatted = f"{hms['hours']}h "
-    formatted = f"{formatted}{hms['minutes']}m {hms['seconds']}s"
-    return formatted
+def format_duration(milliseconds):
+    """Format a duration for humans, e.g. 1h 07m 12s"""
+    minutes, seconds = divmod(int(milliseconds // 1000), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours > 0:
+        return f"{hours}h {minutes:02}m {seconds:02}s"
+    return f"{minutes:02}m {seconds:02}s"
 
 
 def convert_hour_range(hour_string):
@@ -0,0 +1,69 @@
+"""Parse yaml with libyaml when PyYAML was built with it
+
+The pure python parser is several times slower on job definitions, it's only
+used when libyaml is not available.
+"""
+import yaml
+from yaml.composer import Composer
+from yaml.constructor import SafeConstructor
+from yaml.resolver import Resolver
+
+try:
+    from yaml.cyaml import CParser
+    from yaml.cyaml import CSafeLoader as SafeLoader
+except ImportError:
+    CParser = None
+    SafeLoader = yaml.SafeLoader
+
+
+if CParser is not None:
+
+    class StreamLoader(CParser, Composer, SafeConstructor, Resolver):
+        """Parse with libyaml and build the nodes in python, so a document can
+        be read one list item at a time (libyaml only composes whole documents)
+        """
+
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+
+
+else:
+    StreamLoader = yaml.SafeLoader
+
+
+def load(stream):
+    """Same as yaml.safe_load"""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def iter_yaml_sequence(stream, loader_class=None):
+    """Parse yaml lists one item at a time, without reading the whole stream
+    into memory first
+    Documents that are not lists are returned as one item, so both a list of
+    jobs and one job per document can be read
+
+    :param stream: file-like object or string
+    :param loader_class: defaults to StreamLoader
+    :return: generator of the parsed items
+    """
+    loader = (loader_class or StreamLoader)(stream)
+    try:
+        loader.get_event()  # stream start
+        while not loader.check_event(yaml.StreamEndEvent):
+            loader.get_event()  # document start
+            if loader.check_event(yaml.SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    yield loader.construct_document(loader.compose_node(None, None))
+                loader.get_event()
+            else:
+                document = loader.construct_document(loader.compose_node(None, None))
+                if document is not None:
+                    yield document
+            loader.get_event()  # document end
+            loader.anchors = {}
+    finally:
+        loader.dispose()
@@ -0,0 +1,8 @@
+"""Start the background refresh of the cached data"""
+import logging
+from runduck import app
+from runduck.refresher import run_forever
+
+if __name__ == "__main__":
+    app.logger.setLevel(logging.INFO)
+    run_forever()